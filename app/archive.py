@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import String, bindparam, delete, func, insert, select, type_coerce, update
+
+from .context_cache import context_cache
+from .db import SessionLocal, read_router
+from .metrics import ARCHIVE_REHYDRATE, ARCHIVE_SESSIONS
+from .models import ChatArchive, ChatMessage, ChatSession
+
+# Cold-session archiving: session ที่ไม่มี message ใหม่เกิน ARCHIVE_AFTER_DAYS
+# ย้าย messages ทั้งหมดไปเป็น blob เดียวใน chat_archives (JSON + zlib) แล้วลบออกจาก chat_messages
+# -> chat_messages / index เหลือแต่ session ที่ยัง active (vacuum / backup / index scan เล็กลง)
+# - archive: claim session (UPDATE ... WHERE archived_at IS NULL AND last_message_at < cutoff)
+#   + insert blob + delete messages ใน transaction เดียว; หลาย worker รันพร้อมกันได้ (claim ได้ตัวเดียว)
+# - rehydrate: ตอน session ถูกเปิดอีกครั้ง (get_messages / export-pdf / chat / regenerate)
+#   insert กลับด้วย id + created_at เดิม (cursor, summary.covered_message_id ยังใช้ได้) แล้วลบ blob
+# - /api/search ค้นเฉพาะ chat_messages: ค้นทุก session -> response บอกจำนวน session ที่ archive อยู่ (ไม่ได้ค้น)
+#   ค้นใน session เดียว -> rehydrate session นั้นก่อน
+# รัน: ปิดไว้เป็น default; ARCHIVE_ENABLED=1 -> ใน worker ทุก ARCHIVE_INTERVAL_SECONDS
+#   หรือจาก cron: python -m app.archive (สั่งเองตรง ๆ ไม่ดู ARCHIVE_ENABLED)
+# rehydrate ทำงานเสมอ (ปิด archiver ทีหลัง session ที่ archive ไว้แล้วยังเปิดได้)
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0").lower() in {"1", "true", "yes"}
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "200"))
+ARCHIVE_ZLIB_LEVEL = int(os.getenv("ARCHIVE_ZLIB_LEVEL", "6"))
+
+
+# created_at อ่าน / เขียนเป็นค่าดิบของ DB (ไม่ผ่าน DateTime type)
+# sqlite: server_default เก็บ "YYYY-MM-DD HH:MM:SS" แต่ SQLAlchemy bind เป็น "...:SS.000000"
+# -> ถ้าแปลงไป-กลับ ลำดับ (created_at, id) กับ message ใหม่ในวินาทีเดียวกันจะสลับ
+_RAW_CREATED_AT = type_coerce(ChatMessage.created_at, String).label("created_at")
+_INSERT_MESSAGE = insert(ChatMessage).values(
+    id=bindparam("m_id"), session_id=bindparam("m_session_id"), role=bindparam("m_role"),
+    content=bindparam("m_content"), created_at=type_coerce(bindparam("m_created_at"), String),
+)
+
+
+def _raw(value):
+    # sqlite คืน text ดิบ; driver ของ postgres แปลงเป็น datetime เองอยู่แล้ว
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_messages(rows) -> tuple[bytes, int]:
+    # rows: (id, role, content, created_at) เรียงตาม (created_at, id) -> (blob, ขนาดก่อนบีบอัด)
+    payload = json.dumps(
+        [[r.id, r.role, r.content, _raw(r.created_at)] for r in rows],
+        ensure_ascii=False, separators=(",", ":"),
+    ).encode()
+    return zlib.compress(payload, ARCHIVE_ZLIB_LEVEL), len(payload)
+
+
+def decode_messages(session_id: int, codec: str, blob: bytes) -> list[dict]:
+    if codec != "zlib":
+        raise ValueError(f"unknown archive codec: {codec}")
+    return [
+        {"m_id": mid, "m_session_id": session_id, "m_role": role, "m_content": content, "m_created_at": at}
+        for mid, role, content, at in json.loads(zlib.decompress(blob))
+    ]
+
+
+class Archiver:
+    def __init__(
+        self,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        interval: float = ARCHIVE_INTERVAL_SECONDS,
+        batch: int = ARCHIVE_BATCH,
+        enabled: bool = ARCHIVE_ENABLED,
+        window: int = 1024,
+    ):
+        self.enabled = enabled
+        self.after_days = after_days
+        self.interval = interval
+        self.batch = batch
+        self._task: asyncio.Task | None = None
+        self._lock = threading.Lock()
+        self._rehydrate_ms: deque = deque(maxlen=window)
+
+        self.archived = 0
+        self.archived_messages = 0
+        self.rehydrated = 0
+        self.failed = 0
+
+    # --- archive ---
+
+    def archive_session(self, session_id: int, cutoff: datetime) -> bool:
+        with SessionLocal() as db:
+            # claim: ถ้ามี message ใหม่เข้ามาระหว่างนี้ last_message_at จะเลย cutoff -> ไม่ได้ claim
+            claimed = db.execute(
+                update(ChatSession)
+                .where(ChatSession.id == session_id, ChatSession.archived_at.is_(None), ChatSession.last_message_at < cutoff)
+                .values(archived_at=func.now())
+            ).rowcount
+            if not claimed:
+                db.rollback()
+                return False
+
+            rows = db.execute(
+                select(ChatMessage.id, ChatMessage.role, ChatMessage.content, _RAW_CREATED_AT)
+                .where(ChatMessage.session_id == session_id)
+                .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+            ).all()
+            if not rows:
+                db.rollback()
+                return False
+
+            blob, raw = encode_messages(rows)
+            db.execute(insert(ChatArchive).values(
+                session_id=session_id, codec="zlib", blob=blob,
+                message_count=len(rows), raw_bytes=raw, stored_bytes=len(blob),
+            ))
+            db.execute(delete(ChatMessage).where(ChatMessage.id.in_([r.id for r in rows])))
+            db.commit()
+
+        context_cache.invalidate(session_id)
+        with self._lock:
+            self.archived += 1
+            self.archived_messages += len(rows)
+        ARCHIVE_SESSIONS.labels("archived").inc()
+        return True
+
+    def archive_idle(self, idle_seconds: float | None = None, limit: int | None = None) -> int:
+        # archive session ที่ idle เกินกำหนด (ทีละ batch จนหมด หรือครบ limit) -> จำนวนที่ archive ได้
+        idle = self.after_days * 86400 if idle_seconds is None else idle_seconds
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=idle)
+        done = 0
+        while limit is None or done < limit:
+            size = self.batch if limit is None else min(self.batch, limit - done)
+            with SessionLocal() as db:
+                ids = db.scalars(
+                    select(ChatSession.id)
+                    .where(ChatSession.archived_at.is_(None), ChatSession.last_message_at < cutoff)
+                    .order_by(ChatSession.last_message_at.asc())
+                    .limit(size)
+                ).all()
+            archived = 0
+            for session_id in ids:
+                try:
+                    archived += self.archive_session(session_id, cutoff)
+                except Exception:
+                    self.failed += 1
+                    logger.exception("archive of session %s failed", session_id)
+            done += archived
+            # batch ไม่เต็ม = หมดแล้ว; archive ไม่ได้สักตัว = ที่เหลือโดน claim / fail (ไม่วนซ้ำ)
+            if len(ids) < size or not archived:
+                break
+        return done
+
+    # --- rehydrate ---
+
+    def rehydrate(self, session_id: int) -> bool:
+        # True = session นี้เพิ่งถูกย้ายกลับ (โดย call นี้หรือ worker อื่นพร้อมกัน) -> อ่านต่อจาก primary
+        t0 = time.perf_counter()
+        with SessionLocal() as db:
+            archive = db.get(ChatArchive, session_id)
+            if archive is None:
+                return False
+            rows = decode_messages(session_id, archive.codec, archive.blob)
+            # ลบ blob ก่อน: worker อื่นที่ rehydrate พร้อมกันจะได้ rowcount 0 (ไม่ insert ซ้ำ)
+            if not db.execute(delete(ChatArchive).where(ChatArchive.session_id == session_id)).rowcount:
+                db.rollback()
+                return True
+            if rows:
+                db.execute(_INSERT_MESSAGE, rows)
+            db.execute(update(ChatSession).where(ChatSession.id == session_id).values(archived_at=None))
+            db.commit()
+
+        read_router.note_write(session_id)
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self.rehydrated += 1
+            self._rehydrate_ms.append(elapsed * 1000)
+        ARCHIVE_SESSIONS.labels("rehydrated").inc()
+        ARCHIVE_REHYDRATE.observe(elapsed)
+        return True
+
+    async def rehydrate_async(self, session_id: int) -> bool:
+        # sync engine ใน thread (เกิดแค่ตอนเปิด session เก่า ไม่ใช่ hot path)
+        return await asyncio.to_thread(self.rehydrate, session_id)
+
+    def archived_count(self, db) -> int:
+        # จำนวน session ที่ archive อยู่ (1 row ต่อ session ใน chat_archives)
+        return db.scalar(select(func.count()).select_from(ChatArchive))
+
+    # --- background ---
+
+    def start(self):
+        if self._task is not None or not self.enabled or self.interval <= 0 or self.after_days <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                n = await asyncio.to_thread(self.archive_idle)
+                if n:
+                    logger.info("archived %d idle sessions", n)
+            except Exception:
+                logger.exception("archive round failed")
+
+    def stats(self) -> dict:
+        with SessionLocal() as db:
+            sessions, messages, raw, stored = db.execute(select(
+                func.count(), func.coalesce(func.sum(ChatArchive.message_count), 0),
+                func.coalesce(func.sum(ChatArchive.raw_bytes), 0), func.coalesce(func.sum(ChatArchive.stored_bytes), 0),
+            )).one()
+        with self._lock:
+            lat = sorted(self._rehydrate_ms)
+
+        def pct(p: float):
+            return round(lat[min(int(len(lat) * p), len(lat) - 1)], 2) if lat else None
+
+        return {
+            "enabled": self.enabled,
+            "after_days": self.after_days,
+            "interval_seconds": self.interval,
+            "running": self._task is not None,
+            "archived_sessions": sessions,
+            "archived_messages": messages,
+            "raw_bytes": raw,
+            "stored_bytes": stored,
+            "saved_bytes": raw - stored,
+            "ratio": round(raw / stored, 2) if stored else None,
+            "process": {
+                "archived": self.archived,
+                "archived_messages": self.archived_messages,
+                "rehydrated": self.rehydrated,
+                "failed": self.failed,
+                "rehydrate_p50_ms": pct(0.5),
+                "rehydrate_p95_ms": pct(0.95),
+                "rehydrate_max_ms": pct(1.0),
+            },
+        }
+
+
+archiver = Archiver()
+
+
+if __name__ == "__main__":
+    # cron: python -m app.archive [--days 30] [--limit N]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=float, default=ARCHIVE_AFTER_DAYS)
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    n = archiver.archive_idle(idle_seconds=args.days * 86400, limit=args.limit)
+    s = archiver.stats()
+    logger.info("archived %d sessions; archive holds %d sessions, %d -> %d bytes",
+                n, s["archived_sessions"], s["raw_bytes"], s["stored_bytes"])
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict, deque
+
+from .context_window import MAX_MESSAGES
+
+# In-memory LRU cache ของ context ล่าสุดต่อ session (ring buffer MAX_MESSAGES messages)
+# - อัปเดตแบบ write-through หลัง commit (ดู hooks ใน app/messages.py)
+# - ลบทิ้งเมื่อมีการลบ message / session
+# หมายเหตุ: cache อยู่ใน process เดียว ถ้ารันหลาย worker และ request ของ session เดียวกัน
+# วิ่งไปคนละ worker ได้ ให้ตั้ง CONTEXT_CACHE_SESSIONS=0 เพื่อปิด
+
+
+class ContextCache:
+    def __init__(self, max_sessions: int = 1024, window: int = 20):
+        self.max_sessions = max_sessions
+        self.window = window
+        self._entries: OrderedDict[int, deque] = OrderedDict()
+        # write generation ต่อ session: กัน loader เอาข้อมูลเก่ามาทับหลังมี write ระหว่างโหลด
+        self._gen: dict[int, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_sessions > 0
+
+    def get(self, session_id: int) -> list[dict] | None:
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(session_id)
+            self.hits += 1
+            return list(entry)
+
+    def token(self, session_id: int) -> tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._gen.get(session_id, 0)
+
+    def fill(self, session_id: int, messages: list[dict], token: tuple[int, int]):
+        if not self.enabled:
+            return
+        with self._lock:
+            if token != (self._epoch, self._gen.get(session_id, 0)):
+                return
+            self._entries[session_id] = deque(messages[-self.window:], maxlen=self.window)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _bump(self, session_id: int):
+        self._gen[session_id] = self._gen.get(session_id, 0) + 1
+        if len(self._gen) > self.max_sessions * 4:
+            self._gen.clear()
+            self._epoch += 1
+
+    def append(self, session_id: int, role: str, content: str):
+        with self._lock:
+            self._bump(session_id)
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                entry.append({"role": role, "content": content})
+
+    def invalidate(self, session_id: int):
+        with self._lock:
+            self._bump(session_id)
+            if self._entries.pop(session_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._gen.clear()
+            self._epoch += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "max_sessions": self.max_sessions,
+            "window": self.window,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+context_cache = ContextCache(
+    max_sessions=int(os.getenv("CONTEXT_CACHE_SESSIONS", "1024")),
+    window=MAX_MESSAGES,
+)
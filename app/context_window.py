@@ -0,0 +1,110 @@
+import functools
+import os
+
+# ประกอบ context ตาม token budget (ใหม่ -> เก่า) แทนการตัด messages[-20:] ตายตัว
+# - token estimator เปลี่ยนได้ (default: heuristic ไม่ต้องต่อเน็ต)
+# - ข้อความเก่าที่ยาวเกินจะถูกตัดให้สั้นลง
+# - จำนวน token ต่อข้อความ cache ไว้ (turn ถัดไปคิดเฉพาะข้อความใหม่)
+
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+MAX_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MAX_MESSAGE_TOKENS", "800"))
+# จำนวน message สูงสุดที่ดึงมาให้ builder เลือก (และขนาด ring buffer ของ context cache)
+MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "40"))
+
+ROLE_OVERHEAD = 4  # "User: " / "Assistant: " + newline
+MIN_PARTIAL_TOKENS = 64
+TRUNCATED_MARK = "\n…(truncated)"
+
+
+def heuristic_tokens(text: str) -> int:
+    # ~4 ตัวอักษร/token สำหรับ ASCII, ตัวอักษรอื่น (ไทย ฯลฯ) ~2 ตัวอักษร/token
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_len = len(text) - non_ascii
+    return (ascii_len + 3) // 4 + (non_ascii + 1) // 2
+
+
+ESTIMATORS = {
+    "heuristic": heuristic_tokens,
+    "chars": len,
+}
+
+_estimator = ESTIMATORS.get(os.getenv("TOKEN_ESTIMATOR", "heuristic"), heuristic_tokens)
+
+
+def set_estimator(fn):
+    global _estimator
+    _estimator = fn
+    count_tokens.cache_clear()
+    truncate_to_tokens.cache_clear()
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    return _estimator(text)
+
+
+def estimate_tokens(text: str) -> int:
+    # ไม่ผ่าน cache: ข้อความที่นับครั้งเดียว (prompt ทั้งก้อน / คำตอบสำหรับ metrics)
+    return _estimator(text)
+
+
+@functools.lru_cache(maxsize=1024)
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # ตัดตามสัดส่วนแล้วค่อยลดทีละนิดจนพอดี budget
+    keep = max(1, int(len(text) * max_tokens / tokens))
+    while keep > 1 and count_tokens(text[:keep]) + count_tokens(TRUNCATED_MARK) > max_tokens:
+        keep = int(keep * 0.9)
+    return text[:keep] + TRUNCATED_MARK
+
+
+def summary_budget(summary: str = "") -> int:
+    # budget ของ messages เมื่อมี summary อยู่ใน prompt ด้วย (summary กิน budget ส่วนหนึ่ง)
+    if not summary:
+        return TOKEN_BUDGET
+    return max(TOKEN_BUDGET - count_tokens(summary), MAX_MESSAGE_TOKENS)
+
+
+def build_context(
+    messages: list[dict],
+    budget: int | None = None,
+    max_message_tokens: int | None = None,
+) -> list[dict]:
+    budget = budget or TOKEN_BUDGET
+    max_message_tokens = max_message_tokens or MAX_MESSAGE_TOKENS
+
+    selected = []
+    used = 0
+    for i, m in enumerate(reversed(messages[-MAX_MESSAGES:])):
+        content = m.get("content", "") or ""
+        cost = count_tokens(content) + ROLE_OVERHEAD
+
+        # ข้อความล่าสุดส่งเต็ม, ข้อความเก่าที่ยาวเกินให้ตัด
+        if i > 0 and cost > max_message_tokens + ROLE_OVERHEAD:
+            content = truncate_to_tokens(content, max_message_tokens)
+            cost = count_tokens(content) + ROLE_OVERHEAD
+
+        if used + cost > budget:
+            remaining = budget - used - ROLE_OVERHEAD
+            if i == 0:
+                content = truncate_to_tokens(content, max(budget - ROLE_OVERHEAD, 1))
+            elif remaining >= MIN_PARTIAL_TOKENS:
+                content = truncate_to_tokens(content, remaining)
+            else:
+                break
+            selected.append({"role": m.get("role", "user"), "content": content})
+            break
+
+        selected.append({"role": m.get("role", "user"), "content": content})
+        used += cost
+
+    selected.reverse()
+    return selected
+
+
+def context_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(m.get("content", "") or "") + ROLE_OVERHEAD for m in messages)
@@ -1,23 +1,292 @@
+import itertools
 import os
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.requests import Request
 
-load_dotenv() 
+from .metrics import DB_POOL_TIMEOUTS, DB_POOL_WAIT, DB_READS, instrument_engine
+
+load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("Missing DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+def _async_url(url: str) -> str:
+    # แปลง sync driver -> async driver (psycopg2 -> asyncpg, sqlite -> aiosqlite)
+    if url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url[len("postgresql+psycopg2://"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+def _url_list(value: str | None) -> list[str]:
+    return [u.strip() for u in (value or "").split(",") if u.strip()]
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+# read replicas (คั่นด้วย comma): endpoint ที่อ่านอย่างเดียวไปที่ replica, เขียนไป primary เสมอ
+# (read endpoints เป็น sync ทั้งหมด -> replica มีแค่ sync engine)
+DATABASE_REPLICA_URLS = _url_list(os.getenv("DATABASE_REPLICA_URLS"))
+# read-your-writes: หลังเขียน อ่านจาก primary ต่ออีก N วินาที (ควร > replication lag)
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))
+STICKY_COOKIE = "db_rw"
+
+# pool ต่อ engine (primary และ replica แต่ละตัวได้ pool ของตัวเอง ต่อ worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# ปิด connection ที่เก่ากว่า N วินาที (-1 = ไม่ปิด); ตั้งไว้ต่ำกว่า idle timeout ของ DB / proxy
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+# pre_ping = SELECT 1 ทุก checkout (+1 round-trip); ปิดได้ถ้าตั้ง recycle ไว้แล้ว
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1").lower() not in {"0", "false", "no"}
+
+
+class _TimedPool:
+    # เวลารอ connection จาก pool (ตอน pool เต็ม) + จำนวน timeout -> /metrics, /api/db
+    # label = pool logging_name (ติดไปกับ pool.recreate() ตอน engine.dispose())
+    def _do_get(self):
+        t0 = time.perf_counter()
+        name = self.logging_name or "default"
+        try:
+            conn = super()._do_get()
+        except PoolTimeout:
+            DB_POOL_TIMEOUTS.labels(name).inc()
+            raise
+        DB_POOL_WAIT.labels(name).observe(time.perf_counter() - t0)
+        return conn
+
+
+class TimedQueuePool(_TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def _pool_kwargs(url: str, name: str, is_async: bool) -> dict:
+    kw = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_logging_name": name}
+    if url.split("?")[0].endswith((":memory:", "://")):
+        # sqlite in-memory ใช้ SingletonThreadPool / StaticPool (ไม่มี size / overflow)
+        return kw
+    return {
+        **kw,
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+def _make_engine(url: str, name: str):
+    engine = create_engine(url, **_pool_kwargs(url, name, is_async=False))
+    instrument_engine(engine, name)
+    return engine
+
+
+def _make_async_engine(url: str, name: str):
+    engine = create_async_engine(url, **_pool_kwargs(url, name, is_async=True))
+    instrument_engine(engine.sync_engine, name)
+    return engine
+
+
+engine = _make_engine(DATABASE_URL, "sync")
+# async engine สำหรับ streaming endpoints (ไม่ block event loop)
+async_engine = _make_async_engine(ASYNC_DATABASE_URL, "async")
+
+replica_engines = [_make_engine(u, f"replica{i}") for i, u in enumerate(DATABASE_REPLICA_URLS)]
+
+
+class RoutingSession(Session):
+    # session ที่เปิดด้วย read_session(): SELECT ไป replica (info["replica"])
+    # flush / INSERT / UPDATE / DELETE / session.connection() ไป primary เสมอ
+    # และหลังเขียนแล้ว ทั้ง session อ่านจาก primary ต่อ (refresh หลัง commit ต้องเห็น row ที่เพิ่งเขียน)
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None:
+            if not self._flushing and getattr(clause, "is_select", False):
+                return replica
+            self.info["replica"] = None
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+
+SessionLocal = sessionmaker(bind=engine, class_=RoutingSession, autoflush=False, autocommit=False)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, class_=AsyncSession, sync_session_class=RoutingSession,
+    autoflush=False, expire_on_commit=False,
+)
 
 Base = declarative_base()
 
+
+class ReadRouter:
+    # เลือก primary / replica ต่อ read request
+    # stickiness (read-your-writes):
+    #   - cookie db_rw: ตั้งหลัง request ที่เขียน (POST / PATCH / DELETE) ใช้ได้ข้าม worker
+    #   - note_write(session_id): commit ของ session นั้นใน process นี้ (write-behind / stream ที่จบทีหลัง)
+    def __init__(self, replicas: int, sticky_seconds: float = DB_REPLICA_STICKY_SECONDS, max_sessions: int = 10000):
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.max_sessions = max_sessions
+        self._writes: OrderedDict[int, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self._rr = itertools.count()
+        self.counts: dict[str, int] = {}
+
+    def note_write(self, session_id: int):
+        if not self.replicas or self.sticky_seconds <= 0:
+            return
+        with self._lock:
+            self._writes[session_id] = time.monotonic()
+            self._writes.move_to_end(session_id)
+            while len(self._writes) > self.max_sessions:
+                self._writes.popitem(last=False)
+
+    def _recently_written(self, session_id: int) -> bool:
+        at = self._writes.get(session_id)
+        return at is not None and time.monotonic() - at < self.sticky_seconds
+
+    def choose(self, session_id: int | None = None, sticky_until: float = 0.0) -> int | None:
+        # คืน index ของ replica หรือ None = primary
+        if not self.replicas:
+            reason = "no_replica"
+        elif sticky_until > time.time():
+            reason = "sticky_client"
+        elif session_id is not None and self._recently_written(session_id):
+            reason = "sticky_session"
+        else:
+            reason = "replica"
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        DB_READS.labels("replica" if reason == "replica" else "primary", reason).inc()
+        if reason != "replica":
+            return None
+        return next(self._rr) % self.replicas
+
+    def sticky_cookie(self) -> str:
+        # ค่า = unix time ที่หมด stickiness (เทียบข้าม worker ได้)
+        until = time.time() + self.sticky_seconds
+        return f"{STICKY_COOKIE}={until:.3f}; Max-Age={max(int(self.sticky_seconds), 1)}; Path=/; HttpOnly; SameSite=Lax"
+
+    def stats(self) -> dict:
+        return {
+            "replicas": self.replicas,
+            "sticky_seconds": self.sticky_seconds,
+            "sticky_sessions": sum(1 for sid in list(self._writes) if self._recently_written(sid)),
+            "reads": dict(self.counts),
+        }
+
+
+read_router = ReadRouter(len(replica_engines))
+
+
+def _sticky_until(request) -> float:
+    try:
+        return float(request.cookies.get(STICKY_COOKIE) or 0)
+    except ValueError:
+        return 0.0
+
+
+def _request_session_id(request) -> int | None:
+    value = request.path_params.get("session_id") or request.query_params.get("session_id")
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def route_read(request: Request) -> int | None:
+    # replica index สำหรับ read request นี้ (None = primary)
+    return read_router.choose(_request_session_id(request), _sticky_until(request))
+
+
+def read_session(replica: int | None = None) -> Session:
+    # replica = index จาก read_router.choose() (None = primary)
+    db = SessionLocal()
+    if replica is not None:
+        db.info["replica"] = replica_engines[replica]
+    return db
+
+
+class StickyWritesMiddleware:
+    # pure ASGI: request ที่อาจเขียน (ไม่ใช่ GET / HEAD / OPTIONS) ตอบ 2xx -> ตั้ง cookie db_rw
+    # client เดิมอ่านจาก primary ต่อจนหมด DB_REPLICA_STICKY_SECONDS
+    SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in self.SAFE_METHODS:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", read_router.sticky_cookie().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def pool_stats() -> dict:
+    engines = {"sync": engine, "async": async_engine.sync_engine}
+    engines.update({f"replica{i}": e for i, e in enumerate(replica_engines)})
+    out = {}
+    for name, e in engines.items():
+        pool = e.pool
+        if not hasattr(pool, "checkedout"):
+            out[name] = {"pool": type(pool).__name__}
+            continue
+        counts, waited = DB_POOL_WAIT.labels(name).snapshot()
+        checkouts = sum(counts)
+        out[name] = {
+            "pool": type(pool).__name__,
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "checkouts": checkouts,
+            "avg_wait_ms": round(waited / checkouts * 1000, 3) if checkouts else 0.0,
+            "timeouts": int(DB_POOL_TIMEOUTS.labels(name).value),
+        }
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pre_ping": DB_POOL_PRE_PING,
+        "engines": out,
+        "routing": read_router.stats(),
+    }
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db(request: Request):
+    # dependency ของ endpoint ที่อ่านอย่างเดียว (ไป replica ถ้ามี และไม่ติด stickiness)
+    db = read_session(route_read(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
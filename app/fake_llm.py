@@ -0,0 +1,129 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+# Local stand-in for genai.GenerativeModel (ใช้ตอน test / benchmark ไม่ต้องต่อเน็ต)
+# เปิดใช้ด้วย GEMINI_FAKE=1
+# จำลอง upstream ที่ไม่นิ่ง (ทดสอบ hedging / retry / fallback):
+#   FAKE_LLM_SLOW_RATE / FAKE_LLM_SLOW_TTFT_MS -> บาง request first token ช้ามาก (shard ช้า)
+#   FAKE_LLM_FAIL_RATE -> บาง request error 503 ก่อน token แรก
+#   FAKE_LLM_SEED -> สุ่มซ้ำได้
+# ขนาด / ความเร็ว: FAKE_LLM_CHUNKS chunk ละ FAKE_LLM_CHUNK_TOKENS คำ ห่างกัน FAKE_LLM_CHUNK_DELAY_MS
+#   (หรือ FAKE_LLM_TOKENS_PER_SEC -> คำนวณ delay จาก token rate)
+
+
+_rng = random.Random(os.getenv("FAKE_LLM_SEED") or None)
+
+
+class FakeUpstreamError(Exception):
+    # หน้าตาเหมือน google.api_core exceptions (มี .code เป็น HTTP status)
+    code = 503
+
+
+def use_fake() -> bool:
+    return os.getenv("GEMINI_FAKE", "").strip().lower() in {"1", "true", "yes"}
+
+
+@dataclass
+class FakeChunk:
+    text: str
+
+
+class FakeGenerativeModel:
+    # stats รวมทุก instance (ใช้ดู concurrency ใน benchmark)
+    in_flight = 0
+    peak_in_flight = 0
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name: str = "fake-model", system_instruction: str | None = None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.ttft = float(os.getenv("FAKE_LLM_TTFT_MS", "200")) / 1000
+        self.chunks = int(os.getenv("FAKE_LLM_CHUNKS", "30"))
+        self.chunk_tokens = max(int(os.getenv("FAKE_LLM_CHUNK_TOKENS", "1")), 1)
+        tps = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "0"))
+        if tps > 0:
+            self.chunk_delay = self.chunk_tokens / tps
+        else:
+            self.chunk_delay = float(os.getenv("FAKE_LLM_CHUNK_DELAY_MS", "20")) / 1000
+        self.slow_rate = float(os.getenv("FAKE_LLM_SLOW_RATE", "0"))
+        self.slow_ttft = float(os.getenv("FAKE_LLM_SLOW_TTFT_MS", "5000")) / 1000
+        self.fail_rate = float(os.getenv("FAKE_LLM_FAIL_RATE", "0"))
+
+    @classmethod
+    def reset_stats(cls):
+        with cls._lock:
+            cls.in_flight = 0
+            cls.peak_in_flight = 0
+            cls.calls = 0
+
+    @classmethod
+    def _enter(cls):
+        with cls._lock:
+            cls.in_flight += 1
+            cls.calls += 1
+            cls.peak_in_flight = max(cls.peak_in_flight, cls.in_flight)
+
+    @classmethod
+    def _exit(cls):
+        with cls._lock:
+            cls.in_flight -= 1
+
+    def _pieces(self, prompt: str) -> list[str]:
+        n = self.chunk_tokens
+        return ["".join(f"token{i * n + j} " for j in range(n)) for i in range(self.chunks)]
+
+    def _first_delay(self) -> float:
+        # สุ่มต่อ request: error / shard ช้า / ปกติ
+        roll = _rng.random()
+        if roll < self.fail_rate:
+            raise FakeUpstreamError(f"{self.model_name}: 503 upstream unavailable")
+        if roll < self.fail_rate + self.slow_rate:
+            return self.slow_ttft
+        return self.ttft
+
+    # ----- sync (เหมือน model.generate_content) -----
+    def generate_content(self, prompt: str, stream: bool = False, request_options=None):
+        if stream:
+            return self._stream(prompt)
+        self._enter()
+        try:
+            time.sleep(self._first_delay() + self.chunk_delay * self.chunks)
+            return FakeChunk("".join(self._pieces(prompt)))
+        finally:
+            self._exit()
+
+    def _stream(self, prompt: str):
+        self._enter()
+        try:
+            time.sleep(self._first_delay())
+            for piece in self._pieces(prompt):
+                yield FakeChunk(piece)
+                time.sleep(self.chunk_delay)
+        finally:
+            self._exit()
+
+    # ----- async (เหมือน model.generate_content_async) -----
+    async def generate_content_async(self, prompt: str, stream: bool = False, request_options=None):
+        if stream:
+            return self._astream(prompt)
+        self._enter()
+        try:
+            await asyncio.sleep(self._first_delay() + self.chunk_delay * self.chunks)
+            return FakeChunk("".join(self._pieces(prompt)))
+        finally:
+            self._exit()
+
+    async def _astream(self, prompt: str):
+        self._enter()
+        try:
+            await asyncio.sleep(self._first_delay())
+            for piece in self._pieces(prompt):
+                yield FakeChunk(piece)
+                await asyncio.sleep(self.chunk_delay)
+        finally:
+            self._exit()
@@ -1,5 +1,13 @@
 import os
-import google.generativeai as genai
+
+from .fake_llm import FakeGenerativeModel, use_fake
+from .model_pool import ModelPool
+from .context_window import build_context, summary_budget
+from .metrics import llm_call
+from .llm_router import llm_router
+
+# primary model (fallback / hedge / retry ตั้งค่าใน llm_router)
+MODEL_NAME = os.getenv("LLM_MODEL", "gemini-2.5-flash")
 
 SYSTEM_INSTRUCTION = """
 You are a helpful study assistant chatbot.
@@ -7,6 +15,12 @@ You explain clearly, step-by-step when needed, and provide short examples.
 If the user asks for code, provide Python code with comments.
 """
 
+SUMMARY_INSTRUCTION = """
+You maintain a running summary of a study chat between a student and an assistant.
+Keep the topics covered, key explanations, definitions, code decisions and open questions.
+Be concise (at most ~200 words). Plain text, no headings.
+"""
+
 LEVEL_INSTRUCTION = {
     "beginner": """
 Explain concepts simply.
@@ -25,81 +39,148 @@ Focus on edge cases, performance, and best practices.
 """
 }
 
-def chat_reply(messages: list[dict], level: str = "beginner") -> str:
+def _genai():
+    # import SDK ตอนใช้จริงครั้งแรก (~1s: protobuf / grpc types) ไม่ใช่ตอน import app.main
+    # -> worker boot เร็วขึ้น, GEMINI_FAKE=1 ไม่ต้อง import เลย
+    import google.generativeai as genai
+    return genai
+
+def _configure():
+    # configure ครั้งเดียวต่อ process (configure ซ้ำจะทิ้ง client/connection เดิม)
+    if use_fake():
+        return
     api_key = os.getenv("GEMINI_API_KEY")
     if not api_key:
-        raise RuntimeError("Missing GEMINI_API_KEY in environment")
+        raise RuntimeError("Missing GEMINI_API_KEY")
+    _genai().configure(api_key=api_key)
+
+def _build_model(model_name: str, system_instruction: str | None):
+    if use_fake():
+        return FakeGenerativeModel(model_name, system_instruction=system_instruction)
+    return _genai().GenerativeModel(model_name, system_instruction=system_instruction)
+
+def _stream_instruction(level: str) -> str:
+    return (
+        SYSTEM_INSTRUCTION
+        + "\n\nAudience instruction:\n"
+        + LEVEL_INSTRUCTION.get(level, LEVEL_INSTRUCTION["beginner"])
+        + "\n\nIMPORTANT: Always respond in GitHub-flavored Markdown."
+    )
 
-    genai.configure(api_key=api_key)
+# system instruction ต่อ level คำนวณครั้งเดียว
+STREAM_INSTRUCTIONS = {lvl: _stream_instruction(lvl) for lvl in LEVEL_INSTRUCTION}
 
-    # ใช้โมเดลที่เหมาะกับแชท
-    model = genai.GenerativeModel("gemini-2.5-flash", system_instruction=SYSTEM_INSTRUCTION)
+def _level_label(level: str) -> str:
+    # level มาจาก client ตรง ๆ -> จำกัดค่าที่ใช้เป็น metric label
+    return level if level in LEVEL_INSTRUCTION else "other"
 
-    # แปลง messages เป็นข้อความเดียว (MVP ง่ายสุด)
-    # messages: [{role:"user"/"assistant", content:"..."}]
-    transcript = []
-    transcript.append(f"(Audience level: {level})")
-    for m in messages[-20:]:  # จำกัด context กันยาวเกิน
+model_pool = ModelPool(_build_model, configure=_configure)
+
+# get_model(name) ต่อ profile: llm_router เลือกชื่อ model (primary / fallback) เอง
+def _chat_model(name: str = MODEL_NAME):
+    return model_pool.get(name, "chat", SYSTEM_INSTRUCTION)
+
+def _title_model(name: str = MODEL_NAME):
+    return model_pool.get(name, "title")
+
+def _summary_model(name: str = MODEL_NAME):
+    return model_pool.get(name, "summary", SUMMARY_INSTRUCTION)
+
+def _stream_model(level: str, name: str = MODEL_NAME):
+    if level not in STREAM_INSTRUCTIONS:
+        level = "beginner"
+    return model_pool.get(name, level, STREAM_INSTRUCTIONS[level])
+
+def warm_models():
+    # สร้าง model ทุก profile ตอน startup (ถ้าไม่มี key ก็ข้ามไป แล้วไป error ตอนใช้งานจริง)
+    try:
+        _chat_model()
+        _title_model()
+        _summary_model()
+        for lvl in STREAM_INSTRUCTIONS:
+            _stream_model(lvl)
+    except RuntimeError:
+        pass
+
+def _build_prompt(messages: list[dict], level: str, summary: str = "") -> str:
+    transcript = [f"(Audience level: {level})"]
+    if summary:
+        transcript.append(f"Summary of earlier conversation:\n{summary}")
+    budget = summary_budget(summary)
+
+    # เลือกข้อความตาม token budget (ใหม่ -> เก่า) แทน messages[-20:]
+    for m in build_context(messages, budget=budget):
         role = m.get("role", "user")
         content = m.get("content", "")
         if role == "user":
             transcript.append(f"User: {content}")
         else:
             transcript.append(f"Assistant: {content}")
+    return "\n".join(transcript) + "\nAssistant:"
 
-    prompt = "\n".join(transcript) + "\nAssistant:"
-    resp = model.generate_content(prompt)
-    return (resp.text or "").strip()
-
-def generate_chat_title(first_user_message: str) -> str:
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing GEMINI_API_KEY in environment")
-
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.5-flash")
-
-    prompt = f"""
+def chat_reply(messages: list[dict], level: str = "beginner", summary: str = "") -> str:
+    # แปลง messages เป็นข้อความเดียว (MVP ง่ายสุด)
+    # messages: [{role:"user"/"assistant", content:"..."}]
+    prompt = _build_prompt(messages, level, summary)
+    with model_pool.track(), llm_call("chat", _level_label(level), prompt) as call:
+        text = llm_router.generate_sync(_chat_model, MODEL_NAME, prompt, "chat")
+        call.chunk(text)
+    return text.strip()
+
+def _title_prompt(first_user_message: str) -> str:
+    return f"""
 Create a short chat session title (3-6 words) based on the user's first message.
 Return ONLY the title text. No quotes. No emoji.
 
 User message: {first_user_message}
 """
-    resp = model.generate_content(prompt)
-    title = (resp.text or "").strip()
+
+def _clean_title(text: str) -> str:
+    title = (text or "").strip()
 
     # กันพลาด: ตัดบรรทัด/ตัดยาว
-    title = title.splitlines()[0].strip()
+    title = (title.splitlines() or [""])[0].strip()
     return title[:60] or "Study Chat"
 
-def chat_reply_stream(messages: list[dict], level: str = "beginner"):
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing GEMINI_API_KEY")
-
-    genai.configure(api_key=api_key)
-
-    model = genai.GenerativeModel(
-        "gemini-2.5-flash",
-        system_instruction=(
-            SYSTEM_INSTRUCTION
-            + "\n\nAudience instruction:\n"
-            + LEVEL_INSTRUCTION.get(level, LEVEL_INSTRUCTION["beginner"])
-            + "\n\nIMPORTANT: Always respond in GitHub-flavored Markdown."
-        )
+async def generate_chat_title_async(first_user_message: str) -> str:
+    prompt = _title_prompt(first_user_message)
+    with llm_call("title", "-", prompt) as call:
+        async with model_pool.track_async():
+            text = await llm_router.generate(_title_model, MODEL_NAME, prompt, "title")
+        call.chunk(text)
+    return _clean_title(text)
+
+async def chat_reply_stream_async(messages: list[dict], level: str = "beginner", summary: str = ""):
+    # async version: ไม่กิน threadpool ระหว่างรอ Gemini
+    # ผ่าน llm_router: hedge ถ้า token แรกช้า, retry / fallback ก่อน token แรก
+    prompt = _build_prompt(messages, level, summary)
+
+    def get_model(name: str):
+        return _stream_model(level, name)
+
+    with llm_call("stream", _level_label(level), prompt) as call:
+        async with model_pool.track_async():
+            stream = llm_router.stream(get_model, MODEL_NAME, prompt)
+            try:
+                async for text in stream:
+                    call.chunk(text)
+                    yield text
+            finally:
+                # ปิด stream (cancel request ที่ค้าง) ทันทีตอน client หลุด ไม่ต้องรอ GC
+                await stream.aclose()
+
+async def summarize_async(previous_summary: str, messages: list[dict]) -> str:
+    # อัปเดต summary แบบ incremental: summary เดิม + ข้อความใหม่ที่หลุด window
+    lines = []
+    for m in messages:
+        role = "User" if m.get("role") == "user" else "Assistant"
+        lines.append(f"{role}: {m.get('content', '')}")
+    prompt = (
+        f"Current summary:\n{previous_summary or '(none)'}\n\n"
+        "New messages to fold into the summary:\n" + "\n".join(lines) + "\n\nUpdated summary:"
     )
-
-    transcript = [f"(Audience level: {level})"]
-    for m in messages[-20:]:
-        role = m.get("role", "user")
-        content = m.get("content", "")
-        if role == "user":
-            transcript.append(f"User: {content}")
-        else:
-            transcript.append(f"Assistant: {content}")
-    prompt = "\n".join(transcript) + "\nAssistant:"
-
-    stream = model.generate_content(prompt, stream=True)
-    for chunk in stream:
-        if getattr(chunk, "text", None):
-            yield chunk.text
+    with llm_call("summary", "-", prompt) as call:
+        async with model_pool.track_async():
+            text = await llm_router.generate(_summary_model, MODEL_NAME, prompt, "summary")
+        call.chunk(text)
+    return text.strip()
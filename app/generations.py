@@ -0,0 +1,245 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+import uuid
+from collections import deque
+from itertools import islice
+
+from .sse import Coalescer, SSEWriter, sse_stats
+
+# Generation แยกจาก HTTP connection:
+# - model stream รันใน task ของตัวเอง เขียน event (มี seq) ลง buffer ที่จำกัดขนาด
+# - response แต่ละตัวเป็นแค่ subscriber อ่านจาก buffer (SSE id: = seq)
+# - client หลุด -> generation รันต่อจนจบและ persist เอง, reconnect ด้วย Last-Event-ID
+#   แล้ว replay จาก buffer (ไม่เรียก Gemini ใหม่)
+# - subscriber ที่ตามไม่ทัน buffer ได้ event "snapshot" (ข้อความทั้งหมดถึงตอนนั้น) แทน
+# - single-flight: 1 session มี generation ที่รันอยู่ได้ทีละตัว (session_lock + claim)
+#   คำขอซ้ำ (double-click / retry) key เดียวกัน = (session id, message ที่ตอบ, level)
+#   ต่อ stream เดิม (fan-out), คำขออื่นรอให้ตัวที่รันอยู่จบก่อน
+
+logger = logging.getLogger(__name__)
+
+GEN_BUFFER_EVENTS = int(os.getenv("GEN_BUFFER_EVENTS", "1024"))
+# เก็บ generation ที่จบแล้วไว้ให้ reconnect ได้อีกกี่วินาที
+GEN_RETENTION_SECONDS = float(os.getenv("GEN_RETENTION_SECONDS", "300"))
+
+
+class Generation:
+    def __init__(
+        self,
+        session_id: int,
+        kind: str = "chat",
+        key: tuple | None = None,
+        prompt: str = "",
+        buffer_events: int = GEN_BUFFER_EVENTS,
+    ):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.kind = kind
+        # (session id, id ของ user message ที่ตอบ, level)
+        self.key = key
+        self.prompt = prompt
+        self.events: deque[tuple[int, str, str]] = deque(maxlen=buffer_events)
+        self.seq = 0
+        self.done = False
+        self.finished_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self._parts: list[str] = []
+        self._part_seqs: list[int] = []
+        self._changed = asyncio.Event()
+
+    def text(self, upto: int | None = None) -> str:
+        if upto is None:
+            return "".join(self._parts)
+        return "".join(self._parts[:bisect.bisect_right(self._part_seqs, upto)])
+
+    def publish(self, event: str, data: str):
+        if self.done:
+            return
+        self.seq += 1
+        self.events.append((self.seq, event, data))
+        if event == "message":
+            self._parts.append(data)
+            self._part_seqs.append(self.seq)
+        # ปลุก subscriber ทุกตัว แล้วเริ่ม event ใหม่สำหรับรอบถัดไป
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    @property
+    def level(self) -> str | None:
+        return self.key[2] if self.key else None
+
+    async def wait(self):
+        if self.task is not None and not self.task.done():
+            await asyncio.wait([self.task])
+
+    def _finish(self):
+        self.done = True
+        self.finished_at = time.time()
+        self._changed.set()
+
+    async def run(self, source, on_complete, on_error=None):
+        # on_complete(answer) persist + งานหลังจบ (รันแม้ไม่มี client ต่ออยู่)
+        # on_error(partial) ถ้า model error / ถูก cancel ก่อนได้คำตอบครบ (เช่นคืน token ที่จองไว้)
+        coalescer = Coalescer()
+        pieces = 0
+        streamed = False
+        try:
+            async for text in coalescer.pieces(source):
+                pieces += 1
+                self.publish("message", text)
+            streamed = True
+            await on_complete(self.text())
+            self.publish("done", "ok")
+        except Exception as e:
+            self.publish("error", str(e))
+        finally:
+            sse_stats.coalesced(coalescer.chunks_in, pieces)
+            self._finish()
+            if not streamed and on_error is not None:
+                try:
+                    await on_error(self.text())
+                except Exception:
+                    logger.exception("on_error of generation %s failed", self.id)
+
+    async def subscribe(self, after: int = 0):
+        # yield (seq, event, data) ที่ seq > after จนกว่า generation จะจบ
+        while True:
+            changed = self._changed
+            first = self.events[0][0] if self.events else self.seq + 1
+            if after < first - 1:
+                # event ที่ต้องการหลุด buffer ไปแล้ว -> ส่งข้อความรวมถึงก่อน buffer แล้ว replay ต่อ
+                after = first - 1
+                yield after, "snapshot", self.text(upto=after)
+                continue
+
+            pending = list(islice(self.events, after - first + 1, None))
+            for seq, event, data in pending:
+                after = seq
+                yield seq, event, data
+
+            if self.done and after >= self.seq:
+                return
+            if not pending:
+                await changed.wait()
+
+
+class GenerationRegistry:
+    def __init__(self, retention: float = GEN_RETENTION_SECONDS):
+        self.retention = retention
+        self._by_id: dict[str, Generation] = {}
+        self._by_session: dict[int, Generation] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.started = 0
+        self.resumes = 0
+        self.attached = 0
+        self.waits = 0
+
+    def _prune(self):
+        now = time.time()
+        for gen in list(self._by_id.values()):
+            if gen.done and now - gen.finished_at > self.retention:
+                self._by_id.pop(gen.id, None)
+                if self._by_session.get(gen.session_id) is gen:
+                    self._by_session.pop(gen.session_id, None)
+        for sid, lock in list(self._locks.items()):
+            if not lock.locked() and self.running(sid) is None:
+                self._locks.pop(sid, None)
+
+    def session_lock(self, session_id: int) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    def running(self, session_id: int) -> Generation | None:
+        gen = self._by_session.get(session_id)
+        return gen if gen is not None and not gen.done else None
+
+    async def claim(self, session_id: int, match) -> Generation | None:
+        # ต้องถือ session_lock อยู่: ถ้า generation ที่รันอยู่ match -> คืนตัวนั้น (ต่อ stream เดิม)
+        # ไม่ match -> รอให้จบก่อน แล้วคืน None (caller เริ่ม generation ใหม่ได้)
+        active = self.running(session_id)
+        if active is None:
+            return None
+        if match(active):
+            self.attached += 1
+            return active
+        self.waits += 1
+        await active.wait()
+        return None
+
+    def start(
+        self,
+        session_id: int,
+        source,
+        on_complete,
+        on_error=None,
+        kind: str = "chat",
+        key: tuple | None = None,
+        prompt: str = "",
+    ) -> Generation:
+        # เรียกใน event loop (ถือ session_lock อยู่)
+        self._prune()
+        gen = Generation(session_id, kind, key=key, prompt=prompt)
+        self._by_id[gen.id] = gen
+        self._by_session[session_id] = gen
+        gen.task = asyncio.create_task(gen.run(source, on_complete, on_error))
+        self.started += 1
+        return gen
+
+    def get(self, generation_id: str) -> Generation | None:
+        return self._by_id.get(generation_id)
+
+    def latest(self, session_id: int) -> Generation | None:
+        self._prune()
+        return self._by_session.get(session_id)
+
+    def forget_session(self, session_id: int):
+        # ลบ session แล้ว: หยุด generation ที่ค้าง (เรียกจาก sync endpoint ใน threadpool ได้)
+        gen = self._by_session.pop(session_id, None)
+        if gen is None:
+            return
+        self._by_id.pop(gen.id, None)
+        task = gen.task
+        if task is not None and not task.done():
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    async def drain(self, timeout: float = 30.0):
+        # ตอน shutdown: รอ generation ที่ค้างให้ persist ให้เสร็จก่อน
+        tasks = [g.task for g in self._by_id.values() if g.task is not None and not g.task.done()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    def stats(self) -> dict:
+        running = sum(1 for g in self._by_id.values() if not g.done)
+        return {
+            "running": running,
+            "retained": len(self._by_id) - running,
+            "started": self.started,
+            "resumes": self.resumes,
+            "attached": self.attached,
+            "waits": self.waits,
+        }
+
+
+generations = GenerationRegistry()
+
+
+async def sse_subscribe(gen: Generation, after: int = 0):
+    # body ของ StreamingResponse: replay จาก buffer แล้วตาม event ใหม่ (ตัด connection ได้ทุกเมื่อ)
+    out = SSEWriter()
+    try:
+        async for seq, event, data in gen.subscribe(after):
+            yield out.frame(event, data, seq)
+    finally:
+        out.close()
+
+
+def parse_last_event_id(value) -> int:
+    try:
+        return max(int(str(value).strip()), 0)
+    except (TypeError, ValueError):
+        return 0
@@ -0,0 +1,191 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .metrics import HTTP_COMPRESSED_BYTES, HTTP_CONDITIONAL
+
+# HTTP caching ของ read endpoints ที่ frontend เรียกบ่อยที่สุด (list sessions / messages)
+# - ETag (strong) จาก version ของ session (+1 ทุกครั้งที่เขียน ดู messages.bump_version)
+#   request ที่มี If-None-Match ตรง -> 304 ไม่ต้อง query messages / serialize
+# - Cache-Control: private, no-cache -> browser เก็บไว้แต่ revalidate ทุกครั้ง (fetch เดิมได้ 304 อัตโนมัติ)
+# - CompressionMiddleware: บีบอัด JSON ที่ใหญ่กว่า HTTP_COMPRESS_MIN_BYTES (br ถ้าติดตั้ง brotli, ไม่งั้น gzip)
+#   ETag ของ response ที่บีบอัดต่อท้าย "-gzip" / "-br" (คนละ bytes กัน) ตอนเทียบ If-None-Match ตัดออก
+
+HTTP_COMPRESS_ENABLED = os.getenv("HTTP_COMPRESS_ENABLED", "1").lower() not in {"0", "false", "no"}
+HTTP_COMPRESS_MIN_BYTES = int(os.getenv("HTTP_COMPRESS_MIN_BYTES", "1024"))
+HTTP_COMPRESS_LEVEL = int(os.getenv("HTTP_COMPRESS_LEVEL", "6"))
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CACHE_CONTROL = "private, no-cache"
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix + '"'):
+            return tag[: -len(suffix) - 1] + '"'
+    return tag
+
+
+def if_none_match(request: Request, etag: str) -> bool:
+    # weak comparison (RFC 9110: If-None-Match), ไม่สนใจ suffix ของ content-encoding
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(_opaque(tag) == etag for tag in header.split(","))
+
+
+class HttpCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.conditional: dict[str, dict[str, int]] = {}
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def add(self, route: str, result: str):
+        with self._lock:
+            counts = self.conditional.setdefault(route, {})
+            counts[result] = counts.get(result, 0) + 1
+        HTTP_CONDITIONAL.labels(route, result).inc()
+
+    def add_compressed(self, raw: int, sent: int):
+        with self._lock:
+            self.compressed += 1
+            self.raw_bytes += raw
+            self.sent_bytes += sent
+        HTTP_COMPRESSED_BYTES.labels("raw").inc(raw)
+        HTTP_COMPRESSED_BYTES.labels("sent").inc(sent)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "conditional": {route: dict(c) for route, c in self.conditional.items()},
+                "compression": {
+                    "enabled": HTTP_COMPRESS_ENABLED,
+                    "encodings": ["br", "gzip"] if brotli is not None else ["gzip"],
+                    "min_bytes": HTTP_COMPRESS_MIN_BYTES,
+                    "responses": self.compressed,
+                    "raw_bytes": self.raw_bytes,
+                    "sent_bytes": self.sent_bytes,
+                    "ratio": round(self.raw_bytes / self.sent_bytes, 2) if self.sent_bytes else None,
+                },
+            }
+
+
+http_cache_stats = HttpCacheStats()
+
+
+def conditional(request: Request, response: Response, route: str, etag: str | None) -> Response | None:
+    # ตั้ง ETag / Cache-Control ให้ response; คืน 304 ถ้า client มีของ version นี้อยู่แล้ว
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    response.headers["Vary"] = "Accept-Encoding"
+    if etag is None:
+        http_cache_stats.add(route, "uncacheable")
+        return None
+    response.headers["ETag"] = etag
+    if if_none_match(request, etag):
+        http_cache_stats.add(route, "not_modified")
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Accept-Encoding"})
+    http_cache_stats.add(route, "modified" if request.headers.get("if-none-match") else "miss")
+    return None
+
+
+def _choose_encoding(accept: str) -> str | None:
+    offered = {}
+    for part in accept.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    # pure ASGI: บีบอัดเฉพาะ application/json ที่ส่งเป็น body ก้อนเดียว (JSONResponse)
+    # SSE / FileResponse (PDF) / response ที่ stream หลายก้อนผ่านไปเหมือนเดิม
+    def __init__(self, app, minimum_size: int = HTTP_COMPRESS_MIN_BYTES, level: int = HTTP_COMPRESS_LEVEL):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.level = level
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = ""
+        for k, v in scope["headers"]:
+            if k == b"accept-encoding":
+                accept = v.decode("latin-1")
+                break
+        encoding = _choose_encoding(accept)
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+
+        async def send_wrapper(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                headers = dict((k.lower(), v) for k, v in message.get("headers", []))
+                if headers.get(b"content-type", b"").startswith(b"application/json") and b"content-encoding" not in headers:
+                    start = message  # รอดู body ก่อนตัดสินใจ
+                    return
+                return await send(message)
+            if start is None:
+                return await send(message)
+
+            pending, start = start, None
+            body = message.get("body", b"")
+            if message.get("more_body") or len(body) < self.minimum_size:
+                await send(pending)
+                return await send(message)
+
+            # mtime=0: bytes เดิมทุกครั้ง (strong ETag "-gzip" ชี้ representation เดียว)
+            if encoding == "br":
+                compressed = brotli.compress(body, quality=min(self.level, 11))
+            else:
+                compressed = gzip.compress(body, self.level, mtime=0)
+            headers = []
+            for k, v in pending.get("headers", []):
+                name = k.lower()
+                if name == b"content-length" or name == b"vary":
+                    continue
+                if name == b"etag" and v.endswith(b'"'):
+                    v = v[:-1] + f"-{encoding}".encode() + b'"'
+                headers.append((k, v))
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            http_cache_stats.add_compressed(len(body), len(compressed))
+            await send({**pending, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,5 +1,66 @@
+import logging
+
+from sqlalchemy import inspect, text
+
 from .db import engine, Base
 from . import models  # noqa: F401
+from .search import ensure_search_index
+
+def _add_missing_columns(conn):
+    # create_all ไม่เพิ่ม column/index ให้ table ที่มีอยู่แล้ว -> เพิ่มเองแบบง่าย ๆ
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not insp.has_table(table.name):
+            continue
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            col_type = col.type.compile(dialect=conn.dialect)
+            # server_default แบบค่าคงที่ -> row เดิมได้ค่านั้น (NOT NULL เพิ่มได้เฉพาะตอนมี default)
+            if col.server_default is not None and isinstance(col.server_default.arg, str):
+                col_type += f" DEFAULT {col.server_default.arg}"
+                if not col.nullable:
+                    col_type += " NOT NULL"
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}'))
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def _backfill_last_message(conn):
+    # sessions เก่าที่ยังไม่มี last_message_at
+    from .messages import make_preview
+
+    rows = conn.execute(text("""
+        SELECT s.id, m.content, m.created_at
+        FROM chat_sessions s
+        JOIN chat_messages m ON m.id = (
+            SELECT m2.id FROM chat_messages m2
+            WHERE m2.session_id = s.id
+            ORDER BY m2.created_at DESC, m2.id DESC
+            LIMIT 1
+        )
+        WHERE s.last_message_at IS NULL
+    """)).all()
+    for session_id, content, created_at in rows:
+        conn.execute(
+            text("UPDATE chat_sessions SET last_message_at = :at, last_preview = :p WHERE id = :id"),
+            {"at": created_at, "p": make_preview(content), "id": session_id},
+        )
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        _add_missing_columns(conn)
+        _backfill_last_message(conn)
+        ensure_search_index(conn)
+
+def schema_ready() -> bool:
+    # เช็คแบบเบา ๆ ตอน worker boot (ไม่ migrate): มีครบทุก table หรือยัง
+    insp = inspect(engine)
+    return all(insp.has_table(t.name) for t in Base.metadata.sorted_tables)
+
+if __name__ == "__main__":
+    # migration step แยกจาก worker boot: python -m app.init_db (ครั้งเดียวต่อ deploy)
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+    logging.getLogger(__name__).info("schema up to date (%s)", engine.url.render_as_string(hide_password=True))
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from .metrics import LLM_EVENTS
+
+# Routing ของ model call: timeout / retry (jitter) / fallback model / hedged stream
+# - stream: ยิง request แรก ถ้ายังไม่มี token แรกภายใน LLM_HEDGE_AFTER_MS ยิงซ้ำอีกตัว (model เดิม)
+#   ตัวไหนได้ token แรกก่อนใช้ตัวนั้น อีกตัว cancel ทิ้ง (The Tail at Scale: hedged requests)
+#   hedge ได้ไม่เกิน LLM_HEDGE_MAX_RATIO ของ request ทั้งหมด (คุมค่า API / rate limit)
+# - retry / fallback ทำได้แค่ก่อน token แรก (หลังจากนั้นส่งไปหา client แล้ว ต่อใหม่ไม่ได้)
+#   ลำดับ: primary x (1 + LLM_RETRIES) -> LLM_FALLBACK_MODEL, backoff แบบ full jitter
+#   fallback ปิดไว้เป็น default (ว่าง): ต้องเลือก model ที่ key นี้ใช้ได้และตอบได้ดีพอเอง
+# - retry เฉพาะ error ชั่วคราว: timeout / connection / HTTP 429, 5xx (google.api_core มี .code)
+# ค่า TTFT ที่ user เห็นเก็บเป็น rolling window -> p50 / p90 / p99 ที่ /api/llm/router
+
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "").strip()
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "1500"))
+LLM_HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))
+LLM_TTFT_TIMEOUT_MS = float(os.getenv("LLM_TTFT_TIMEOUT_MS", "20000"))
+LLM_IDLE_TIMEOUT_MS = float(os.getenv("LLM_IDLE_TIMEOUT_MS", "30000"))
+LLM_TIMEOUT_MS = float(os.getenv("LLM_TIMEOUT_MS", "60000"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))
+LLM_RETRY_BACKOFF_MS = float(os.getenv("LLM_RETRY_BACKOFF_MS", "250"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return getattr(exc, "code", None) in RETRYABLE_STATUS
+
+
+def _text(chunk) -> str:
+    return getattr(chunk, "text", None) or ""
+
+
+async def _aclose(it):
+    close = getattr(it, "aclose", None)
+    if close is not None:
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+def _percentiles(values) -> dict:
+    data = sorted(values)
+    if not data:
+        return {"count": 0}
+
+    def pct(p: float) -> float:
+        return round(data[min(int(len(data) * p), len(data) - 1)] * 1000, 1)
+
+    return {"count": len(data), "p50_ms": pct(0.5), "p90_ms": pct(0.9), "p99_ms": pct(0.99), "max_ms": pct(1.0)}
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        fallback: str = LLM_FALLBACK_MODEL,
+        hedge_after_ms: float = LLM_HEDGE_AFTER_MS,
+        hedge_max_ratio: float = LLM_HEDGE_MAX_RATIO,
+        ttft_timeout_ms: float = LLM_TTFT_TIMEOUT_MS,
+        idle_timeout_ms: float = LLM_IDLE_TIMEOUT_MS,
+        timeout_ms: float = LLM_TIMEOUT_MS,
+        retries: int = LLM_RETRIES,
+        backoff_ms: float = LLM_RETRY_BACKOFF_MS,
+        window: int = 2048,
+    ):
+        self.fallback = fallback
+        self.hedge_after = hedge_after_ms / 1000
+        self.hedge_max_ratio = hedge_max_ratio
+        self.ttft_timeout = ttft_timeout_ms / 1000
+        self.idle_timeout = idle_timeout_ms / 1000
+        self.timeout = timeout_ms / 1000
+        self.retries = retries
+        self.backoff = backoff_ms / 1000
+        self._lock = threading.Lock()
+        # TTFT ที่ user เห็น (รวม hedge / retry) แยกตามตัวที่ชนะ: primary / hedge / fallback
+        self._ttft: dict[str, deque] = {}
+        self._window = window
+
+        self.streams = 0
+        self.hedges = 0
+        self.counts: dict[str, int] = {}
+
+    def _plan(self, model_name: str) -> list[str]:
+        plan = [model_name] * (1 + self.retries)
+        if self.fallback and self.fallback != model_name:
+            plan.append(self.fallback)
+        return plan
+
+    def _event(self, kind: str, event: str):
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + 1
+        LLM_EVENTS.labels(kind, event).inc()
+
+    async def _sleep_before(self, attempt: int, model_name: str, primary: str, kind: str):
+        if attempt == 0:
+            return
+        self._event(kind, "fallback" if model_name != primary else "retry")
+        # full jitter: uniform(0, base * 2^n) ไม่ให้ทุก worker retry พร้อมกัน
+        await asyncio.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def _hedge_allowed(self) -> bool:
+        with self._lock:
+            # budget: hedge ได้ ratio ของ stream ทั้งหมด (+1 ให้ตัวแรก ๆ ได้)
+            if self.hedge_after <= 0 or self.hedges >= self.hedge_max_ratio * self.streams + 1:
+                return False
+            self.hedges += 1
+            return True
+
+    def _record_ttft(self, winner: str, seconds: float):
+        with self._lock:
+            for key in (winner, "all"):
+                self._ttft.setdefault(key, deque(maxlen=self._window)).append(seconds)
+
+    async def _open(self, model, prompt: str):
+        # เปิด stream แล้วรอจนได้ chunk แรกที่มีข้อความ ("" = stream ว่าง)
+        stream = await model.generate_content_async(prompt, stream=True)
+        it = stream.__aiter__()
+        while True:
+            try:
+                text = _text(await it.__anext__())
+            except StopAsyncIteration:
+                return it, ""
+            if text:
+                return it, text
+
+    async def _first_token(self, get_model, model_name: str, prompt: str, label: str, kind: str):
+        # race ระหว่าง request แรกกับ hedge -> (iterator, first text, label ของตัวที่ชนะ)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        deadline = start + self.ttft_timeout
+        hedge_at = start + self.hedge_after if 0 < self.hedge_after < self.ttft_timeout else None
+        tasks = {asyncio.ensure_future(self._open(get_model(model_name), prompt)): label}
+        error: BaseException | None = None
+        try:
+            while tasks:
+                wake = deadline if hedge_at is None else hedge_at
+                done, _ = await asyncio.wait(tasks, timeout=max(wake - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    winner = tasks.pop(task)
+                    if task.exception() is None:
+                        if winner == "hedge":
+                            self._event(kind, "hedge_won")
+                        return (*task.result(), winner)
+                    error = task.exception()
+                if done:
+                    continue
+                if hedge_at is None:
+                    self._event(kind, "timeout")
+                    raise TimeoutError(f"{model_name}: no first token after {self.ttft_timeout:.1f}s")
+                # ถึงเวลา hedge (ครั้งเดียวต่อ attempt)
+                hedge_at = None
+                if self._hedge_allowed():
+                    self._event(kind, "hedge")
+                    tasks[asyncio.ensure_future(self._open(get_model(model_name), prompt))] = "hedge"
+            raise error
+        finally:
+            # ตัวที่แพ้: cancel (ยังรอ token แรก) หรือปิด stream (ได้ token แรกพร้อมกัน)
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    await _aclose(task.result()[0])
+                else:
+                    task.cancel()
+
+    async def stream(self, get_model, model_name: str, prompt: str, kind: str = "stream"):
+        # get_model(name) -> model (จาก model_pool); yield ข้อความทีละ chunk
+        with self._lock:
+            self.streams += 1
+        t0 = time.perf_counter()
+        error: BaseException | None = None
+        for attempt, name in enumerate(self._plan(model_name)):
+            await self._sleep_before(attempt, name, model_name, kind)
+            label = "primary" if name == model_name else "fallback"
+            try:
+                it, first, winner = await self._first_token(get_model, name, prompt, label, kind)
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                self._event(kind, "error")
+                error = e
+                continue
+
+            self._record_ttft(winner, time.perf_counter() - t0)
+            try:
+                if first:
+                    yield first
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(it.__anext__(), self.idle_timeout)
+                    except StopAsyncIteration:
+                        return
+                    text = _text(chunk)
+                    if text:
+                        yield text
+            finally:
+                await _aclose(it)
+        raise error
+
+    async def generate(self, get_model, model_name: str, prompt: str, kind: str) -> str:
+        # non-stream (title / summary): timeout + retry + fallback, ไม่ hedge
+        error: BaseException | None = None
+        for attempt, name in enumerate(self._plan(model_name)):
+            await self._sleep_before(attempt, name, model_name, kind)
+            try:
+                resp = await asyncio.wait_for(get_model(name).generate_content_async(prompt), self.timeout)
+                return resp.text or ""
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                self._event(kind, "error")
+                error = e
+        raise error
+
+    def generate_sync(self, get_model, model_name: str, prompt: str, kind: str) -> str:
+        # sync endpoint (threadpool): timeout ผ่าน request_options ของ SDK
+        error: BaseException | None = None
+        for attempt, name in enumerate(self._plan(model_name)):
+            if attempt:
+                self._event(kind, "fallback" if name != model_name else "retry")
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+            try:
+                resp = get_model(name).generate_content(prompt, request_options={"timeout": self.timeout})
+                return resp.text or ""
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                self._event(kind, "error")
+                error = e
+        raise error
+
+    def stats(self) -> dict:
+        with self._lock:
+            ttft = {k: _percentiles(v) for k, v in self._ttft.items()}
+            counts = dict(self.counts)
+        return {
+            "fallback_model": self.fallback or None,
+            "hedge_after_ms": self.hedge_after * 1000,
+            "hedge_max_ratio": self.hedge_max_ratio,
+            "retries": self.retries,
+            "streams": self.streams,
+            "hedges": self.hedges,
+            "events": counts,
+            "ttft": ttft,
+        }
+
+
+llm_router = LLMRouter()
@@ -1,66 +1,220 @@
-from fastapi import FastAPI, Request, Depends, APIRouter, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+import logging
+
+from fastapi import FastAPI, Request, Response, Depends, APIRouter, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, FileResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from dotenv import load_dotenv
-from sqlalchemy import desc
+from sqlalchemy import desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .db import get_db, SessionLocal
+from .db import get_db, get_async_db, get_read_db, route_read, read_router, pool_stats, StickyWritesMiddleware
 from .models import ChatSession, ChatMessage
-from .init_db import init_db
-from .gemini_client import chat_reply, chat_reply_stream, generate_chat_title
-from .pdf_utils import chat_to_pdf_bytes
+from .messages import add_message, bump_version, recent_context, recent_context_async, pending_writes, merge_pending
+from .pagination import encode_cursor, keyset_filter, clamp_limit
+from .init_db import init_db, schema_ready
+from .context_cache import context_cache
+from .summaries import get_summary, get_summary_async, refresh_summary, forget_summary
+from .tasks import task_queue
+from .response_cache import response_cache, is_cacheable, replay
+from .titles import DEFAULT_TITLES, heuristic_title, refine_title, title_waiter, drop_title_waiter
+from .gemini_client import (
+    chat_reply,
+    chat_reply_stream_async,
+    model_pool,
+)
+from .pdf_export import render_session_pdf, remove_file, shutdown_pool
+from .sse import sse_stats
+from .search import search_messages
+from .generations import generations, sse_subscribe, parse_last_event_id
+from .rate_limit import rate_limiter, RateLimited, reserve_tokens, used_tokens
+from .metrics import METRICS_ENABLED, MetricsMiddleware, registry
+from .write_behind import WritesPending, message_writer
+from .llm_router import llm_router
+from .startup import DB_AUTO_MIGRATE, warmup
+from .archive import archiver
+from .http_cache import HTTP_COMPRESS_ENABLED, CompressionMiddleware, conditional, http_cache_stats, make_etag
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
+if HTTP_COMPRESS_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+if read_router.replicas:
+    app.add_middleware(StickyWritesMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 @app.on_event("startup")
 def on_startup():
-    init_db()
+    # schema: `python -m app.init_db` ก่อน start workers (DB_AUTO_MIGRATE=1 -> ทำที่นี่)
+    if DB_AUTO_MIGRATE:
+        init_db()
+    elif not schema_ready():
+        logger.error("database schema is missing tables: run `python -m app.init_db` (or set DB_AUTO_MIGRATE=1)")
+    warmup.start()
 
-def sse_data(text: str) -> str:
-    # SSE ต้อง prefix data: ทุกบรรทัด
-    lines = (text or "").splitlines()
-    if not lines:
-        return "data:\n\n"
-    return "".join(f"data: {line}\n" for line in lines) + "\n"
+@app.on_event("startup")
+async def start_task_queue():
+    task_queue.start()
+    message_writer.start()
+    archiver.start()
+
+@app.on_event("shutdown")
+async def stop_task_queue():
+    await archiver.stop()
+    # generation ที่ค้างต้อง persist ให้เสร็จ (และ enqueue summary) ก่อน
+    await generations.drain()
+    # flush message ที่ค้างใน write-behind queue
+    await message_writer.stop()
+    # flush งาน background ที่ค้าง (title / summary) ก่อนปิด worker
+    await task_queue.stop()
+
+@app.on_event("shutdown")
+def stop_pdf_pool():
+    shutdown_pool()
 
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-# 0) list sessions (ล่าสุดขึ้นก่อน)
-@app.get("/api/sessions")
-def list_sessions(db: Session = Depends(get_db)):
+@app.get("/bench/render", response_class=HTMLResponse)
+def bench_render(request: Request):
+    # synthetic-stream benchmark ของ client renderer (frame time vs จำนวน message)
+    return templates.TemplateResponse("bench_render.html", {"request": request})
+
+@registry.collector
+def _runtime_gauges():
+    # ค่าปัจจุบันจาก singleton ต่าง ๆ (อ่านตอน scrape)
+    gens = generations.stats()
+    pool = model_pool.stats()
+    limits = rate_limiter.stats(hot=0)
+    yield "generations_running", "Generations currently streaming", [({}, gens["running"])]
+    yield "sse_streams_active", "Open SSE responses", [({}, sse_stats.active)]
+    yield "task_queue_pending", "Background jobs waiting", [({}, task_queue.stats()["pending"])]
+    yield "write_behind_pending", "Messages waiting to be flushed", [({}, pending_writes.count()[0])]
+    yield "llm_in_flight", "Model calls in flight", [({}, pool["in_flight"])]
+    yield "rate_limit_global_level", "Tokens left in the global buckets", [
+        ({"bucket": name}, level) for name, level in limits["global_levels"].items()
+    ]
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/health")
+async def health():
+    # readiness probe: startup เสร็จแล้ว (warm-up อาจยังทำอยู่ใน background)
+    return {"ok": True, "warmup": warmup.stats()}
+
+@app.get("/api/llm/pool")
+def llm_pool_stats():
+    return model_pool.stats()
+
+@app.get("/api/llm/router")
+def llm_router_stats():
+    # hedge / retry / fallback + TTFT percentiles (ตามตัวที่ชนะ: primary / hedge / fallback)
+    return llm_router.stats()
+
+@app.get("/api/tasks")
+def task_queue_stats():
+    return task_queue.stats()
+
+@app.get("/api/streams")
+def stream_stats():
+    return {**sse_stats.stats(), "generations": generations.stats()}
+
+@app.get("/api/writes")
+def write_behind_stats():
+    return message_writer.stats()
+
+@app.get("/api/db")
+def db_stats():
+    return pool_stats()
+
+@app.get("/api/archive")
+def archive_stats():
+    # พื้นที่ที่ประหยัดได้ (ทั้ง DB) + rehydrate latency (process นี้)
+    return archiver.stats()
+
+@app.get("/api/httpcache")
+def http_cache_stats_endpoint():
+    # 304 / miss ต่อ endpoint + bytes ก่อน / หลังบีบอัด
+    return http_cache_stats.stats()
+
+@app.get("/api/ratelimit")
+def rate_limit_stats():
+    return rate_limiter.stats()
+
+@app.get("/api/cache/responses")
+def response_cache_stats():
+    return response_cache.stats()
+
+@app.get("/api/cache/context")
+def context_cache_stats():
+    return context_cache.stats()
+
+# 0) list sessions (ล่าสุดขึ้นก่อน) — query เดียว, keyset pagination ด้วย cursor
+def session_page(db: Session, cursor: str | None = None, limit: int = 50) -> tuple[list[ChatSession], bool]:
+    # หน้าเดียวของ session list -> (sessions, has_more); cursor ผิด -> ValueError
+    q = db.query(ChatSession)
+    if cursor:
+        q = q.filter(keyset_filter(ChatSession, cursor))
     sessions = (
-        db.query(ChatSession)
-        .order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
-        .limit(50)
+        q.order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+        .limit(limit + 1)
         .all()
     )
+    return sessions[:limit], len(sessions) > limit
 
-    # เอา last message preview มาช่วยให้ดูดีขึ้น (MVP ทำแบบ query เพิ่มทีละ session ก็พอ)
-    result = []
-    for s in sessions:
-        last = (
-            db.query(ChatMessage)
-            .filter(ChatMessage.session_id == s.id)
-            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-            .first()
-        )
-        result.append({
-            "id": s.id,
-            "title": s.title,
-            "level": s.level,
-            "created_at": s.created_at.isoformat() if s.created_at else None,
-            "last_preview": (last.content[:80] + "…") if last and len(last.content) > 80 else (last.content if last else ""),
-            "last_at": last.created_at.isoformat() if last and last.created_at else None,
-        })
-    return {"sessions": result}
+def session_item(s: ChatSession) -> dict:
+    return {
+        "id": s.id,
+        "title": s.title,
+        "level": s.level,
+        "created_at": s.created_at.isoformat() if s.created_at else None,
+        "last_preview": s.last_preview or "",
+        "last_at": s.last_message_at.isoformat() if s.last_message_at else None,
+    }
+
+@app.get("/api/sessions")
+def list_sessions(request: Request, response: Response, cursor: str | None = None, limit: int = 50, db: Session = Depends(get_read_db)):
+    limit = clamp_limit(limit)
+    try:
+        sessions, has_more = session_page(db, cursor, limit)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    # ETag จาก (id, version) ของหน้านี้: สร้าง / ลบ / rename / message ใหม่ เปลี่ยนอย่างใดอย่างหนึ่ง
+    etag = make_etag("sessions", cursor, limit, has_more, *(f"{s.id}.{s.version}" for s in sessions))
+    not_modified = conditional(request, response, "sessions", etag)
+    if not_modified is not None:
+        return not_modified
+
+    next_cursor = encode_cursor(sessions[-1].created_at, sessions[-1].id) if has_more else None
+    return {"sessions": [session_item(s) for s in sessions], "next_cursor": next_cursor}
+
+# ค้นหาข้อความใน chat history ทุก session (full-text + trigram fallback)
+@app.get("/api/search")
+def search(q: str = "", cursor: str | None = None, limit: int = 20, session_id: int | None = None, db: Session = Depends(get_read_db)):
+    if not q.strip():
+        raise HTTPException(400, "Empty query")
+    # ค้นใน session เดียวที่ archive อยู่: ย้ายกลับก่อนแล้วค้นจาก primary
+    if session_id is not None and archiver.rehydrate(session_id):
+        db.info["replica"] = None
+    try:
+        page = search_messages(db, q, cursor=cursor, limit=clamp_limit(limit, default=20, maximum=100), session_id=session_id)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    # ค้นทุก session: session ที่ archive อยู่ไม่ถูกค้น (ไม่แตก blob ทุก search) -> บอก client ว่าไม่ได้ค้นกี่ session
+    page["archived_sessions_excluded"] = archiver.archived_count(db) if session_id is None else 0
+    return page
 
 # 1) rename session
 @app.patch("/api/sessions/{session_id}")
@@ -74,6 +228,7 @@ def rename_session(session_id: int, payload: dict, db: Session = Depends(get_db)
         return JSONResponse({"error": "Session not found"}, status_code=404)
 
     s.title = title[:200]
+    db.execute(bump_version(session_id))
     db.commit()
     return {"ok": True, "id": s.id, "title": s.title}
 
@@ -84,8 +239,12 @@ def delete_session(session_id: int, db: Session = Depends(get_db)):
     if not s:
         return JSONResponse({"error": "Session not found"}, status_code=404)
 
+    # message ที่ค้างใน write-behind ต้องลงก่อน (ไม่งั้นไป insert ทีหลังให้ session ที่ลบแล้ว)
+    write_barrier(session_id)
     db.delete(s)
     db.commit()
+    forget_summary(session_id)
+    generations.forget_session(session_id)
     return {"ok": True}
 
 # 1) สร้าง session ใหม่
@@ -103,18 +262,127 @@ def create_session(payload: dict, db: Session = Depends(get_db)):
         "level": s.level,
     }
 
-# 2) โหลดรายการข้อความของ session
-@app.get("/api/sessions/{session_id}/messages")
-def get_messages(session_id: int, db: Session = Depends(get_db)):
-    msgs = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
-        .all()
+def _parse_sync_token(token: str) -> tuple[int, int, int | None]:
+    # <version>.<last id>.<จำนวน message ที่ id <= last id>; token แบบเก่า (ไม่มีจำนวน) -> count None = โหลดเต็มหน้า
+    parts = token.split(".")
+    if len(parts) not in (2, 3):
+        raise ValueError(token)
+    version, last_id = int(parts[0]), int(parts[1])
+    return version, last_id, int(parts[2]) if len(parts) == 3 else None
+
+def _count_upto(db: Session, session_id: int, last_id: int) -> int:
+    return db.scalar(
+        select(func.count()).select_from(ChatMessage)
+        .where(ChatMessage.session_id == session_id, ChatMessage.id <= last_id)
     )
+
+# 2) โหลดรายการข้อความของ session (keyset pagination: before / after cursor)
+# since=<sync_token> (จาก response ก่อนหน้า): delta = เฉพาะ message ที่ใหม่กว่า token
+# ถ้ามีการลบ / แทน message หลัง token (regenerate) หรือใหม่เกิน limit -> หน้าล่าสุดเต็ม ๆ (delta: false)
+# id ไม่ได้เรียงตามลำดับ commit (transaction ที่ได้ id น้อยกว่าอาจ commit ทีหลัง, worker อื่น / sync endpoint)
+# -> token เก็บจำนวน message ที่ id <= last id ไว้ด้วย ถ้าตอนนี้จำนวนไม่เท่าเดิม = มี row commit แทรกหลังออก token
+#    -> หน้าล่าสุดเต็ม ๆ แทน delta (ไม่ตกหล่น)
+@app.get("/api/sessions/{session_id}/messages")
+def get_messages(
+    session_id: int,
+    request: Request,
+    response: Response,
+    before: str | None = None,
+    after: str | None = None,
+    since: str | None = None,
+    limit: int = 50,
+    db: Session = Depends(get_read_db),
+):
+    if sum(1 for p in (before, after, since) if p) > 1:
+        raise HTTPException(400, "Use only one of before, after or since")
+    limit = clamp_limit(limit)
+    if since:
+        try:
+            since_version, since_id, since_count = _parse_sync_token(since)
+        except ValueError:
+            raise HTTPException(400, "Invalid since token")
+
+    # snapshot ก่อน query (ดู merge_pending)
+    pending = pending_writes.snapshot(session_id) if not before else []
+
+    # version อ่านก่อน messages: เขียนแทรกระหว่างนี้ -> ETag / token เก่ากว่าข้อมูล (รอบหน้าโหลดซ้ำ ไม่ใช่ตกหล่น)
+    row = db.execute(
+        select(ChatSession.version, ChatSession.history_version).where(ChatSession.id == session_id)
+    ).first()
+    # มี message ค้างใน write-behind: overlay ไม่อยู่ใน version -> ไม่ให้ cache
+    etag = make_etag("messages", session_id, row.version, before, after, since, limit) if row and not pending else None
+    not_modified = conditional(request, response, "messages", etag)
+    if not_modified is not None:
+        return not_modified
+
+    delta = bool(since) and row is not None and since_count is not None and row.history_version <= since_version
+    if delta and row.version != since_version and _count_upto(db, session_id, since_id) != since_count:
+        delta = False
+
+    def page():
+        q = db.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        if delta:
+            if row.version == since_version:
+                return [], False
+            msgs = q.filter(ChatMessage.id > since_id).order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).limit(limit + 1).all()
+            return msgs[:limit], len(msgs) > limit
+        try:
+            if after:
+                q = q.filter(keyset_filter(ChatMessage, after, older=False))
+            elif before:
+                q = q.filter(keyset_filter(ChatMessage, before))
+        except ValueError:
+            raise HTTPException(400, "Invalid cursor")
+
+        if after:
+            msgs = q.order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc()).limit(limit + 1).all()
+            return msgs[:limit], len(msgs) > limit
+        # หน้าล่าสุด (หรือเก่ากว่า before): ดึงจากใหม่ -> เก่า แล้วกลับลำดับ
+        msgs = q.order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()).limit(limit + 1).all()
+        return list(reversed(msgs[:limit])), len(msgs) > limit
+
+    msgs, has_more = page()
+    if delta and has_more:
+        delta = False
+        msgs, has_more = page()
+    # ว่าง = อาจเป็น session ที่ archive ไว้ -> ย้ายกลับแล้วอ่านใหม่จาก primary (hot session ไม่เสีย query เพิ่ม)
+    if not msgs and not delta and archiver.rehydrate(session_id):
+        db.info["replica"] = None
+        msgs, has_more = page()
+
+    rows = [{
+        "id": m.id,
+        "role": m.role,
+        "content": m.content,
+        "created_at": m.created_at.isoformat() if m.created_at else None,
+    } for m in msgs]
+    # หน้าล่าสุด: ต่อท้ายด้วย message ที่ยังอยู่ใน write-behind queue (id = null, pending = true)
+    # cursor คิดจาก row ที่อยู่ใน DB แล้วเท่านั้น
+    if pending and not (after and has_more):
+        rows = merge_pending(rows, pending)
+        if len(rows) > limit and not after:
+            rows, has_more = rows[-limit:], True
+
+    # token สำหรับ since= ครั้งถัดไป: เฉพาะหน้าล่าสุด (ไม่มี message ใหม่กว่านี้ที่ยังไม่ได้ส่ง)
+    sync_token = None
+    if row is not None and not before and not (after and has_more):
+        if delta:
+            last_id = max([since_id] + [m.id for m in msgs])
+            count = since_count + len(msgs)
+        else:
+            last_id = max((m.id for m in msgs), default=0)
+            # หน้าล่าสุดที่มีครบทุก message -> นับจาก page ได้เลย ไม่ต้อง query
+            count = len(msgs) if not after and not has_more else _count_upto(db, session_id, last_id)
+        sync_token = f"{row.version}.{last_id}.{count}"
+
     return {
         "session_id": session_id,
-        "messages": [{"role": m.role, "content": m.content, "created_at": m.created_at.isoformat() if m.created_at else None} for m in msgs]
+        "messages": rows,
+        "has_more": has_more,
+        "prev_cursor": encode_cursor(msgs[0].created_at, msgs[0].id) if msgs else before,
+        "next_cursor": encode_cursor(msgs[-1].created_at, msgs[-1].id) if msgs else after,
+        "delta": delta,
+        "sync_token": sync_token,
     }
 
 # 3) ส่งข้อความ (chat) + บันทึกลง DB
@@ -129,61 +397,70 @@ def chat(session_id: int, payload: dict, db: Session = Depends(get_db)):
     s = db.query(ChatSession).filter(ChatSession.id == session_id).first()
     if not s:
         return JSONResponse({"error": "Session not found"}, status_code=404)
+    if s.archived_at is not None:
+        archiver.rehydrate(session_id)
+
+    # เขียนตรง (ไม่ผ่าน write-behind): ให้ message ที่ค้างของ session นี้ลงก่อน ลำดับจะได้ไม่สลับ
+    write_barrier(session_id)
+
+    # rate limit ก่อนบันทึกอะไร (โดน 429 แล้วไม่มี user message ค้าง)
+    reserved = admit_llm_call(session_id, user_text)
 
-    # save user msg
-    db.add(ChatMessage(session_id=session_id, role="user", content=user_text))
-    db.commit()
-    
     # ✅ Auto-title: ถ้าเป็นข้อความแรกของห้อง และ title ยังเป็นค่า default
-    DEFAULT_TITLES = {"New Chat", "Study Chat"}
-    total = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
+    # ใช้ heuristic title ไปก่อน แล้วให้ Gemini ปรับใน background (ไม่ block คำตอบ)
+    placeholder = None
+    if s.last_message_at is None and s.title in DEFAULT_TITLES:
+        placeholder = heuristic_title(user_text)
+        s.title = placeholder
 
-    if total == 1 and (s.title in DEFAULT_TITLES):
-        try:
-            new_title = generate_chat_title(user_text)
-            s.title = new_title[:200]
-            db.commit()
-        except Exception:
-            # ไม่ให้พังทั้งระบบถ้า gen title fail
-            db.rollback()
-            pass
+    # save user msg
+    add_message(db, session_id, "user", user_text)
+    db.commit()
 
+    if placeholder:
+        task_queue.enqueue(refine_title, session_id, user_text, placeholder)
 
-    # fetch recent messages for context (last 20)
-    recent = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .limit(20)
-        .all()
-    )
-    recent = list(reversed(recent))
-    context = [{"role": m.role, "content": m.content} for m in recent]
+    # fetch recent messages for context (ผ่าน context cache, ตัดตาม token budget ตอนสร้าง prompt)
+    context = recent_context(db, session_id)
+    summary = get_summary(db, session_id)
 
-    # ask gemini
-    answer = chat_reply(context, level=level)
+    # ask gemini (คำถามแรกของ session ลองหาใน response cache ก่อน)
+    cacheable = is_cacheable(context, summary)
+    answer = response_cache.get(user_text, level) if cacheable else None
+    if answer is None:
+        try:
+            answer = chat_reply(context, level=level, summary=summary)
+        except Exception:
+            rate_limiter.settle(session_id, reserved, 0, called=False)
+            raise
+        rate_limiter.settle(session_id, reserved, used_tokens(context, summary, answer))
+        if cacheable:
+            response_cache.put(user_text, level, answer)
+    else:
+        rate_limiter.settle(session_id, reserved, 0, called=False)
 
     # save assistant msg
-    db.add(ChatMessage(session_id=session_id, role="assistant", content=answer))
+    add_message(db, session_id, "assistant", answer)
     db.commit()
 
+    # อัปเดต rolling summary หลังตอบ (ไม่ block response)
+    task_queue.enqueue(refresh_summary, session_id)
+
     return {"reply": answer, "session_title": s.title}
 
-# 4) Export PDF ทั้งบทสนทนา
+# 4) Export PDF ทั้งบทสนทนา (render ใน process pool ลงไฟล์ชั่วคราว แล้ว stream กลับ)
 @app.post("/api/sessions/{session_id}/export-pdf")
-def export_pdf(session_id: int, db: Session = Depends(get_db)):
-    msgs = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
-        .all()
-    )
-    payload_msgs = [{"role": m.role, "content": m.content} for m in msgs]
-    pdf_bytes = chat_to_pdf_bytes("Study Chat", payload_msgs)
-    return Response(
-        content=pdf_bytes,
+async def export_pdf(session_id: int, request: Request):
+    # อ่านอย่างเดียว: render จาก replica ได้ (ถ้าไม่ติด stickiness)
+    replica = route_read(request)
+    if await archiver.rehydrate_async(session_id):
+        replica = None
+    path = await render_session_pdf(session_id, "Study Chat", replica=replica)
+    return FileResponse(
+        path,
         media_type="application/pdf",
-        headers={"Content-Disposition": 'attachment; filename="study-chat.pdf"'},
+        filename="study-chat.pdf",
+        background=BackgroundTask(remove_file, path),
     )
 
 @app.post("/api/sessions/{session_id}/regenerate")
@@ -191,182 +468,248 @@ def regenerate(session_id: int, db: Session = Depends(get_db)):
     s = db.query(ChatSession).filter(ChatSession.id == session_id).first()
     if not s:
         raise HTTPException(404, "Session not found")
+    if s.archived_at is not None:
+        archiver.rehydrate(session_id)
+    write_barrier(session_id)
 
-    messages = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .all()
-    )
+    # ไม่ต้องโหลดทั้ง history: หา message ล่าสุดของแต่ละ role ผ่าน index
+    def last_of(role: str):
+        return (
+            db.query(ChatMessage)
+            .filter(ChatMessage.session_id == session_id, ChatMessage.role == role)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .first()
+        )
 
-    last_user = next((m for m in messages if m.role == "user"), None)
-    last_assistant = next((m for m in messages if m.role == "assistant"), None)
+    last_user = last_of("user")
+    last_assistant = last_of("assistant")
 
     if not last_user:
         raise HTTPException(400, "No user message to regenerate")
 
+    reserved = admit_llm_call(session_id, last_user.content)
+
     if last_assistant:
         db.delete(last_assistant)
+        db.execute(bump_version(session_id, rewrite=True))
         db.commit()
 
-    recent = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .limit(20)
-        .all()
-    )
-    recent = list(reversed(recent))
-    context = [{"role": m.role, "content": m.content} for m in recent]
+    context = recent_context(db, session_id)
+    summary = get_summary(db, session_id)
 
-    reply = chat_reply(context, level="beginner")
+    try:
+        reply = chat_reply(context, level="beginner", summary=summary)
+    except Exception:
+        rate_limiter.settle(session_id, reserved, 0, called=False)
+        raise
+    rate_limiter.settle(session_id, reserved, used_tokens(context, summary, reply))
 
-    db.add(ChatMessage(session_id=session_id, role="assistant", content=reply))
+    add_message(db, session_id, "assistant", reply)
     db.commit()
+    task_queue.enqueue(refresh_summary, session_id)
 
     return {"reply": reply}
 
-@app.post("/api/sessions/{session_id}/chat/stream")
-def chat_stream(session_id: int, payload: dict, db: Session = Depends(get_db)):
-    user_text = (payload.get("message") or "").strip()
-    if not user_text:
-        raise HTTPException(400, "Empty message")
-
-    # ✅ query session ก่อน
-    s = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    if not s:
-        raise HTTPException(404, "Session not found")
-
-    # ✅ level ใช้ของ session เป็น default
-    level = (payload.get("level") or s.level or "beginner").strip()
-
-    # ✅ save user msg
-    db.add(ChatMessage(session_id=session_id, role="user", content=user_text))
-    db.commit()
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
 
-    # ✅ context
-    recent = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .limit(20)
-        .all()
-    )
-    recent = list(reversed(recent))
-    context = [{"role": m.role, "content": m.content} for m in recent]
+def write_barrier(session_id: int):
+    # sync endpoint ที่จะเขียน / ลบตรง ๆ: รอ write-behind ของ session นี้ก่อน, ไม่ทันก็ 503 (อย่าเขียนสลับลำดับ)
+    try:
+        message_writer.barrier(session_id)
+    except WritesPending as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": "1"})
 
-    # ✅ auto-title (เหมือนเดิม)
-    DEFAULT_TITLES = {"New Chat", "Study Chat"}
+def admit_llm_call(session_id: int, text: str) -> int:
+    # token bucket ต่อ session + global; คืน token ที่จองไว้ให้ settle ตอนตอบเสร็จ
     try:
-        total = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
-        if total == 1 and (s.title in DEFAULT_TITLES):
-            new_title = generate_chat_title(user_text)
-            s.title = (new_title or "Study Chat")[:200]
-            db.commit()
-    except Exception:
-        db.rollback()
+        return rate_limiter.acquire(session_id, reserve_tokens(text))
+    except RateLimited as e:
+        raise HTTPException(429, str(e), headers={"Retry-After": e.retry_after_header})
 
-    def event_generator():
-        full = ""
-        try:
-            for chunk in chat_reply_stream(context, level):
-                if not chunk:
-                    continue
-                full += chunk
-                yield sse_data(chunk)
-
-            db2 = SessionLocal()
-            try:
-                db2.add(ChatMessage(session_id=session_id, role="assistant", content=full))
-                db2.commit()
-            finally:
-                db2.close()
-
-            yield "event: done\ndata: ok\n\n"
-        except Exception as e:
-            yield f"event: error\ndata: {str(e)}\n\n"
-
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
-    )
+async def admit_llm_call_async(session_id: int, text: str) -> int:
+    # เหมือน admit_llm_call แต่ไม่ block event loop (redis backend)
+    try:
+        return await rate_limiter.acquire_async(session_id, reserve_tokens(text))
+    except RateLimited as e:
+        raise HTTPException(429, str(e), headers={"Retry-After": e.retry_after_header})
 
+def stream_response(gen, after: int = 0) -> StreamingResponse:
+    headers = {**SSE_HEADERS, "X-Generation-Id": gen.id}
+    return StreamingResponse(sse_subscribe(gen, after), media_type="text/event-stream", headers=headers)
 
-@app.post("/api/sessions/{session_id}/regenerate/stream")
-def regenerate_stream(session_id: int, db: Session = Depends(get_db)):
-    s = db.query(ChatSession).filter(ChatSession.id == session_id).first()
-    if not s:
-        raise HTTPException(404, "Session not found")
+@app.post("/api/sessions/{session_id}/chat/stream")
+async def chat_stream(session_id: int, payload: dict, db: AsyncSession = Depends(get_async_db)):
+    user_text = (payload.get("message") or "").strip()
+    if not user_text:
+        raise HTTPException(400, "Empty message")
 
-    # ✅ ดึงล่าสุด (ใหม่ -> เก่า)
-    messages = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .all()
-    )
+    async with generations.session_lock(session_id):
+        # ✅ single-flight: ข้อความเดิมส่งซ้ำระหว่างที่ยัง generate อยู่ -> ต่อ stream เดิม
+        # ข้อความอื่น -> รอ generation ที่รันอยู่จบก่อน (ทีละ generation ต่อ session)
+        req_level = (payload.get("level") or "").strip()
+        active = await generations.claim(
+            session_id,
+            lambda g: g.kind == "chat" and g.prompt == user_text and (not req_level or g.level == req_level),
+        )
+        if active is not None:
+            return stream_response(active)
+
+        # ✅ query session ก่อน
+        s = await db.get(ChatSession, session_id)
+        if not s:
+            raise HTTPException(404, "Session not found")
+        # session เก่าที่ archive ไว้: ย้าย messages กลับก่อน (context / history ต้องครบ)
+        if s.archived_at is not None:
+            await archiver.rehydrate_async(session_id)
+
+        # ✅ level ใช้ของ session เป็น default
+        level = req_level or (s.level or "beginner").strip()
+
+        # ✅ rate limit (stream ที่ต่อของเดิมด้านบนไม่นับ)
+        reserved = await admit_llm_call_async(session_id, user_text)
+
+        # ✅ auto-title: heuristic ทันที, Gemini title มาทีหลังผ่าน SSE event "title"
+        placeholder = None
+        if s.last_message_at is None and s.title in DEFAULT_TITLES and not pending_writes.snapshot(session_id):
+            placeholder = heuristic_title(user_text)
+
+        # ✅ save user msg (+ placeholder title) ผ่าน write-behind: ไม่มี commit บน request path
+        # ข้อความนี้เห็นใน context / get_messages ทันทีแม้ยังไม่ flush
+        user_msg = await message_writer.persist(session_id, "user", user_text, title=placeholder, db=db)
+
+        title_fut = None
+        if placeholder:
+            title_fut = title_waiter(session_id)
+            task_queue.enqueue(refine_title, session_id, user_text, placeholder)
+
+        # ✅ context
+        context = await recent_context_async(db, session_id)
+        summary = await get_summary_async(db, session_id)
+
+        # ✅ response cache (เฉพาะคำถามแรกของ session)
+        cacheable = is_cacheable(context, summary)
+        cached = response_cache.get(user_text, level) if cacheable else None
+
+        # คืน connection ให้ pool ก่อน stream (ไม่งั้นทุก stream จะถือ connection ไว้จนจบ)
+        await db.close()
+
+        if cached is not None:
+            source = replay(cached)
+        else:
+            source = chat_reply_stream_async(context, level, summary=summary)
+
+        async def finish(answer: str):
+            # persist ใน generation task (ไม่ขึ้นกับ connection ของ client)
+            # รอ batch commit ก่อนส่ง done (done = คำตอบลง DB แล้ว)
+            # settle ก่อน persist: model ตอบครบแล้ว ถึง persist fail token ก็ใช้ไปแล้ว
+            if cached is not None:
+                await rate_limiter.settle_async(session_id, reserved, 0, called=False)
+            else:
+                await rate_limiter.settle_async(session_id, reserved, used_tokens(context, summary, answer))
+            # after=user_msg: คำถาม flush ไม่ผ่าน -> ไม่บันทึกคำตอบ (error ไปที่ stream)
+            await message_writer.persist(session_id, "assistant", answer, after=user_msg, wait=True)
+            task_queue.enqueue(refresh_summary, session_id)
+            if cacheable and cached is None:
+                response_cache.put(user_text, level, answer)
+
+        async def failed(partial: str):
+            # model error / ถูก cancel: คืน token ที่จองไว้ (คิดเฉพาะส่วนที่ได้มาแล้ว)
+            called = cached is None and bool(partial)
+            await rate_limiter.settle_async(session_id, reserved, used_tokens(context, summary, partial) if called else 0, called=called)
+
+        gen = generations.start(
+            session_id, source, finish, failed, key=(session_id, user_msg.ref, level), prompt=user_text
+        )
+        if placeholder:
+            gen.publish("title", placeholder)
+        if title_fut is not None:
+            def on_title(f):
+                if not f.cancelled() and f.exception() is None:
+                    gen.publish("title", f.result())
 
-    last_user = next((m for m in messages if m.role == "user"), None)
-    last_assistant = next((m for m in messages if m.role == "assistant"), None)
+            title_fut.add_done_callback(on_title)
+            gen.task.add_done_callback(lambda _: drop_title_waiter(session_id, title_fut))
 
-    if not last_user:
-        raise HTTPException(400, "No user message to regenerate")
+    return stream_response(gen)
 
-    # ✅ อย่าลบ assistant ก่อน stream (ถ้า stream fail จะหาย)
-    # context ใช้ 20 ข้อความล่าสุด (ยังมี assistant เก่าอยู่ก็ไม่เป็นไร)
-    recent = (
-        db.query(ChatMessage)
-        .filter(ChatMessage.session_id == session_id)
-        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
-        .limit(20)
-        .all()
-    )
-    recent = list(reversed(recent))
-    context = [{"role": m.role, "content": m.content} for m in recent]
 
-    def event_gen():
-        full = ""
-        try:
-            for chunk in chat_reply_stream(context, level="beginner"):
-                if not chunk:
-                    continue
-                full += chunk
-                yield sse_data(chunk)
-
-            # ✅ stream สำเร็จค่อย “replace” ใน Session ใหม่แบบ atomic
-            db2 = SessionLocal()
-            try:
-                # ลบ assistant เก่าล่าสุด (ถ้ามี)
-                if last_assistant:
-                    obj = db2.query(ChatMessage).filter(ChatMessage.id == last_assistant.id).first()
-                    if obj:
-                        db2.delete(obj)
-                        db2.flush()
-
-                # insert assistant ใหม่
-                db2.add(ChatMessage(session_id=session_id, role="assistant", content=full))
-                db2.commit()
-            finally:
-                db2.close()
-
-            yield "event: done\ndata: ok\n\n"
-        except Exception as e:
-            yield f"event: error\ndata: {str(e)}\n\n"
-
-    return StreamingResponse(
-        event_gen(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
-    )
+@app.post("/api/sessions/{session_id}/regenerate/stream")
+async def regenerate_stream(session_id: int, db: AsyncSession = Depends(get_async_db)):
+    level = "beginner"
+    async with generations.session_lock(session_id):
+        s = await db.get(ChatSession, session_id)
+        if not s:
+            raise HTTPException(404, "Session not found")
+        if s.archived_at is not None:
+            await archiver.rehydrate_async(session_id)
+
+        # ✅ ดึงล่าสุด (ใหม่ -> เก่า)
+        async def last_of(role: str):
+            result = await db.execute(
+                select(ChatMessage)
+                .where(ChatMessage.session_id == session_id, ChatMessage.role == role)
+                .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+                .limit(1)
+            )
+            return result.scalars().first()
+
+        # อ่าน message ล่าสุดจาก DB ตรง ๆ -> ให้ที่ค้างใน write-behind ลงก่อน
+        await message_writer.drain_session(session_id)
+        last_user = await last_of("user")
+        if not last_user:
+            raise HTTPException(400, "No user message to regenerate")
+
+        # ✅ single-flight: กด regenerate ซ้ำ / มี generation ตอบข้อความเดียวกันอยู่ -> ต่อ stream เดิม
+        key = (session_id, last_user.id, level)
+        await db.close()
+        active = await generations.claim(session_id, lambda g: g.key == key)
+        if active is not None:
+            return stream_response(active)
+
+        # อาจรอ generation ก่อนหน้าจบ -> ข้อความล่าสุดเปลี่ยนได้ อ่านใหม่หลังรอ
+        last_user = await last_of("user")
+        if not last_user:
+            # ถูกลบ / เปลี่ยนไประหว่างรอ
+            raise HTTPException(400, "No user message to regenerate")
+        last_assistant = await last_of("assistant")
+        key = (session_id, last_user.id, level)
+        reserved = await admit_llm_call_async(session_id, last_user.content)
+
+        # ✅ อย่าลบ assistant ก่อน stream (ถ้า stream fail จะหาย)
+        # context ใช้ข้อความล่าสุด (ยังมี assistant เก่าอยู่ก็ไม่เป็นไร)
+        context = await recent_context_async(db, session_id)
+        summary = await get_summary_async(db, session_id)
+        last_assistant_id = last_assistant.id if last_assistant else None
+        await db.close()
+
+        async def finish(answer: str):
+            # ✅ stream สำเร็จค่อย “replace”: ลบ assistant เก่า + insert ใหม่ใน batch (transaction) เดียวกัน
+            await rate_limiter.settle_async(session_id, reserved, used_tokens(context, summary, answer))
+            await message_writer.persist(session_id, "assistant", answer, replaces=last_assistant_id, wait=True)
+            task_queue.enqueue(refresh_summary, session_id)
+
+        async def failed(partial: str):
+            await rate_limiter.settle_async(session_id, reserved, used_tokens(context, summary, partial) if partial else 0, called=bool(partial))
+
+        source = chat_reply_stream_async(context, level=level, summary=summary)
+        gen = generations.start(session_id, source, finish, failed, kind="regenerate", key=key)
+
+    return stream_response(gen)
+
+@app.get("/api/sessions/{session_id}/stream")
+async def resume_stream(session_id: int, request: Request, generation_id: str | None = None, last_event_id: int | None = None):
+    # reconnect: replay จาก buffer ของ generation ตั้งแต่ Last-Event-ID (ไม่เรียก Gemini ใหม่)
+    gen = generations.get(generation_id) if generation_id else generations.latest(session_id)
+    if gen is None or gen.session_id != session_id:
+        raise HTTPException(404, "No generation to resume")
+
+    after = parse_last_event_id(request.headers.get("last-event-id", last_event_id))
+    generations.resumes += 1
+    return stream_response(gen, after=min(after, gen.seq))
 
 @app.patch("/api/sessions/{session_id}/level")
 def update_session_level(session_id: int, payload: dict, db: Session = Depends(get_db)):
@@ -379,5 +722,6 @@ def update_session_level(session_id: int, payload: dict, db: Session = Depends(g
         raise HTTPException(404, "Session not found")
 
     s.level = level
+    db.execute(bump_version(session_id))
     db.commit()
     return {"ok": True, "level": s.level}
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from sqlalchemy import event, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .context_cache import context_cache
+from .context_window import MAX_MESSAGES
+from .models import ChatSession, ChatMessage
+
+# ทุกที่ที่เขียน ChatMessage ให้ผ่าน helper นี้
+# เพื่ออัปเดต last_message_at / last_preview ของ session ใน transaction เดียวกัน
+# และ write-through เข้า context cache หลัง commit
+# message ที่ยังอยู่ใน write-behind queue (app/write_behind.py) อยู่ใน pending_writes
+# ตอนอ่าน (context / get_messages) รวมเข้าไปด้วย (read-your-writes)
+
+PREVIEW_LEN = 80
+CONTEXT_LIMIT = MAX_MESSAGES
+
+def make_preview(content: str) -> str:
+    content = content or ""
+    return (content[:PREVIEW_LEN] + "…") if len(content) > PREVIEW_LEN else content
+
+def _touch_session(session_id: int, content: str):
+    return (
+        update(ChatSession)
+        .where(ChatSession.id == session_id)
+        .values(last_message_at=func.now(), last_preview=make_preview(content), version=ChatSession.version + 1)
+    )
+
+def bump_version(session_id: int, rewrite: bool = False):
+    # session เปลี่ยน (rename / level / ลบ message) -> ETag ใหม่
+    # rewrite = ลบ / แทน message เดิม: client ที่ถือ delta token ก่อนหน้านี้ต้องโหลดใหม่ทั้งหน้า
+    values = {"version": ChatSession.version + 1}
+    if rewrite:
+        values["history_version"] = ChatSession.version + 1
+    return update(ChatSession).where(ChatSession.id == session_id).values(**values)
+
+@dataclass(eq=False)
+class PendingMessage:
+    session_id: int
+    role: str
+    content: str
+    # ลบ message นี้ใน transaction เดียวกัน (regenerate แทนคำตอบเดิม)
+    replaces: int | None = None
+    # ตั้ง title ของ session พร้อมกัน (heuristic title ของข้อความแรก)
+    title: str | None = None
+    # message ที่ต้องลง DB ก่อน (คำถามของคำตอบนี้): ถ้า fail -> message นี้ fail ตาม ไม่มีคำตอบลอย ๆ
+    after: "PendingMessage | None" = None
+    seq: int = 0
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # ใส่ก่อน commit ของ batch (reader ใช้ตัด row ที่ flush ไปแล้วออกจาก overlay)
+    id: int | None = None
+    error: Exception | None = None
+    future: asyncio.Future | None = None
+
+    @property
+    def ref(self):
+        # อ้างถึง message ได้ก่อนรู้ id จริง (เช่น key ของ single-flight)
+        return self.id if self.id is not None else f"pending:{self.seq}"
+
+    def as_row(self) -> dict:
+        return {
+            "id": self.id,
+            "role": self.role,
+            "content": self.content,
+            "created_at": self.created_at.isoformat(),
+            "pending": True,
+        }
+
+class PendingWrites:
+    # message ที่ enqueue แล้วแต่ยังไม่ commit (อ่านได้จาก threadpool ด้วย)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_session: dict[int, list[PendingMessage]] = {}
+
+    def add(self, msg: PendingMessage):
+        with self._lock:
+            self._by_session.setdefault(msg.session_id, []).append(msg)
+
+    def discard(self, msgs: list[PendingMessage]):
+        with self._lock:
+            for m in msgs:
+                group = self._by_session.get(m.session_id)
+                if group is None:
+                    continue
+                group.remove(m)
+                if not group:
+                    del self._by_session[m.session_id]
+
+    def snapshot(self, session_id: int) -> list[PendingMessage]:
+        with self._lock:
+            return list(self._by_session.get(session_id, ()))
+
+    def count(self) -> tuple[int, int]:
+        with self._lock:
+            return sum(len(g) for g in self._by_session.values()), len(self._by_session)
+
+pending_writes = PendingWrites()
+
+def merge_pending(rows: list[dict], pending: list[PendingMessage]) -> list[dict]:
+    # rows (เก่า -> ใหม่) จาก DB + pending ต่อท้าย; snapshot pending ต้องเอามาก่อน query
+    # (message ที่ flush ระหว่างนั้นมี id แล้ว -> ถ้าอยู่ใน rows ก็ไม่ซ้ำ)
+    if not pending:
+        return rows
+    ids = {r["id"] for r in rows}
+    replaced = {p.replaces for p in pending if p.replaces}
+    merged = [r for r in rows if r["id"] not in replaced]
+    merged += [p.as_row() for p in pending if p.id is None or p.id not in ids]
+    return merged
+
+def _queue_cache_append(db: Session, session_id: int, role: str, content: str):
+    db.info.setdefault("ctx_append", []).append((session_id, role, content))
+
+def add_message(db: Session, session_id: int, role: str, content: str) -> ChatMessage:
+    msg = ChatMessage(session_id=session_id, role=role, content=content)
+    db.add(msg)
+    db.execute(_touch_session(session_id, content))
+    _queue_cache_append(db, session_id, role, content)
+    return msg
+
+async def add_message_async(db: AsyncSession, session_id: int, role: str, content: str) -> ChatMessage:
+    msg = ChatMessage(session_id=session_id, role=role, content=content)
+    db.add(msg)
+    await db.execute(_touch_session(session_id, content))
+    _queue_cache_append(db.sync_session, session_id, role, content)
+    return msg
+
+# ----- context (last N messages) ผ่าน cache -----
+
+def _recent_query(session_id: int, limit: int):
+    return (
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(limit)
+    )
+
+def recent_context(db: Session, session_id: int, limit: int = CONTEXT_LIMIT) -> list[dict]:
+    cached = context_cache.get(session_id)
+    if cached is not None:
+        return cached[-limit:]
+
+    token = context_cache.token(session_id)
+    pending = pending_writes.snapshot(session_id)
+    rows = db.execute(_recent_query(session_id, limit)).all()
+    context = _context_rows(rows, pending, limit)
+    context_cache.fill(session_id, context, token)
+    return context
+
+async def recent_context_async(db: AsyncSession, session_id: int, limit: int = CONTEXT_LIMIT) -> list[dict]:
+    cached = context_cache.get(session_id)
+    if cached is not None:
+        return cached[-limit:]
+
+    token = context_cache.token(session_id)
+    pending = pending_writes.snapshot(session_id)
+    rows = (await db.execute(_recent_query(session_id, limit))).all()
+    context = _context_rows(rows, pending, limit)
+    context_cache.fill(session_id, context, token)
+    return context
+
+def _context_rows(rows, pending: list[PendingMessage], limit: int) -> list[dict]:
+    merged = merge_pending([{"id": r.id, "role": r.role, "content": r.content} for r in reversed(rows)], pending)
+    return [{"role": m["role"], "content": m["content"]} for m in merged[-limit:]]
+
+# ----- cache hooks (ทำงานกับทั้ง Session และ AsyncSession) -----
+
+@event.listens_for(Session, "after_flush")
+def _track_deletes(session, flush_context):
+    for obj in session.deleted:
+        if isinstance(obj, ChatMessage):
+            session.info.setdefault("ctx_invalidate", set()).add(obj.session_id)
+        elif isinstance(obj, ChatSession):
+            session.info.setdefault("ctx_invalidate", set()).add(obj.id)
+
+@event.listens_for(Session, "after_commit")
+def _apply_cache_writes(session):
+    for session_id, role, content in session.info.pop("ctx_append", []):
+        context_cache.append(session_id, role, content)
+    for session_id in session.info.pop("ctx_invalidate", ()):
+        context_cache.invalidate(session_id)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_cache_writes(session, previous_transaction):
+    session.info.pop("ctx_append", None)
+    session.info.pop("ctx_invalidate", None)
@@ -0,0 +1,331 @@
+import asyncio
+import bisect
+import contextvars
+import math
+import os
+import threading
+import time
+
+from .context_window import estimate_tokens
+
+# Metrics แบบ Prometheus (text format 0.0.4) ที่ GET /metrics
+# - Counter / Histogram เขียนเองแบบเบา ๆ (ไม่ต้องพึ่ง prometheus_client): observe = lock + bisect
+# - gauge อ่านค่า ณ ตอน scrape ผ่าน collector (pool ของ engine, task queue, rate limit ...)
+# - MetricsMiddleware: เวลาต่อ endpoint (label = route template ไม่ใช่ path จริง) + จำนวน query ต่อ request
+# - instrument_engine(): นับ / จับเวลา query ทุกตัวผ่าน SQLAlchemy cursor events
+# - llm_call(): TTFT / เวลารวม / token (ประมาณ) ต่อ kind + level
+# METRICS_ENABLED=0 -> ไม่ติด middleware / engine events (endpoint ยังตอบได้แต่ไม่มีข้อมูล)
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in {"0", "false", "no"}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        # child ต่อชุด label cache ไว้ (hot path ไม่ต้องสร้าง object ใหม่)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> list[str]:
+        out = self.header()
+        for values, child in list(self._children.items()):
+            out.append(f"{self.name}{_labels(self.labelnames, values)} {_num(child.value)}")
+        return out
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # counts[i] = จำนวนที่ตกช่อง i (ไม่สะสม), ช่องสุดท้าย = +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> list[str]:
+        out = self.header()
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            acc = 0
+            for le, n in zip(self.buckets + (math.inf,), counts):
+                acc += n
+                le_label = 'le="' + _num(le) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, values, le_label)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_num(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, values)} {acc}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors = []
+
+    def counter(self, name: str, help: str, labelnames: tuple = ()) -> Counter:
+        m = Counter(name, help, labelnames)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(m)
+        return m
+
+    def collector(self, fn):
+        # fn() -> iterable ของ (name, help, [(labels dict, value), ...]) เป็น gauge อ่านตอน scrape
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        out = []
+        for m in self._metrics:
+            out.extend(m.render())
+        # collector หลายตัวอาจส่งชื่อเดียวกัน (เช่น pool ของ engine sync / async) -> รวมเป็น family เดียว
+        gauges: dict[str, tuple[str, list]] = {}
+        for fn in self._collectors:
+            for name, help, samples in fn():
+                gauges.setdefault(name, (help, []))[1].extend(samples)
+        for name, (help, samples) in gauges.items():
+            out += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            for labels, value in samples:
+                if value is not None:
+                    out.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(value)}")
+        return "\n".join(out) + "\n"
+
+
+registry = Registry()
+
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Request duration until the last body byte (SSE: whole stream)",
+    ("method", "route", "status"),
+)
+DB_QUERIES_PER_REQUEST = registry.histogram(
+    "db_queries_per_request", "SQL statements executed while handling a request", ("route",), COUNT_BUCKETS,
+)
+DB_QUERY_DURATION = registry.histogram(
+    "db_query_duration_seconds", "SQL statement duration", ("engine", "statement"), QUERY_BUCKETS,
+)
+LLM_TTFT = registry.histogram("llm_ttft_seconds", "Time to first model token", ("kind", "level"))
+LLM_DURATION = registry.histogram("llm_duration_seconds", "Model call duration", ("kind", "level", "outcome"))
+LLM_EVENTS = registry.counter(
+    "llm_router_events_total", "Hedges, retries, fallbacks, timeouts and retryable errors", ("kind", "event"),
+)
+LLM_TOKENS = registry.counter("llm_tokens_total", "Estimated model tokens", ("kind", "level", "direction"))
+LLM_COMPLETION_TOKENS = registry.histogram(
+    "llm_completion_tokens", "Estimated completion tokens per call", ("kind", "level"), TOKEN_BUCKETS,
+)
+SSE_DURATION = registry.histogram("sse_stream_duration_seconds", "SSE response duration", ("outcome",))
+SSE_TTFB = registry.histogram("sse_ttfb_seconds", "SSE time to first frame")
+PDF_RENDER = registry.histogram("pdf_render_seconds", "PDF export render time (incl. pool wait)", ("mode",))
+WRITE_BEHIND_BATCH = registry.histogram(
+    "write_behind_batch_size", "Messages per write-behind flush", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+WRITE_BEHIND_FLUSH = registry.histogram("write_behind_flush_seconds", "Write-behind flush duration", buckets=QUERY_BUCKETS)
+DB_POOL_WAIT = registry.histogram(
+    "db_pool_wait_seconds", "Time to get a connection from the pool", ("engine",),
+    (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DB_POOL_TIMEOUTS = registry.counter("db_pool_timeouts_total", "Pool checkouts that hit DB_POOL_TIMEOUT", ("engine",))
+DB_READS = registry.counter("db_reads_total", "Read-only requests by target engine", ("target", "reason"))
+HTTP_CONDITIONAL = registry.counter(
+    "http_conditional_total", "ETag reads: miss / modified / not_modified (304) / uncacheable", ("route", "result"),
+)
+HTTP_COMPRESSED_BYTES = registry.counter("http_compressed_bytes_total", "JSON body bytes before / after compression", ("kind",))
+ARCHIVE_SESSIONS = registry.counter("archive_sessions_total", "Sessions moved to / back from the archive", ("event",))
+ARCHIVE_REHYDRATE = registry.histogram(
+    "archive_rehydrate_seconds", "Time to move an archived session back into chat_messages", buckets=QUERY_BUCKETS,
+)
+
+
+# จำนวน query ของ request ปัจจุบัน (list 1 ช่อง: context ที่ copy ไป threadpool / task ยังชี้ list เดียวกัน)
+_request_queries: contextvars.ContextVar[list | None] = contextvars.ContextVar("request_queries", default=None)
+
+
+class MetricsMiddleware:
+    # pure ASGI (ไม่ใช้ BaseHTTPMiddleware: ไม่ต้อง wrap body ของ StreamingResponse)
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        queries = [0]
+        token = _request_queries.set(queries)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_queries.reset(token)
+            route = scope.get("route")
+            # path ที่ไม่ match route ไม่ใส่เป็น label (กัน cardinality ระเบิด)
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_DURATION.labels(scope["method"], path, str(status)).observe(time.perf_counter() - t0)
+            DB_QUERIES_PER_REQUEST.labels(path).observe(queries[0])
+
+
+def _statement_kind(statement: str) -> str:
+    head = statement.lstrip()[:8].split(None, 1)
+    kind = head[0].lower() if head else ""
+    return kind if kind in {"select", "insert", "update", "delete", "with"} else "other"
+
+
+def instrument_engine(engine, name: str):
+    # engine = sync Engine (async engine ส่ง .sync_engine)
+    from sqlalchemy import event
+
+    if not METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("_metrics_t0")
+        if stack:
+            DB_QUERY_DURATION.labels(name, _statement_kind(statement)).observe(time.perf_counter() - stack.pop())
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[0] += 1
+
+    @registry.collector
+    def _pool():
+        # QueuePool เท่านั้นที่มีตัวเลขพวกนี้ (NullPool / StaticPool ข้าม)
+        pool = engine.pool
+        if not hasattr(pool, "checkedout"):
+            return
+        labels = {"engine": name}
+        yield "db_pool_size", "Configured pool size", [(labels, pool.size())]
+        yield "db_pool_checked_out", "Connections currently checked out", [(labels, pool.checkedout())]
+        # overflow() ติดลบตอนยังไม่เต็ม pool
+        yield "db_pool_overflow", "Connections opened above pool size", [(labels, max(pool.overflow(), 0))]
+
+
+class llm_call:
+    # with llm_call("stream", level, prompt) as call: ... call.chunk(text)
+    # ใช้ได้ทั้งใน generator sync / async; ออกด้วย GeneratorExit / CancelledError = cancelled
+    __slots__ = ("kind", "level", "prompt", "t0", "ttft", "parts")
+
+    def __init__(self, kind: str, level: str, prompt: str):
+        self.kind = kind
+        self.level = level
+        self.prompt = prompt
+        self.ttft = None
+        self.parts: list[str] = []
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def chunk(self, text: str):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.t0
+            LLM_TTFT.labels(self.kind, self.level).observe(self.ttft)
+        self.parts.append(text)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        LLM_DURATION.labels(self.kind, self.level, outcome).observe(time.perf_counter() - self.t0)
+        completion = estimate_tokens("".join(self.parts)) if self.parts else 0
+        LLM_TOKENS.labels(self.kind, self.level, "prompt").inc(estimate_tokens(self.prompt))
+        LLM_TOKENS.labels(self.kind, self.level, "completion").inc(completion)
+        LLM_COMPLETION_TOKENS.labels(self.kind, self.level).observe(completion)
+        return False
@@ -0,0 +1,93 @@
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+# Process-wide pool ของ model objects: สร้างครั้งเดียวต่อ (model name, profile)
+# แล้ว reuse ทุก request (ไม่ต้อง configure / สร้าง GenerativeModel ใหม่ทุกครั้ง)
+
+
+class ModelPool:
+    def __init__(self, builder, configure=None):
+        # builder(model_name, system_instruction) -> model object
+        self._builder = builder
+        self._configure = configure
+        self._configured = False
+        self._models: dict[tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_calls = 0
+        self.construct_seconds: dict[str, float] = {}
+
+    def _ensure_configured(self):
+        if self._configured or self._configure is None:
+            return
+        self._configure()
+        self._configured = True
+
+    def get(self, model_name: str, profile: str, system_instruction: str | None = None):
+        key = (model_name, profile)
+        model = self._models.get(key)
+        if model is not None:
+            self.hits += 1
+            return model
+
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self.hits += 1
+                return model
+
+            self._ensure_configured()
+            t0 = time.perf_counter()
+            model = self._builder(model_name, system_instruction)
+            self.construct_seconds[f"{model_name}:{profile}"] = time.perf_counter() - t0
+            self._models[key] = model
+            self.misses += 1
+            return model
+
+    def reset(self):
+        with self._lock:
+            self._models.clear()
+            self._configured = False
+            self.construct_seconds.clear()
+
+    def _enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.total_calls += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextmanager
+    def track(self):
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+
+    @asynccontextmanager
+    async def track_async(self):
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def stats(self) -> dict:
+        return {
+            "models": len(self._models),
+            "hits": self.hits,
+            "misses": self.misses,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_calls": self.total_calls,
+            "construct_ms": {k: round(v * 1000, 3) for k, v in self.construct_seconds.items()},
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, func
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, LargeBinary, func
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -10,13 +10,31 @@ class ChatSession(Base):
     level = Column(String(20), nullable=False, default="beginner")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    # denormalized จาก message ล่าสุด (อัปเดตใน app/messages.py) กัน N+1 ตอน list sessions
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    last_preview = Column(String(120), nullable=True)
+
+    # ไม่ใช่ NULL = messages ย้ายไปอยู่ใน chat_archives แล้ว (app/archive.py) -> rehydrate ก่อนใช้
+    archived_at = Column(DateTime(timezone=True), nullable=True)
+
+    # +1 ทุกครั้งที่ session / messages เปลี่ยน -> ETag ของ list / messages และ delta (?since=)
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # version ล่าสุดที่มีการลบ / แทน message เดิม (regenerate): delta จากก่อนหน้านี้ใช้ไม่ได้ ต้องโหลดใหม่
+    history_version = Column(Integer, nullable=False, default=0, server_default="0")
+
     messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    summary = relationship("ChatSummary", back_populates="session", cascade="all, delete-orphan", uselist=False)
+    archive = relationship("ChatArchive", back_populates="session", cascade="all, delete-orphan", uselist=False)
+
+    __table_args__ = (
+        Index("ix_chat_sessions_created_at_id", "created_at", "id"),
+    )
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), index=True, nullable=False)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
 
     role = Column(String(20), nullable=False)  # "user" | "assistant"
     content = Column(Text, nullable=False)
@@ -24,3 +42,40 @@ class ChatMessage(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     session = relationship("ChatSession", back_populates="messages")
+
+    __table_args__ = (
+        # ทุก endpoint filter session_id แล้ว order by (created_at, id) -> ใช้ index นี้ได้ทั้ง filter + sort
+        Index("ix_chat_messages_session_created_id", "session_id", "created_at", "id"),
+    )
+
+class ChatSummary(Base):
+    # rolling summary ของข้อความเก่าที่หลุด context window (อัปเดตใน background, app/summaries.py)
+    __tablename__ = "chat_summaries"
+
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    content = Column(Text, nullable=False, default="")
+
+    # message ล่าสุดที่ถูกสรุปแล้ว (ครั้งต่อไปสรุปเฉพาะที่ใหม่กว่านี้)
+    covered_message_id = Column(Integer, nullable=True)
+    covered_at = Column(DateTime(timezone=True), nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    session = relationship("ChatSession", back_populates="summary")
+
+class ChatArchive(Base):
+    # messages ของ session ที่ idle นาน: blob เดียวต่อ session (JSON บีบอัด), ย้ายกลับตอนถูกเปิดอีกครั้ง
+    __tablename__ = "chat_archives"
+
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), primary_key=True)
+    codec = Column(String(10), nullable=False, default="zlib")
+    blob = Column(LargeBinary, nullable=False)
+
+    message_count = Column(Integer, nullable=False)
+    # ขนาดก่อน / หลังบีบอัด (รายงานพื้นที่ที่ประหยัดได้ที่ /api/archive)
+    raw_bytes = Column(Integer, nullable=False)
+    stored_bytes = Column(Integer, nullable=False)
+
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    session = relationship("ChatSession", back_populates="archive")
@@ -0,0 +1,35 @@
+import base64
+from datetime import datetime
+
+from sqlalchemy import func, select, tuple_
+
+# Opaque keyset cursor: (created_at, id) -> base64 string
+
+def encode_cursor(created_at: datetime | None, row_id: int) -> str:
+    raw = f"{created_at.isoformat() if created_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        ts, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|", 1)
+        return (datetime.fromisoformat(ts) if ts else None), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def clamp_limit(limit: int | None, default: int = 50, maximum: int = 200) -> int:
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
+
+def keyset_filter(model, cursor: str, older: bool = True):
+    # เทียบกับ created_at ของ row ใน DB ตรง ๆ (sqlite เก็บ CURRENT_TIMESTAMP คนละ format กับ param)
+    # ถ้า row ถูกลบไปแล้วค่อยใช้ timestamp ใน cursor
+    c_at, c_id = decode_cursor(cursor)
+    anchor = func.coalesce(
+        select(model.created_at).where(model.id == c_id).scalar_subquery(),
+        c_at,
+    )
+    if older:
+        return tuple_(model.created_at, model.id) < tuple_(anchor, c_id)
+    return tuple_(model.created_at, model.id) > tuple_(anchor, c_id)
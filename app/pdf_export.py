@@ -0,0 +1,78 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .metrics import PDF_RENDER
+
+# Render PDF ใน process pool (layout ของ ReportLab กิน CPU, ไม่ให้ block event loop / GIL)
+# worker เขียนลงไฟล์ชั่วคราว แล้ว endpoint stream ไฟล์กลับด้วย FileResponse
+# PDF_EXPORT_WORKERS=0 -> render ใน thread แทน
+# ReportLab (pdf_utils) import ตอน export ครั้งแรก หรือใน warm_pdf() ตอน startup แบบ background
+
+PDF_EXPORT_WORKERS = int(os.getenv("PDF_EXPORT_WORKERS", "2"))
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: worker สร้าง engine / connection ของตัวเอง (ไม่ share socket กับ parent)
+        _pool = ProcessPoolExecutor(
+            max_workers=PDF_EXPORT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+def _export(session_id: int, title: str, path: str, replica: int | None) -> str:
+    # module-level เพื่อให้ pickle ไป worker ได้; import ReportLab ใน process ที่ render จริง
+    from .pdf_utils import export_session_pdf
+
+    return export_session_pdf(session_id, title, path, replica=replica)
+
+
+def warm_pdf():
+    # import ReportLab + register font ล่วงหน้า
+    # process mode: parent ไม่ได้ render เอง (worker spawn + import ตอน export ครั้งแรก) -> ข้าม
+    if PDF_EXPORT_WORKERS > 0:
+        return
+    from .pdf_utils import register_fonts
+
+    register_fonts()
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+async def render_session_pdf(session_id: int, title: str, replica: int | None = None) -> str:
+    # replica: index จาก route_read() ของ request (worker process ไม่รู้ stickiness เอง)
+    fd, path = tempfile.mkstemp(prefix="study-chat-", suffix=".pdf")
+    os.close(fd)
+    t0 = time.perf_counter()
+    try:
+        if PDF_EXPORT_WORKERS > 0:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(_get_pool(), _export, session_id, title, path, replica)
+        else:
+            await asyncio.to_thread(_export, session_id, title, path, replica)
+    except BaseException:
+        remove_file(path)
+        raise
+    # วัดฝั่ง parent (worker process ไม่มี registry ร่วมกัน)
+    PDF_RENDER.labels("process" if PDF_EXPORT_WORKERS > 0 else "thread").observe(time.perf_counter() - t0)
+    return path
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,25 +1,29 @@
 from io import BytesIO
+from itertools import islice
+from xml.sax.saxutils import escape
+
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.cidfonts import UnicodeCIDFont
 
-# ✅ ฟอนต์ Unicode (รองรับภาษาไทย)
-pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+_fonts_registered = False
 
-def chat_to_pdf_bytes(title: str, messages: list[dict]) -> bytes:
-    buf = BytesIO()
 
-    doc = SimpleDocTemplate(
-        buf,
-        pagesize=A4,
-        leftMargin=40,
-        rightMargin=40,
-        topMargin=50,
-        bottomMargin=40,
-    )
+def register_fonts():
+    # ✅ ฟอนต์ Unicode (รองรับภาษาไทย) — register ตอน render ครั้งแรก ไม่ใช่ตอน import
+    global _fonts_registered
+    if not _fonts_registered:
+        pdfmetrics.registerFont(UnicodeCIDFont("STSong-Light"))
+        _fonts_registered = True
+
+# จำนวน message ต่อ chunk ตอน build PDF แบบ incremental
+CHUNK_SIZE = 200
 
+
+def _styles():
+    register_fonts()
     styles = getSampleStyleSheet()
 
     styles["Normal"].fontName = "STSong-Light"
@@ -47,20 +51,87 @@ def chat_to_pdf_bytes(title: str, messages: list[dict]) -> bytes:
             textColor="#1f2937",  # slate-800
         )
     )
+    return styles
 
-    story = []
 
-    # Title
-    story.append(Paragraph(title, styles["TitleStyle"]))
-    story.append(Spacer(1, 12))
+def _message_flowables(m: dict, styles) -> list:
+    role = "User" if m.get("role") == "user" else "Assistant"
+    # escape ก่อน (เนื้อหาเป็น markdown/code ที่มี < > & ได้) แล้วค่อยแปลง newline
+    content = escape(m.get("content") or "").replace("\n", "<br/>")
+    return [
+        Paragraph(f"<b>{role}:</b>", styles["RoleStyle"]),
+        Paragraph(content, styles["Normal"]),
+        Spacer(1, 10),
+    ]
+
+
+class _ChunkedStory(list):
+    # story ที่เติม flowables ทีละ chunk ตอน ReportLab เรียก len()
+    # (doc.build ลบ flowable ที่ใช้แล้วออกจาก list) -> ไม่ต้องถือทั้ง story ไว้ใน memory
+    def __init__(self, head: list, chunks):
+        super().__init__(head)
+        self._chunks = chunks
+
+    def __len__(self):
+        n = super().__len__()
+        if n < 8 and self._chunks is not None:
+            for chunk in self._chunks:
+                self.extend(chunk)
+                if super().__len__() >= 8:
+                    break
+            else:
+                self._chunks = None
+            n = super().__len__()
+        return n
+
 
-    for m in messages:
-        role = "User" if m.get("role") == "user" else "Assistant"
-        content = (m.get("content") or "").replace("\n", "<br/>")
+def write_chat_pdf(out, title: str, messages, chunk_size: int = CHUNK_SIZE):
+    # out: path หรือ file object, messages: iterable ของ {role, content} (อ่านทีละ chunk)
+    doc = SimpleDocTemplate(
+        out,
+        pagesize=A4,
+        leftMargin=40,
+        rightMargin=40,
+        topMargin=50,
+        bottomMargin=40,
+    )
+    styles = _styles()
 
-        story.append(Paragraph(f"<b>{role}:</b>", styles["RoleStyle"]))
-        story.append(Paragraph(content, styles["Normal"]))
-        story.append(Spacer(1, 10))
+    def chunks():
+        it = iter(messages)
+        while True:
+            batch = list(islice(it, chunk_size))
+            if not batch:
+                return
+            flowables = []
+            for m in batch:
+                flowables.extend(_message_flowables(m, styles))
+            yield flowables
+
+    # Title
+    head = [Paragraph(escape(title), styles["TitleStyle"]), Spacer(1, 12)]
+    doc.build(_ChunkedStory(head, chunks()))
 
-    doc.build(story)
+
+def chat_to_pdf_bytes(title: str, messages: list[dict]) -> bytes:
+    buf = BytesIO()
+    write_chat_pdf(buf, title, messages)
     return buf.getvalue()
+
+
+def export_session_pdf(session_id: int, title: str, path: str, replica: int | None = None) -> str:
+    # รันใน worker process: stream rows จาก DB (yield_per) แล้ว render ลงไฟล์
+    from sqlalchemy import select
+
+    from .db import read_session
+    from .models import ChatMessage
+
+    with read_session(replica) as db:
+        rows = db.execute(
+            select(ChatMessage.role, ChatMessage.content)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+            .execution_options(yield_per=CHUNK_SIZE)
+        )
+        write_chat_pdf(path, title, ({"role": r.role, "content": r.content} for r in rows))
+    return path
@@ -0,0 +1,350 @@
+import logging
+import math
+import os
+import threading
+import time
+
+from .context_window import build_context, context_tokens, count_tokens
+
+# Rate limit การเรียก Gemini (token bucket) ทั้งต่อ session และรวมทั้ง process / ทุก worker
+# - นับ 2 อย่าง: จำนวน request และ token (ประมาณ)
+# - ตอนรับ request จองไว้ = token ของข้อความ + RATE_LIMIT_OUTPUT_TOKENS (ยังไม่รู้ความยาวคำตอบ)
+#   ตอบเสร็จค่อย settle ตามที่ใช้จริง (prompt + answer) คืน / หักส่วนต่าง
+# - bucket เก็บใน backend: memory (ต่อ process) หรือ redis (share กันข้าม uvicorn workers)
+#   async endpoint / background task ใช้ *_async (redis.asyncio ไม่ block event loop), sync endpoint ใช้ตัว sync
+# - เกิน limit -> 429 + Retry-After (endpoint), auto-title ข้ามไปใช้ heuristic title
+# ค่า limit เป็นต่อนาที (burst ได้ถึง 1 นาที), 0 = ไม่จำกัด
+# ปิดไว้เป็น default (เปิดด้วย RATE_LIMIT_ENABLED=1) -> deploy เดิมไม่โดน 429 โดยไม่ได้ตั้งใจ
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "0").lower() in {"1", "true", "yes"}
+RATE_LIMIT_SESSION_RPM = float(os.getenv("RATE_LIMIT_SESSION_RPM", "20"))
+RATE_LIMIT_SESSION_TPM = float(os.getenv("RATE_LIMIT_SESSION_TPM", "60000"))
+RATE_LIMIT_GLOBAL_RPM = float(os.getenv("RATE_LIMIT_GLOBAL_RPM", "300"))
+RATE_LIMIT_GLOBAL_TPM = float(os.getenv("RATE_LIMIT_GLOBAL_TPM", "1000000"))
+# token ที่จองไว้สำหรับคำตอบตอนยังไม่รู้ความยาวจริง
+RATE_LIMIT_OUTPUT_TOKENS = int(os.getenv("RATE_LIMIT_OUTPUT_TOKENS", "1000"))
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+
+
+class RateLimited(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+# spec ของ bucket: (key, capacity, refill ต่อวินาที, cost)
+# backend.take(specs, force) -> (wait seconds, levels หลังหัก)
+# - force=False: all-or-nothing, ถ้า bucket ไหนไม่พอจะไม่หักเลยแล้วคืนเวลาที่ต้องรอ
+# - force=True: หัก/คืนเลยไม่เช็ค (settle, cost ติดลบ = คืน token)
+# cost มากกว่า capacity ผ่านได้ถ้า bucket เต็ม (ติดลบแล้วค่อยเติม) ไม่งั้นจะไม่มีวันผ่าน
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, prune_every: int = 1024):
+        self._lock = threading.Lock()
+        # key -> [tokens, updated, full_at]
+        self._buckets: dict[str, list[float]] = {}
+        self._prune_every = prune_every
+        self._ops = 0
+
+    def _level(self, key: str, capacity: float, rate: float, now: float) -> float:
+        b = self._buckets.get(key)
+        if b is None:
+            return capacity
+        return min(capacity, b[0] + (now - b[1]) * rate)
+
+    def take(self, specs: list[tuple], force: bool = False) -> tuple[float, list[float]]:
+        now = time.monotonic()
+        with self._lock:
+            levels = [self._level(key, cap, rate, now) for key, cap, rate, _ in specs]
+            if not force:
+                wait = 0.0
+                for (_, cap, rate, cost), level in zip(specs, levels):
+                    need = min(cost, cap)
+                    if level < need:
+                        wait = max(wait, (need - level) / rate)
+                if wait > 0:
+                    return wait, levels
+
+            after = []
+            for (key, cap, rate, cost), level in zip(specs, levels):
+                left = min(cap, level - cost)
+                self._buckets[key] = [left, now, now + (cap - left) / rate]
+                after.append(left)
+
+            self._ops += 1
+            if self._ops % self._prune_every == 0:
+                self._prune(now)
+            return 0.0, after
+
+    async def take_async(self, specs: list[tuple], force: bool = False) -> tuple[float, list[float]]:
+        # in-memory ถือ lock แค่ไม่กี่ µs ไม่ต้องส่งไป thread
+        return self.take(specs, force)
+
+    def _prune(self, now: float):
+        # bucket ที่เติมเต็มแล้ว = เหมือนไม่มี entry
+        for key in [k for k, b in self._buckets.items() if b[2] <= now]:
+            del self._buckets[key]
+
+    def levels(self, specs: list[tuple]) -> list[float]:
+        now = time.monotonic()
+        with self._lock:
+            return [self._level(key, cap, rate, now) for key, cap, rate, _ in specs]
+
+    def lowest(self, prefix: str, suffix: str, capacity: float, rate: float, n: int) -> list[tuple[str, float]]:
+        # session ที่ bucket เหลือน้อยสุด (ใช้หนักสุด) สำหรับ metrics
+        now = time.monotonic()
+        with self._lock:
+            found = [
+                (key, self._level(key, capacity, rate, now))
+                for key in self._buckets
+                if key.startswith(prefix) and key.endswith(suffix)
+            ]
+        return sorted(found, key=lambda kv: kv[1])[:n]
+
+    def size(self) -> int:
+        return len(self._buckets)
+
+
+# เหมือน MemoryBackend.take แต่รันใน redis แบบ atomic (นาฬิกาจาก redis TIME ให้ทุก worker ตรงกัน)
+# ARGV[1] = force, ต่อด้วย capacity / rate / cost ของแต่ละ key; คืนเป็น string (Lua number -> int)
+_TAKE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local force = ARGV[1] == '1'
+local levels = {}
+local wait = 0
+for i = 1, #KEYS do
+  local cap = tonumber(ARGV[i * 3 - 1])
+  local rate = tonumber(ARGV[i * 3])
+  local cost = tonumber(ARGV[i * 3 + 1])
+  local b = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local level = cap
+  if b[1] then
+    level = math.min(cap, tonumber(b[1]) + (now - tonumber(b[2])) * rate)
+  end
+  levels[i] = level
+  local need = math.min(cost, cap)
+  if not force and level < need then
+    wait = math.max(wait, (need - level) / rate)
+  end
+end
+local out = {tostring(wait)}
+for i = 1, #KEYS do
+  local cap = tonumber(ARGV[i * 3 - 1])
+  local rate = tonumber(ARGV[i * 3])
+  local left = levels[i]
+  if wait == 0 then
+    left = math.min(cap, left - tonumber(ARGV[i * 3 + 1]))
+    redis.call('HSET', KEYS[i], 'tokens', tostring(left), 'ts', tostring(now))
+    redis.call('PEXPIRE', KEYS[i], math.ceil((cap - left) / rate * 1000) + 1000)
+  end
+  out[i + 1] = tostring(left)
+end
+return out
+"""
+
+
+class RedisBackend:
+    # share bucket ข้าม worker / process (ใช้ redis หรือตัวที่ compatible เช่น valkey / dragonfly)
+    # 1 round trip ต่อ 1 การเช็ค (redis local ~0.1-0.3 ms)
+    # 2 client: sync (sync endpoint ใน threadpool / stats) กับ redis.asyncio (ใน event loop)
+    name = "redis"
+
+    def __init__(self, url: str = RATE_LIMIT_REDIS_URL):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError as e:
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from e
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_LUA)
+        self._aclient = redis.asyncio.Redis.from_url(url)
+        self._take_async = self._aclient.register_script(_TAKE_LUA)
+
+    @staticmethod
+    def _args(specs: list[tuple], force: bool) -> tuple[list[str], list[str]]:
+        args = ["1" if force else "0"]
+        for _, cap, rate, cost in specs:
+            args += [repr(cap), repr(rate), repr(cost)]
+        return [key for key, *_ in specs], args
+
+    def take(self, specs: list[tuple], force: bool = False) -> tuple[float, list[float]]:
+        keys, args = self._args(specs, force)
+        out = self._take(keys=keys, args=args)
+        return float(out[0]), [float(x) for x in out[1:]]
+
+    async def take_async(self, specs: list[tuple], force: bool = False) -> tuple[float, list[float]]:
+        keys, args = self._args(specs, force)
+        out = await self._take_async(keys=keys, args=args)
+        return float(out[0]), [float(x) for x in out[1:]]
+
+    def levels(self, specs: list[tuple]) -> list[float]:
+        # cost 0 + force = อ่านระดับปัจจุบัน (เขียนค่าเดิมกลับ)
+        return self.take([(key, cap, rate, 0) for key, cap, rate, _ in specs], force=True)[1]
+
+    def lowest(self, prefix: str, suffix: str, capacity: float, rate: float, n: int) -> list[tuple[str, float]]:
+        # ต้อง SCAN ทั้ง keyspace -> ไม่ทำใน metrics
+        return []
+
+    def size(self) -> int | None:
+        return None
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        backend,
+        session_rpm: float = RATE_LIMIT_SESSION_RPM,
+        session_tpm: float = RATE_LIMIT_SESSION_TPM,
+        global_rpm: float = RATE_LIMIT_GLOBAL_RPM,
+        global_tpm: float = RATE_LIMIT_GLOBAL_TPM,
+        enabled: bool = RATE_LIMIT_ENABLED,
+    ):
+        self.backend = backend
+        self.enabled = enabled
+        self.limits = {
+            ("session", "req"): session_rpm,
+            ("session", "tok"): session_tpm,
+            ("global", "req"): global_rpm,
+            ("global", "tok"): global_tpm,
+        }
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = {"session": 0, "global": 0}
+        self.reserved_tokens = 0
+        self.used_tokens = 0
+
+    def _key(self, scope: str, kind: str, session_id: int | None) -> str:
+        return f"rl:s:{session_id}:{kind}" if scope == "session" else f"rl:g:{kind}"
+
+    def _specs(self, session_id: int | None, requests: float, tokens: float) -> list[tuple]:
+        specs = []
+        for (scope, kind), per_minute in self.limits.items():
+            if per_minute <= 0 or (scope == "session" and session_id is None):
+                continue
+            cost = requests if kind == "req" else tokens
+            specs.append((self._key(scope, kind, session_id), per_minute, per_minute / 60, cost))
+        return specs
+
+    def check(self, session_id: int | None, tokens: int) -> tuple[float, str | None]:
+        # จอง 1 request + tokens; คืน (0, None) ถ้าผ่าน, ไม่งั้น (วินาทีที่ต้องรอ, scope ที่เต็ม)
+        specs = self._specs(session_id, 1, tokens) if self.enabled else []
+        if not specs:
+            return 0.0, None
+        return self._checked(specs, tokens, *self.backend.take(specs))
+
+    async def check_async(self, session_id: int | None, tokens: int) -> tuple[float, str | None]:
+        specs = self._specs(session_id, 1, tokens) if self.enabled else []
+        if not specs:
+            return 0.0, None
+        return self._checked(specs, tokens, *await self.backend.take_async(specs))
+
+    def _checked(self, specs: list[tuple], tokens: int, wait: float, levels: list[float]) -> tuple[float, str | None]:
+        with self._lock:
+            if wait <= 0:
+                self.allowed += 1
+                self.reserved_tokens += tokens
+                return 0.0, None
+            # scope ที่ต้องรอนานสุด
+            scope = max(
+                ((key, (min(cost, cap) - level) / rate) for (key, cap, rate, cost), level in zip(specs, levels)),
+                key=lambda kv: kv[1],
+            )[0]
+            scope = "session" if scope.startswith("rl:s:") else "global"
+            self.limited[scope] += 1
+        return wait, scope
+
+    def acquire(self, session_id: int | None, tokens: int) -> int:
+        # raise RateLimited ถ้าเกิน; คืนจำนวน token ที่จองไว้ (ส่งต่อให้ settle)
+        wait, scope = self.check(session_id, tokens)
+        if scope is not None:
+            raise RateLimited(scope, wait)
+        return tokens
+
+    async def acquire_async(self, session_id: int | None, tokens: int) -> int:
+        wait, scope = await self.check_async(session_id, tokens)
+        if scope is not None:
+            raise RateLimited(scope, wait)
+        return tokens
+
+    def _settle_specs(self, session_id: int | None, reserved: int, used: int, called: bool) -> list[tuple]:
+        specs = self._specs(session_id, 0 if called else -1, used - reserved)
+        with self._lock:
+            self.reserved_tokens -= reserved
+            self.used_tokens += used
+        return [s for s in specs if s[3]]
+
+    def settle(self, session_id: int | None, reserved: int, used: int, called: bool = True):
+        # ปรับ token bucket ตามที่ใช้จริง; called=False (เช่นได้จาก response cache) คืน request ด้วย
+        if not self.enabled:
+            return
+        specs = self._settle_specs(session_id, reserved, used, called)
+        if specs:
+            self.backend.take(specs, force=True)
+
+    async def settle_async(self, session_id: int | None, reserved: int, used: int, called: bool = True):
+        if not self.enabled:
+            return
+        specs = self._settle_specs(session_id, reserved, used, called)
+        if specs:
+            await self.backend.take_async(specs, force=True)
+
+    def stats(self, hot: int = 10) -> dict:
+        levels = {}
+        g_specs = self._specs(None, 0, 0)
+        for (key, *_), level in zip(g_specs, self.backend.levels(g_specs) if g_specs else []):
+            levels["requests" if key.endswith(":req") else "tokens"] = round(level, 1)
+
+        sessions = []
+        per_minute = self.limits[("session", "tok")]
+        if per_minute > 0 and hot > 0:
+            for key, level in self.backend.lowest("rl:s:", ":tok", per_minute, per_minute / 60, hot):
+                sessions.append({"session_id": int(key.split(":")[2]), "tokens": round(level, 1)})
+
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "backend": self.backend.name,
+                "limits_per_minute": {f"{scope}_{kind}": v for (scope, kind), v in self.limits.items()},
+                "global_levels": levels,
+                "lowest_sessions": sessions,
+                "buckets": self.backend.size(),
+                "allowed": self.allowed,
+                "limited_session": self.limited["session"],
+                "limited_global": self.limited["global"],
+                "reserved_tokens": self.reserved_tokens,
+                "used_tokens": self.used_tokens,
+            }
+
+
+def reserve_tokens(text: str, output: int = RATE_LIMIT_OUTPUT_TOKENS) -> int:
+    # ตอนรับ request: ข้อความใหม่ + เผื่อคำตอบ (context เดิมคิดตอน settle)
+    return count_tokens(text or "") + output
+
+
+def used_tokens(context: list[dict], summary: str, answer: str) -> int:
+    # ประมาณ token ที่ใช้จริง: context ที่ส่งไปจริง (ตาม budget) + summary + คำตอบ
+    return context_tokens(build_context(context)) + count_tokens(summary or "") + count_tokens(answer or "")
+
+
+def _make_backend():
+    if RATE_LIMIT_BACKEND == "redis":
+        try:
+            return RedisBackend(RATE_LIMIT_REDIS_URL)
+        except RuntimeError:
+            logger.warning("redis backend unavailable, rate limits are per process")
+    return MemoryBackend()
+
+
+rate_limiter = RateLimiter(_make_backend())
@@ -0,0 +1,256 @@
+import asyncio
+import hashlib
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+# Response cache สำหรับคำถามซ้ำ ๆ ("what is recursion", "explain big O")
+# - key = prompt ที่ normalize แล้ว + level (exact match ก่อน)
+# - optional: semantic match ด้วย local vector index (hashed n-gram embedding, ไม่ต้องต่อเน็ต)
+#   index = LSH (random hyperplane) แยกตาม level -> เทียบ cosine เฉพาะ candidate ที่ชน bucket
+#   ไม่ scan ทั้ง cache ใต้ lock, และจำกัดจำนวน candidate ต่อ lookup (SEMANTIC_MAX_CANDIDATES)
+# - TTL + LRU + จำกัดขนาดรวมเป็น bytes
+# ใช้เฉพาะคำถามแรกของ session (ไม่มี history) เพราะคำตอบ turn หลัง ๆ ขึ้นกับ context
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1").lower() not in {"0", "false", "no"}
+
+_PUNCT = re.compile(r"[^\w\s]+", re.UNICODE)
+_SPACES = re.compile(r"\s+")
+EMBED_DIM = 512
+# LSH: LSH_BANDS band x LSH_BITS bit, ชน bucket เดียวกันอย่างน้อย 1 band = candidate
+# cosine 0.92 -> หลุดทุก band ~0.1%, คำถามไม่เกี่ยวกันส่วนใหญ่ไม่ชน
+LSH_BANDS = 12
+LSH_BITS = 6
+SEMANTIC_MAX_CANDIDATES = int(os.getenv("RESPONSE_CACHE_MAX_CANDIDATES", "256"))
+
+
+def normalize_prompt(text: str) -> str:
+    text = _PUNCT.sub(" ", (text or "").lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def hashed_embedding(text: str) -> dict[int, float]:
+    # bag of words + char trigrams -> sparse vector (L2 normalized)
+    vec: dict[int, float] = {}
+    words = text.split()
+    feats = words + [text[i:i + 3] for i in range(max(len(text) - 2, 0))]
+    for f in feats:
+        h = int.from_bytes(hashlib.blake2b(f.encode(), digest_size=4).digest(), "little")
+        idx = h % EMBED_DIM
+        vec[idx] = vec.get(idx, 0.0) + (1.0 if h & 1 << 31 else -1.0)
+    norm = math.sqrt(sum(v * v for v in vec.values())) or 1.0
+    return {k: v / norm for k, v in vec.items()}
+
+
+def cosine(a: dict[int, float], b: dict[int, float]) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+class HyperplaneLSH:
+    # signed random projection: bit = sign(vec . plane), plane เป็น ±1 ต่อ dimension (seed คงที่)
+    def __init__(self, bands: int = LSH_BANDS, bits: int = LSH_BITS, dim: int = EMBED_DIM, seed: int = 9):
+        rng = random.Random(seed)
+        self.bands = bands
+        self.bits = bits
+        self.dim = dim
+        self._planes = [[rng.choice((-1.0, 1.0)) for _ in range(dim)] for _ in range(bands * bits)]
+
+    def signature(self, vec: dict[int, float]) -> tuple[int, ...]:
+        keys = []
+        for b in range(self.bands):
+            value = 0
+            for plane in self._planes[b * self.bits:(b + 1) * self.bits]:
+                dot = sum(v * plane[k % self.dim] for k, v in vec.items())
+                value = value << 1 | (dot >= 0)
+            keys.append(value)
+        return tuple(keys)
+
+
+@dataclass
+class _Entry:
+    level: str
+    answer: str
+    size: int
+    expires_at: float
+    vector: dict[int, float] | None
+    signature: tuple[int, ...] | None = None
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        semantic: bool = False,
+        threshold: float = 0.92,
+        embedder=hashed_embedding,
+        max_candidates: int = SEMANTIC_MAX_CANDIDATES,
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.semantic = semantic
+        self.threshold = threshold
+        self.embedder = embedder
+        self.max_candidates = max_candidates
+        self._lsh = HyperplaneLSH()
+        # (level, band, bucket) -> keys
+        self._buckets: dict[tuple[str, int, int], set[tuple[str, str]]] = {}
+        self._entries: OrderedDict[tuple[str, str], _Entry] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.semantic_candidates = 0
+        self._lookup_seconds = 0.0
+        self._lookups = 0
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.signature is not None:
+            for band, bucket in enumerate(entry.signature):
+                keys = self._buckets.get((entry.level, band, bucket))
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._buckets[(entry.level, band, bucket)]
+
+    def _index(self, key, entry: _Entry):
+        for band, bucket in enumerate(entry.signature):
+            self._buckets.setdefault((entry.level, band, bucket), set()).add(key)
+
+    def get(self, prompt: str, level: str) -> str | None:
+        t0 = time.perf_counter()
+        norm = normalize_prompt(prompt)
+        now = time.time()
+        key = (level, norm)
+        try:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry.expires_at < now:
+                    self._drop(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry.answer
+                if not (self.semantic and norm):
+                    self.misses += 1
+                    return None
+
+            # embedding / signature คำนวณนอก lock
+            vec = self.embedder(norm)
+            signature = self._lsh.signature(vec)
+            with self._lock:
+                match = self._nearest(level, vec, signature, now)
+                if match is not None:
+                    self._entries.move_to_end(match)
+                    self.semantic_hits += 1
+                    return self._entries[match].answer
+                self.misses += 1
+                return None
+        finally:
+            self._lookup_seconds += time.perf_counter() - t0
+            self._lookups += 1
+
+    def _nearest(self, level: str, vec, signature, now: float):
+        # เทียบเฉพาะ entry ของ level เดียวกันที่ชน bucket อย่างน้อย 1 band
+        # ชนหลาย band = น่าจะใกล้กว่า -> เรียงตามจำนวน band ที่ชน แล้วเทียบแค่ max_candidates ตัวแรก
+        hits: Counter = Counter()
+        for band, bucket in enumerate(signature):
+            hits.update(self._buckets.get((level, band, bucket), ()))
+        best_key, best = None, self.threshold
+        for key, _ in hits.most_common(self.max_candidates):
+            entry = self._entries[key]
+            self.semantic_candidates += 1
+            if entry.expires_at < now:
+                continue
+            score = cosine(vec, entry.vector)
+            if score >= best:
+                best_key, best = key, score
+        return best_key
+
+    def put(self, prompt: str, level: str, answer: str):
+        norm = normalize_prompt(prompt)
+        if not norm or not answer:
+            return
+        size = len(norm.encode()) + len(answer.encode())
+        if size > self.max_bytes:
+            return
+        vector = self.embedder(norm) if self.semantic else None
+        signature = self._lsh.signature(vector) if vector is not None else None
+        with self._lock:
+            key = (level, norm)
+            if key in self._entries:
+                self._drop(key)
+            entry = _Entry(level, answer, size, time.time() + self.ttl, vector, signature)
+            self._entries[key] = entry
+            if signature is not None:
+                self._index(key, entry)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "semantic_candidates": self.semantic_candidates,
+            "avg_lookup_ms": round(self._lookup_seconds / self._lookups * 1000, 4) if self._lookups else 0.0,
+        }
+
+
+def is_cacheable(context: list[dict], summary: str = "") -> bool:
+    # คำถามเดี่ยว: มีแค่ข้อความ user ล่าสุด ไม่มี history / summary
+    return RESPONSE_CACHE_ENABLED and not summary and len(context) == 1 and context[0].get("role") == "user"
+
+
+async def replay(answer: str, chunk_chars: int = 80):
+    # ส่งคำตอบจาก cache ออกเป็น chunk เหมือน stream จริง (ตัดที่ช่องว่าง)
+    pos = 0
+    while pos < len(answer):
+        end = min(pos + chunk_chars, len(answer))
+        if end < len(answer):
+            space = answer.rfind(" ", pos, end)
+            if space > pos:
+                end = space + 1
+        yield answer[pos:end]
+        pos = end
+        await asyncio.sleep(0)
+
+
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600))),
+    semantic=os.getenv("RESPONSE_CACHE_SEMANTIC", "0").lower() in {"1", "true", "yes"},
+    threshold=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92")),
+)
@@ -0,0 +1,225 @@
+import base64
+import html
+import json
+import logging
+import os
+import re
+
+from sqlalchemy import and_, cast, func, literal_column, select, text, tuple_
+from sqlalchemy.dialects.postgresql import REAL, REGCONFIG
+from sqlalchemy.orm import Session
+
+from .models import ChatMessage, ChatSession
+
+logger = logging.getLogger(__name__)
+
+# Full-text search ใน chat history (GET /api/search)
+# Postgres:
+#   - fts: generated column content_tsv (tsvector) + GIN index, rank ด้วย ts_rank_cd, highlight ด้วย ts_headline
+#   - trigram: content ILIKE '%q%' ผ่าน GIN gin_trgm_ops (code snippet / คำที่ tsquery ตัดทิ้ง / ภาษาไทย)
+#     ไม่มี pg_trgm (ไม่มีสิทธิ์ CREATE EXTENSION): ILIKE เหมือนเดิมแต่เรียงใหม่ -> เก่า (ไม่มี word_similarity)
+# DB อื่น (sqlite ตอน dev / test): LIKE ทุกคำ เรียงใหม่ -> เก่า
+# pagination แบบ keyset: cursor = (mode, rank, id)
+
+SEARCH_TS_CONFIG = os.getenv("SEARCH_TS_CONFIG", "english")
+SNIPPET_CHARS = 160
+
+# marker ตอน highlight (escape HTML ก่อนแล้วค่อยแปลงเป็น <mark>)
+_START, _STOP = "\x02", "\x03"
+_HEADLINE_OPTS = f"StartSel={_START}, StopSel={_STOP}, MaxFragments=2, MaxWords=24, MinWords=8, FragmentDelimiter= … "
+
+# มีสัญลักษณ์แบบ code (fib(n), a->b, std::vector, x.append) -> tsquery ตัดทิ้งหมด ใช้ trigram แทน
+_CODE_HINT = re.compile(r"[(){}\[\]<>=;`\\|&*+#$@^~]|::|\w[._/]\w")
+
+_TSV = literal_column("chat_messages.content_tsv")
+
+
+def ensure_search_index(conn):
+    # Postgres เท่านั้น: generated tsvector column + GIN index (+ pg_trgm ถ้าติดตั้งได้)
+    if conn.dialect.name != "postgresql":
+        return
+    conn.execute(text(
+        "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS content_tsv tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_TS_CONFIG}'::regconfig, content)) STORED"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_content_tsv ON chat_messages USING GIN (content_tsv)"
+    ))
+    try:
+        with conn.begin_nested():
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_chat_messages_content_trgm "
+                "ON chat_messages USING GIN (content gin_trgm_ops)"
+            ))
+    except Exception as e:
+        # ไม่มีสิทธิ์ CREATE EXTENSION -> ไม่มี word_similarity / index, trigram mode ใช้ ILIKE เรียงตามเวลาแทน
+        logger.warning("pg_trgm unavailable, trigram search falls back to ILIKE by recency: %s", e)
+
+
+_has_trgm: dict = {}
+
+
+def has_trigram(db: Session) -> bool:
+    # เช็คครั้งเดียวต่อ engine ว่ามี pg_trgm ไหม
+    bind = db.get_bind()
+    if bind not in _has_trgm:
+        _has_trgm[bind] = bind.dialect.name == "postgresql" and db.execute(
+            text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        ).first() is not None
+    return _has_trgm[bind]
+
+
+def _encode_cursor(mode: str, rank: float, row_id: int) -> str:
+    raw = json.dumps([mode, rank, row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple[str, float, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        mode, rank, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(mode), float(rank), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def looks_like_code(q: str) -> bool:
+    return bool(_CODE_HINT.search(q))
+
+
+def _mark(fragment: str) -> str:
+    return html.escape(fragment).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def make_snippet(content: str, terms: list[str], width: int = SNIPPET_CHARS) -> str:
+    # snippet รอบ match แรก (escape HTML แล้ว, คำที่ match ครอบด้วย <mark>)
+    lower = content.lower()
+    hits = [lower.find(t.lower()) for t in terms if t]
+    hits = [h for h in hits if h >= 0]
+    first = min(hits) if hits else 0
+    start = max(first - width // 3, 0)
+    end = min(start + width, len(content))
+    piece = content[start:end]
+
+    pattern = re.compile("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True) if t), re.IGNORECASE)
+    if pattern.pattern:
+        piece = pattern.sub(lambda m: f"{_START}{m.group(0)}{_STOP}", piece)
+    prefix = "… " if start > 0 else ""
+    suffix = " …" if end < len(content) else ""
+    return prefix + _mark(piece) + suffix
+
+
+def _row(r, snippet: str, rank: float) -> dict:
+    return {
+        "message_id": r.id,
+        "session_id": r.session_id,
+        "session_title": r.title,
+        "role": r.role,
+        "created_at": r.created_at.isoformat() if r.created_at else None,
+        "rank": rank,
+        "snippet": snippet,
+    }
+
+
+def _fts(db: Session, q: str, after, limit: int, session_id: int | None):
+    tsq = func.websearch_to_tsquery(cast(SEARCH_TS_CONFIG, REGCONFIG), q)
+    rank = func.ts_rank_cd(_TSV, tsq)
+
+    inner = select(
+        ChatMessage.id, ChatMessage.session_id, ChatMessage.role,
+        ChatMessage.content, ChatMessage.created_at, rank.label("rank"),
+    ).where(_TSV.op("@@")(tsq))
+    if session_id is not None:
+        inner = inner.where(ChatMessage.session_id == session_id)
+    if after is not None:
+        inner = inner.where(tuple_(rank, ChatMessage.id) < tuple_(cast(after[0], REAL), after[1]))
+    inner = inner.order_by(rank.desc(), ChatMessage.id.desc()).limit(limit).subquery()
+
+    # ts_headline แพง -> ทำเฉพาะ row ในหน้านี้ (outer query)
+    headline = func.ts_headline(cast(SEARCH_TS_CONFIG, REGCONFIG), inner.c.content, tsq, _HEADLINE_OPTS)
+    stmt = (
+        select(inner, ChatSession.title, headline.label("headline"))
+        .join(ChatSession, ChatSession.id == inner.c.session_id)
+        .order_by(inner.c.rank.desc(), inner.c.id.desc())
+    )
+    return [(r, _mark(r.headline), float(r.rank)) for r in db.execute(stmt)]
+
+
+def _trigram(db: Session, q: str, after, limit: int, session_id: int | None):
+    if not has_trigram(db):
+        return _like_terms(db, [q], after, limit, session_id)
+    score = func.word_similarity(q, ChatMessage.content)
+    stmt = (
+        select(
+            ChatMessage.id, ChatMessage.session_id, ChatMessage.role,
+            ChatMessage.content, ChatMessage.created_at, ChatSession.title, score.label("rank"),
+        )
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(ChatMessage.content.ilike(f"%{_escape_like(q)}%", escape="\\"))
+    )
+    if session_id is not None:
+        stmt = stmt.where(ChatMessage.session_id == session_id)
+    if after is not None:
+        stmt = stmt.where(tuple_(score, ChatMessage.id) < tuple_(cast(after[0], REAL), after[1]))
+    stmt = stmt.order_by(score.desc(), ChatMessage.id.desc()).limit(limit)
+    return [(r, make_snippet(r.content, [q]), float(r.rank)) for r in db.execute(stmt)]
+
+
+def _like(db: Session, q: str, after, limit: int, session_id: int | None):
+    return _like_terms(db, q.split(), after, limit, session_id)
+
+
+def _like_terms(db: Session, terms: list[str], after, limit: int, session_id: int | None):
+    # ILIKE ทุกคำ เรียงใหม่ -> เก่า (cursor ใช้แค่ id)
+    stmt = (
+        select(
+            ChatMessage.id, ChatMessage.session_id, ChatMessage.role,
+            ChatMessage.content, ChatMessage.created_at, ChatSession.title,
+        )
+        .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+        .where(and_(*[ChatMessage.content.ilike(f"%{_escape_like(t)}%", escape="\\") for t in terms]))
+    )
+    if session_id is not None:
+        stmt = stmt.where(ChatMessage.session_id == session_id)
+    if after is not None:
+        stmt = stmt.where(ChatMessage.id < after[1])
+    stmt = stmt.order_by(ChatMessage.id.desc()).limit(limit)
+    return [(r, make_snippet(r.content, terms), 0.0) for r in db.execute(stmt)]
+
+
+_SEARCHERS = {"fts": _fts, "trigram": _trigram, "like": _like}
+
+
+def search_messages(db: Session, q: str, cursor: str | None = None, limit: int = 20, session_id: int | None = None) -> dict:
+    q = (q or "").strip()
+    after = None
+    if cursor:
+        mode, rank, row_id = _decode_cursor(cursor)
+        if mode not in _SEARCHERS:
+            raise ValueError("Invalid cursor")
+        after = (rank, row_id)
+    elif db.get_bind().dialect.name != "postgresql":
+        mode = "like"
+    else:
+        mode = "trigram" if looks_like_code(q) else "fts"
+
+    rows = _SEARCHERS[mode](db, q, after, limit + 1, session_id)
+    if mode == "fts" and not rows and after is None and len(q) >= 3:
+        # tsquery ไม่เจอ (stop word / คำไทยไม่มีช่องว่าง / ชื่อตัวแปร) -> ลอง trigram
+        mode = "trigram"
+        rows = _trigram(db, q, None, limit + 1, session_id)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(mode, rows[-1][2], rows[-1][0].id) if has_more else None
+    return {
+        "query": q,
+        "mode": mode,
+        "results": [_row(r, snippet, rank) for r, snippet, rank in rows],
+        "next_cursor": next_cursor,
+    }
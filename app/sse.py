@@ -0,0 +1,230 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass, field
+
+from .metrics import SSE_DURATION, SSE_TTFB
+
+# SSE framing สำหรับ stream คำตอบ:
+# - Coalescer: รวม chunk เล็ก ๆ จาก Gemini เป็นก้อนเดียวตาม time window / ขนาด
+#   (ลดจำนวน write เล็ก ๆ ผ่าน proxy), ก้อนแรกส่งทันที (time-to-first-byte ไม่ช้าลง)
+# - SSEWriter: format frame (id: / event: / data:) + metrics ต่อ 1 response
+# generation จริงรันแยกใน app/generations.py (client หลุดไม่ยกเลิก generation)
+# SSE_COALESCE_MS=0 -> ส่งทุก chunk เหมือนเดิม
+
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "30"))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "1024"))
+
+_END = object()
+
+
+def sse_data(text: str) -> str:
+    # SSE ต้อง prefix data: ทุกบรรทัด (เก็บ newline ท้าย chunk ไว้ด้วย ไม่งั้น markdown ติดกัน)
+    text = (text or "").replace("\r\n", "\n").replace("\r", "\n")
+    return "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+
+
+def sse_frame(event: str, text: str, event_id: int | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    if event != "message":
+        head += f"event: {event}\n"
+    return head + sse_data(text)
+
+
+@dataclass
+class StreamMetrics:
+    started: float = field(default_factory=time.perf_counter)
+    ttfb: float | None = None
+    frames: int = 0
+    bytes: int = 0
+    completed: bool = False
+    disconnected: bool = False
+    slow_client: bool = False
+
+    def as_dict(self) -> dict:
+        return {
+            "ttfb_ms": round(self.ttfb * 1000, 2) if self.ttfb is not None else None,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "duration_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "completed": self.completed,
+            "disconnected": self.disconnected,
+            "slow_client": self.slow_client,
+        }
+
+
+class SSEStats:
+    # สถิติรวมทุก response (ดูที่ GET /api/streams)
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._ttfb = deque(maxlen=window)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._ttfb.clear()
+            self.active = 0
+            self.streams = 0
+            self.completed = 0
+            self.disconnects = 0
+            self.slow_clients = 0
+            self.chunks_in = 0
+            self.pieces = 0
+            self.frames = 0
+            self.bytes = 0
+
+    def opened(self):
+        with self._lock:
+            self.active += 1
+            self.streams += 1
+
+    def closed(self, m: StreamMetrics):
+        outcome = "completed" if m.completed else "disconnected"
+        SSE_DURATION.labels(outcome).observe(time.perf_counter() - m.started)
+        if m.ttfb is not None:
+            SSE_TTFB.observe(m.ttfb)
+        with self._lock:
+            self.active -= 1
+            self.completed += m.completed
+            self.disconnects += m.disconnected
+            self.slow_clients += m.slow_client
+            self.frames += m.frames
+            self.bytes += m.bytes
+            if m.ttfb is not None:
+                self._ttfb.append(m.ttfb)
+
+    def coalesced(self, chunks_in: int, pieces: int):
+        # จาก generation: chunk ของ model เข้ามาเท่าไหร่ รวมเหลือกี่ก้อน
+        with self._lock:
+            self.chunks_in += chunks_in
+            self.pieces += pieces
+
+    def stats(self) -> dict:
+        with self._lock:
+            ttfb = sorted(self._ttfb)
+            pct = lambda p: round(ttfb[min(len(ttfb) - 1, int(len(ttfb) * p))] * 1000, 2) if ttfb else None
+            return {
+                "active": self.active,
+                "streams": self.streams,
+                "completed": self.completed,
+                "client_disconnects": self.disconnects,
+                "slow_clients": self.slow_clients,
+                "chunks_in": self.chunks_in,
+                "frames": self.frames,
+                "bytes": self.bytes,
+                "chunks_per_piece": round(self.chunks_in / self.pieces, 2) if self.pieces else 0.0,
+                "ttfb_p50_ms": pct(0.5),
+                "ttfb_p95_ms": pct(0.95),
+                "coalesce_ms": SSE_COALESCE_MS,
+                "coalesce_bytes": SSE_COALESCE_BYTES,
+            }
+
+
+sse_stats = SSEStats()
+
+
+class Coalescer:
+    # อ่าน upstream ใน task แยก แล้ว yield text ที่รวมแล้ว (flush ตาม deadline แม้ upstream เงียบ)
+    def __init__(self, window_ms: float = SSE_COALESCE_MS, max_bytes: int = SSE_COALESCE_BYTES):
+        self.window = window_ms / 1000
+        self.max_bytes = max_bytes
+        self.chunks_in = 0
+
+    async def _pump(self, source, queue: asyncio.Queue):
+        try:
+            async for chunk in source:
+                if chunk:
+                    queue.put_nowait(chunk)
+        finally:
+            queue.put_nowait(_END)
+
+    async def pieces(self, source):
+        # exception จาก upstream ส่งต่อให้ caller
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        producer = asyncio.create_task(self._pump(source, queue))
+
+        buf: list[str] = []
+        size = 0
+        deadline = None
+        first = True
+
+        def flush() -> str:
+            nonlocal buf, size, deadline
+            text = "".join(buf)
+            buf, size, deadline = [], 0, None
+            return text
+
+        try:
+            while True:
+                try:
+                    if deadline is None or not queue.empty():
+                        item = await queue.get()
+                    else:
+                        item = await asyncio.wait_for(queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    yield flush()
+                    continue
+
+                if item is _END:
+                    break
+                self.chunks_in += 1
+                buf.append(item)
+                size += len(item)
+
+                # ก้อนแรกส่งทันที / window=0 ส่งทุก chunk / buffer เต็มส่งเลย
+                if first or self.window <= 0 or size >= self.max_bytes:
+                    first = False
+                    yield flush()
+                elif deadline is None:
+                    deadline = loop.time() + self.window
+                elif loop.time() >= deadline:
+                    yield flush()
+
+            if buf:
+                yield flush()
+            await producer
+        finally:
+            if not producer.done():
+                producer.cancel()
+            with suppress(BaseException):
+                await producer
+            # ปิด upstream generator -> หยุด generate ฝั่ง Gemini
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                with suppress(Exception):
+                    await aclose()
+
+
+class SSEWriter:
+    # ใช้ 1 ตัวต่อ 1 response: out.frame(...) ทุก event แล้ว out.close() ใน finally
+    def __init__(self):
+        self.metrics = StreamMetrics()
+        self._closed = False
+        sse_stats.opened()
+
+    def frame(self, event: str, text: str, event_id: int | None = None) -> str:
+        frame = sse_frame(event, text, event_id)
+        m = self.metrics
+        if m.ttfb is None:
+            m.ttfb = time.perf_counter() - m.started
+        if event in {"done", "error"}:
+            m.completed = True
+        elif event == "snapshot":
+            # client ตามไม่ทัน buffer -> ต้องส่งข้อความทั้งก้อนแทน
+            m.slow_client = True
+        m.frames += 1
+        m.bytes += len(frame)
+        return frame
+
+    def close(self):
+        # เรียกใน finally ของ generator: ถ้ายังไม่ได้ส่ง done/error แปลว่า client หลุดกลางทาง
+        if self._closed:
+            return
+        self._closed = True
+        if not self.metrics.completed:
+            self.metrics.disconnected = True
+        sse_stats.closed(self.metrics)
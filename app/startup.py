@@ -0,0 +1,54 @@
+import logging
+import os
+import threading
+import time
+
+from .gemini_client import warm_models
+from .pdf_export import warm_pdf
+
+# Worker boot: ให้ uvicorn รับ request ได้เร็วที่สุด (scale out ตอน traffic spike)
+# - schema: `python -m app.init_db` ครั้งเดียวต่อ deploy (DB_AUTO_MIGRATE=1 -> ทำตอน startup แบบเดิม)
+# - SDK / font หนัก ๆ (google.generativeai, ReportLab) import ตอนใช้ครั้งแรก
+#   STARTUP_WARMUP=background -> warm ใน thread หลัง startup (ไม่ block readiness)
+#   STARTUP_WARMUP=blocking   -> warm ให้เสร็จก่อนรับ request (แบบเดิม)
+#   STARTUP_WARMUP=off        -> ไม่ warm เลย (request แรกจ่ายเอง)
+
+logger = logging.getLogger(__name__)
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0").lower() in {"1", "true", "yes"}
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background").lower()
+
+
+class Warmup:
+    def __init__(self):
+        self.state = "idle"  # idle | running | done | failed | off
+        self.seconds: dict[str, float] = {}
+        self._thread: threading.Thread | None = None
+
+    def _run(self):
+        self.state = "running"
+        try:
+            for name, fn in (("models", warm_models), ("pdf", warm_pdf)):
+                t0 = time.perf_counter()
+                fn()
+                self.seconds[name] = round(time.perf_counter() - t0, 4)
+            self.state = "done"
+        except Exception:
+            # warm ไม่ได้ไม่ใช่เรื่องใหญ่: request แรกจะ import / สร้างเอง
+            logger.warning("startup warm-up failed", exc_info=True)
+            self.state = "failed"
+
+    def start(self, mode: str = STARTUP_WARMUP):
+        if mode == "off":
+            self.state = "off"
+        elif mode == "blocking":
+            self._run()
+        elif self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="startup-warmup", daemon=True)
+            self._thread.start()
+
+    def stats(self) -> dict:
+        return {"mode": STARTUP_WARMUP, "state": self.state, "seconds": dict(self.seconds)}
+
+
+warmup = Warmup()
@@ -1,5 +1,14 @@
-export async function apiListSessions() {
-    const res = await fetch("/api/sessions");
+// 429 จาก rate limit: บอกเวลาที่ต้องรอจาก Retry-After
+export function rateLimitMessage(res) {
+    if (res.status !== 429) return null;
+    const wait = res.headers.get("Retry-After");
+    return `Too many requests, try again in ${wait || "a few"}s`;
+}
+
+export async function apiListSessions(cursor = null, limit = 50) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`/api/sessions?${params}`);
     return await res.json();
 }
 
@@ -12,8 +21,13 @@ export async function apiCreateSession(title = "New Chat") {
     return await res.json();
 }
 
-export async function apiGetMessages(sessionId) {
-    const res = await fetch(`/api/sessions/${sessionId}/messages`);
+// list / messages ส่ง ETag + Cache-Control: no-cache -> browser revalidate เอง (304 ไม่ต้องโหลด body ใหม่)
+export async function apiGetMessages(sessionId, { before = null, after = null, since = null, limit = 50 } = {}) {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (before) params.set("before", before);
+    if (after) params.set("after", after);
+    if (since) params.set("since", since);
+    const res = await fetch(`/api/sessions/${sessionId}/messages?${params}`);
     return await res.json();
 }
 
@@ -24,7 +38,7 @@ export async function apiChat(sessionId, message, level) {
         body: JSON.stringify({ message, level }),
     });
     const data = await res.json();
-    if (!res.ok) throw new Error(data.error || "Chat failed");
+    if (!res.ok) throw new Error(rateLimitMessage(res) || data.error || "Chat failed");
     return data;
 }
 
@@ -57,7 +71,7 @@ export async function apiRegenerate(sessionId) {
         method: "POST",
     });
     const data = await res.json();
-    if (!res.ok) throw new Error(data.error || "Regenerate failed");
+    if (!res.ok) throw new Error(rateLimitMessage(res) || data.error || "Regenerate failed");
     return data;
 }
 
@@ -66,12 +80,29 @@ export async function apiRegenerateStream(sessionId) {
         method: "POST",
     });
     if (!res.ok) {
-        let msg = "Regenerate failed";
+        let msg = rateLimitMessage(res) || "Regenerate failed";
         try {
             const data = await res.json();
-            msg = data.error || msg;
+            if (res.status !== 429) msg = data.error || msg;
         } catch { }
         throw new Error(msg);
     }
     return res;
 }
+
+export async function apiResumeStream(sessionId, generationId, lastEventId = 0) {
+    const params = new URLSearchParams({ generation_id: generationId });
+    const res = await fetch(`/api/sessions/${sessionId}/stream?${params}`, {
+        headers: { "Last-Event-ID": String(lastEventId) },
+    });
+    if (!res.ok) throw new Error("Stream expired");
+    return res;
+}
+
+export async function apiSearch(q, { cursor = null, limit = 20 } = {}) {
+    const params = new URLSearchParams({ q, limit: String(limit) });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`/api/search?${params}`);
+    if (!res.ok) throw new Error("Search failed");
+    return res.json();
+}
@@ -0,0 +1,135 @@
+// Synthetic-stream benchmark: frame time ระหว่าง stream เทียบกับความยาว session
+// legacy      = renderChat() ทุก chunk (rebuild + re-highlight ทุก message)
+// incremental = streamUpdate() ทุก chunk + streamFinish() ตอนจบ
+// เปิด /bench/render แล้วกด Run (ไม่ต้องมี backend / Gemini)
+
+import { state } from "./state.js";
+import { qs, setStatus, renderChat, streamUpdate, streamFinish } from "./ui.js";
+
+const CHUNK_MS = 15;
+const LONG_FRAME_MS = 50;
+
+const ANSWER = [
+    "## Recursion",
+    "",
+    "Recursion is when a function **calls itself** to solve a smaller piece of the problem.",
+    "Each call must move towards a *base case*, otherwise it never stops.",
+    "",
+    "```python",
+    "def fact(n):",
+    "    if n <= 1:",
+    "        return 1",
+    "    return n * fact(n - 1)",
+    "```",
+    "",
+    "- base case: `n <= 1`",
+    "- recursive case: `n * fact(n - 1)`",
+    "",
+    "```js",
+    "const fib = (n) => (n < 2 ? n : fib(n - 1) + fib(n - 2));",
+    "```",
+    "",
+    "Try tracing `fact(4)` by hand to see the call stack grow and shrink.",
+    "",
+].join("\n");
+
+function history(size) {
+    const msgs = [];
+    for (let i = 0; i < size; i++) {
+        msgs.push(i % 2 === 0
+            ? { role: "user", content: `Question ${i}: explain recursion?` }
+            : { role: "assistant", content: ANSWER });
+    }
+    return msgs;
+}
+
+function chunks(text, size = 12) {
+    const out = [];
+    for (let i = 0; i < text.length; i += size) out.push(text.slice(i, i + size));
+    return out;
+}
+
+function sleep(ms) {
+    return new Promise((r) => setTimeout(r, ms));
+}
+
+function percentile(sorted, p) {
+    if (!sorted.length) return 0;
+    return sorted[Math.min(sorted.length - 1, Math.floor(sorted.length * p))];
+}
+
+async function runOne(size, mode) {
+    state.messages = history(size);
+    const assistant = { role: "assistant", content: "", streaming: true };
+    state.messages.push(assistant);
+    renderChat();
+    await sleep(50);
+
+    // frame time = ระยะห่างระหว่าง requestAnimationFrame ติดกัน
+    const frames = [];
+    let last = performance.now();
+    let running = true;
+    const tick = (t) => {
+        frames.push(t - last);
+        last = t;
+        if (running) requestAnimationFrame(tick);
+    };
+    requestAnimationFrame(tick);
+
+    const t0 = performance.now();
+    for (const c of chunks(ANSWER.repeat(3))) {
+        assistant.content += c;
+        if (mode === "legacy") renderChat();
+        else streamUpdate(assistant);
+        await sleep(CHUNK_MS);
+    }
+    if (mode === "legacy") {
+        assistant.streaming = false;
+        renderChat();
+    } else {
+        streamFinish(assistant);
+    }
+    await sleep(50);
+    running = false;
+    const wall = (performance.now() - t0) / 1000;
+
+    const sorted = frames.slice(1).sort((a, b) => a - b);
+    const avg = sorted.reduce((a, b) => a + b, 0) / (sorted.length || 1);
+    return {
+        avg,
+        p95: percentile(sorted, 0.95),
+        max: sorted[sorted.length - 1] || 0,
+        long: sorted.filter((f) => f > LONG_FRAME_MS).length,
+        wall,
+    };
+}
+
+function addRow(size, mode, r) {
+    const tr = document.createElement("tr");
+    for (const v of [size, mode, r.avg.toFixed(1), r.p95.toFixed(1), r.max.toFixed(1), r.long, r.wall.toFixed(2)]) {
+        const td = document.createElement("td");
+        td.className = "pr-6";
+        td.textContent = v;
+        tr.appendChild(td);
+    }
+    qs("results").appendChild(tr);
+}
+
+async function run() {
+    const sizes = qs("sizes").value.split(",").map((x) => parseInt(x, 10)).filter((x) => x > 0);
+    qs("results").innerHTML = "";
+    qs("btnRun").disabled = true;
+
+    for (const size of sizes) {
+        for (const mode of ["legacy", "incremental"]) {
+            setStatus(`Running ${mode} @ ${size} messages...`);
+            addRow(size, mode, await runOne(size, mode));
+        }
+    }
+
+    qs("btnRun").disabled = false;
+    setStatus("Done ✅");
+}
+
+window.__chat = { regenerateStream() {} };
+qs("btnRun").addEventListener("click", run);
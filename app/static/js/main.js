@@ -7,6 +7,9 @@ import {
     apiExportPdf,
     apiRegenerate,
     apiRegenerateStream,
+    apiResumeStream,
+    apiSearch,
+    rateLimitMessage,
 } from "./api.js";
 
 import { state, setActiveSessionId, clearActiveSessionId } from "./state.js";
@@ -15,6 +18,8 @@ import {
     setStatus,
     renderChat,
     renderSessions,
+    streamUpdate,
+    streamFinish,
     updateHeader,
 } from "./ui.js";
 
@@ -41,18 +46,74 @@ async function ensureSession() {
     setActiveSessionId(s.session_id);
 }
 
-async function loadHistory() {
-    if (!state.activeSessionId) return;
-
-    const data = await apiGetMessages(state.activeSessionId);
-    state.messages = (data.messages || []).map((m) => ({
+function toMessages(rows) {
+    return (rows || []).map((m) => ({
+        id: m.id,
         role: m.role,
         content: m.content,
     }));
+}
+
+function cacheHistory(sessionId, syncToken) {
+    if (!sessionId || !syncToken) return;
+    // เก็บเฉพาะ message ที่มี id แล้ว (ที่ยังไม่มี id = optimistic / pending จะมาใน delta รอบหน้า)
+    state.historyCache.set(String(sessionId), {
+        messages: state.messages.filter((m) => m.id != null),
+        cursor: state.historyCursor,
+        hasMore: state.hasMoreHistory,
+        syncToken,
+    });
+}
+
+async function loadHistory() {
+    if (!state.activeSessionId) return;
+
+    const sessionId = state.activeSessionId;
+    const cached = state.historyCache.get(String(sessionId));
+    const data = await apiGetMessages(sessionId, { since: cached?.syncToken });
+    if (sessionId !== state.activeSessionId) return;
+
+    if (cached && data.delta) {
+        state.messages = cached.messages.concat(toMessages(data.messages));
+        state.historyCursor = cached.cursor;
+        state.hasMoreHistory = cached.hasMore;
+    } else {
+        state.messages = toMessages(data.messages);
+        state.historyCursor = data.prev_cursor || null;
+        state.hasMoreHistory = !!data.has_more;
+    }
+    cacheHistory(sessionId, data.sync_token);
 
     renderChat();
 }
 
+async function loadOlderHistory() {
+    if (!state.activeSessionId || !state.hasMoreHistory || state.loadingHistory) return;
+
+    state.loadingHistory = true;
+    const sessionId = state.activeSessionId;
+    try {
+        const data = await apiGetMessages(sessionId, { before: state.historyCursor });
+        if (sessionId !== state.activeSessionId) return;
+
+        const older = toMessages(data.messages);
+        state.messages = older.concat(state.messages);
+        state.historyCursor = data.prev_cursor || null;
+        state.hasMoreHistory = !!data.has_more;
+        const cached = state.historyCache.get(String(sessionId));
+        if (cached) cacheHistory(sessionId, cached.syncToken);
+
+        // คงตำแหน่ง scroll เดิมไว้หลัง prepend
+        const chat = qs("chat");
+        const prevHeight = chat.scrollHeight;
+        const prevTop = chat.scrollTop;
+        renderChat({ scroll: false });
+        chat.scrollTop = chat.scrollHeight - prevHeight + prevTop;
+    } finally {
+        state.loadingHistory = false;
+    }
+}
+
 /* -------------------------
  * Actions
  * ------------------------- */
@@ -99,6 +160,7 @@ async function deleteActiveSession() {
     if (!ok) return;
 
     await apiDeleteSession(state.activeSessionId);
+    state.historyCache.delete(String(state.activeSessionId));
     clearActiveSessionId();
 
     await refreshSessions();
@@ -171,11 +233,16 @@ function bindEvents() {
     });
 
 
+    /* ===== Infinite scroll (history เก่า) ===== */
+    qs("chat").addEventListener("scroll", (e) => {
+        if (e.target.scrollTop < 80) loadOlderHistory();
+    });
+
     /* ===== Top / toolbar ===== */
     qs("btnNew").addEventListener("click", createNewSession);
     qs("btnCopy").addEventListener("click", copyChat);
     qs("btnPdf").addEventListener("click", exportPdf);
-    qs("search").addEventListener("input", renderSessions);
+    qs("search").addEventListener("input", onSearchInput);
 
     /* ===== Sidebar sessions (ChatGPT-style) ===== */
     qs("sessions").addEventListener("click", (e) => {
@@ -220,6 +287,125 @@ document.addEventListener("click", () => {
 });
 
 
+/* -------------------------
+ * Search (title / preview ทันที, เนื้อหาข้อความผ่าน /api/search แบบ debounce)
+ * ------------------------- */
+let searchTimer = null;
+let searchSeq = 0;
+
+function onSearchInput() {
+    const q = qs("search").value.trim();
+    clearTimeout(searchTimer);
+
+    if (q.length < 2) {
+        state.searchHits = null;
+        renderSessions();
+        return;
+    }
+    renderSessions();
+
+    searchTimer = setTimeout(async () => {
+        const seq = ++searchSeq;
+        try {
+            const data = await apiSearch(q);
+            if (seq !== searchSeq) return; // มีคำค้นใหม่กว่าแล้ว
+
+            const hits = new Map();
+            for (const r of data.results) {
+                const key = String(r.session_id);
+                if (!hits.has(key)) hits.set(key, r);
+            }
+            state.searchHits = hits;
+            renderSessions();
+        } catch { }
+    }, 250);
+}
+
+
+/* -------------------------
+ * SSE helpers
+ * ------------------------- */
+function parseSseEvent(raw) {
+    let event = "message";
+    let id = null;
+    const data = [];
+    for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("id:")) id = line.slice(3).trim();
+        else if (line.startsWith("data:")) data.push(line.slice(5).replace(/^ /, ""));
+    }
+    return { id, event, data: data.join("\n") };
+}
+
+// อ่าน SSE จน event done / error (คืน null ถ้า connection ปิดก่อน)
+async function readSse(res, onEvent) {
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder("utf-8");
+    let buffer = "";
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) return null;
+
+        buffer += decoder.decode(value, { stream: true });
+
+        let idx;
+        while ((idx = buffer.indexOf("\n\n")) !== -1) {
+            const ev = parseSseEvent(buffer.slice(0, idx));
+            buffer = buffer.slice(idx + 2);
+            if (ev.event === "done" || ev.event === "error") return ev;
+            onEvent(ev);
+        }
+    }
+}
+
+// generation รันต่อฝั่ง server แม้ connection หลุด -> reconnect ด้วย Last-Event-ID (ไม่ generate ใหม่)
+const RESUME_ATTEMPTS = 5;
+
+async function readGeneration(res, sessionId, assistant) {
+    const generationId = res.headers.get("X-Generation-Id");
+    let lastId = 0;
+
+    for (let attempt = 1; ; attempt++) {
+        try {
+            const end = await readSse(res, ({ id, event, data }) => {
+                if (id) lastId = Number(id);
+
+                // title มาแยก event (heuristic ก่อน แล้ว Gemini title ตามมา)
+                if (event === "title") {
+                    applySessionTitle(sessionId, data);
+                    return;
+                }
+                // ตามไม่ทัน buffer: server ส่งข้อความทั้งหมดถึงตอนนั้นมาแทน
+                if (event === "snapshot") assistant.content = data;
+                else if (event === "message") assistant.content += data;
+                else return;
+                streamUpdate(assistant);
+            });
+            if (end) return end;
+        } catch { }
+
+        if (!generationId || attempt > RESUME_ATTEMPTS) {
+            return { event: "error", data: "Connection lost" };
+        }
+        setStatus(`Reconnecting... (${attempt})`);
+        await new Promise((r) => setTimeout(r, 500 * attempt));
+        try {
+            res = await apiResumeStream(sessionId, generationId, lastId);
+        } catch (e) {
+            return { event: "error", data: e.message };
+        }
+    }
+}
+
+function applySessionTitle(sessionId, title) {
+    if (!title) return;
+    const s = state.sessions.find((x) => String(x.id) === String(sessionId));
+    if (s) s.title = title;
+    renderSessions();
+    updateHeader();
+}
+
 /* -------------------------
  * Regenerate last assistant message
  * ------------------------- */
@@ -241,63 +427,18 @@ async function regenerateStream() {
     state.messages.push(assistant);
     renderChat();
 
+    const sessionId = state.activeSessionId;
+    let end;
     try {
-        const res = await apiRegenerateStream(state.activeSessionId);
-
-        const reader = res.body.getReader();
-        const decoder = new TextDecoder("utf-8");
-        let buffer = "";
-
-        while (true) {
-            const { value, done } = await reader.read();
-            if (done) break;
-
-            buffer += decoder.decode(value, { stream: true });
-
-            let idx;
-            while ((idx = buffer.indexOf("\n\n")) !== -1) {
-                const raw = buffer.slice(0, idx);
-                buffer = buffer.slice(idx + 2);
-
-                if (raw.startsWith("event: done")) {
-                    assistant.streaming = false;
-                    renderChat();
-                    setStatus("Done ✅");
-                    await refreshSessions();
-                    return;
-                }
-
-                if (raw.startsWith("event: error")) {
-                    const msg = raw
-                        .split("\n")
-                        .find((l) => l.startsWith("data:"))
-                        ?.replace("data:", "")
-                        .trim() || "Streaming error";
-                    throw new Error(msg);
-                }
-
-                const dataLines = raw
-                    .split("\n")
-                    .filter((l) => l.startsWith("data:"))
-                    .map((l) => l.replace("data:", "").trimStart());
-
-                if (dataLines.length) {
-                    assistant.content += dataLines.join("\n");
-                    renderChat();
-                }
-            }
-        }
-
-        // ✅ เผื่อ backend ไม่ส่ง event: done
-        assistant.streaming = false;
-        renderChat();
-        setStatus("Done ✅");
-        await refreshSessions();
+        const res = await apiRegenerateStream(sessionId);
+        end = await readGeneration(res, sessionId, assistant);
     } catch (e) {
-        assistant.streaming = false;
-        renderChat();
-        setStatus("Error: " + e.message);
+        end = { event: "error", data: e.message };
     }
+
+    streamFinish(assistant);
+    setStatus(end.event === "error" ? "Error: " + (end.data || "Streaming error") : "Done ✅");
+    await refreshSessions();
 }
 
 
@@ -322,8 +463,9 @@ async function sendMessageStream() {
 
     setStatus("Thinking...");
 
+    const sessionId = state.activeSessionId;
     const res = await fetch(
-        `/api/sessions/${state.activeSessionId}/chat/stream`,
+        `/api/sessions/${sessionId}/chat/stream`,
         {
             method: "POST",
             headers: { "Content-Type": "application/json" },
@@ -331,37 +473,13 @@ async function sendMessageStream() {
         }
     );
 
-    const reader = res.body.getReader();
-    const decoder = new TextDecoder("utf-8");
-    let buffer = "";
-
-    while (true) {
-        const { value, done } = await reader.read();
-        if (done) break;
+    const end = res.ok
+        ? await readGeneration(res, sessionId, assistant)
+        : { event: "error", data: rateLimitMessage(res) || `HTTP ${res.status}` };
 
-        buffer += decoder.decode(value, { stream: true });
-
-        let idx;
-        while ((idx = buffer.indexOf("\n\n")) !== -1) {
-            const rawEvent = buffer.slice(0, idx);
-            buffer = buffer.slice(idx + 2);
-
-            const dataLines = rawEvent
-                .split("\n")
-                .filter(l => l.startsWith("data:"))
-                .map(l => l.replace("data:", "").trimStart());
-
-            if (dataLines.length) {
-                assistant.content += dataLines.join("\n");
-                renderChat();
-            }
-        }
-    }
-
-    assistant.streaming = false;
-    renderChat();
+    streamFinish(assistant);
 
-    setStatus("Done ✅");
+    setStatus(end.event === "error" ? "Error: " + (end.data || "Streaming error") : "Done ✅");
     await refreshSessions();
 }
 
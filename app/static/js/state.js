@@ -5,6 +5,14 @@ export const state = {
     sessions: [],
     messages: [],
     activeLevel: "beginner",
+    // infinite scroll (โหลด history เก่าทีละหน้า)
+    historyCursor: null,
+    hasMoreHistory: false,
+    loadingHistory: false,
+    // ผลค้นหาข้อความ (/api/search): session_id -> hit แรก, null = ไม่ได้ค้น
+    searchHits: null,
+    // history ที่เคยโหลดต่อ session (กลับมาที่ session เดิม -> ขอเฉพาะ delta ด้วย sync token)
+    historyCache: new Map(),
 };
 
 export function setActiveSessionId(id) {
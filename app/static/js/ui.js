@@ -52,26 +52,23 @@ function stripMarkdown(md) {
 
 
 // ===== Markdown renderer =====
-function renderAssistantMarkdown(text, { streaming = false } = {}) {
-    const container = document.createElement("div");
-    container.className = "chatgpt-md";
-
-    // ✅ ระหว่าง stream: อย่า parse markdown (กัน fence ยังไม่ปิดแล้วเพี้ยน)
-    if (streaming) {
-        container.textContent = text || "";
-        return container;
+function markdownHtml(text) {
+    if (typeof window.marked === "undefined" || typeof window.DOMPurify === "undefined") {
+        return null;
     }
+    const html = window.marked.parse(text || "", { breaks: true });
+    return window.DOMPurify.sanitize(html);
+}
 
-    const hasMarked = typeof window.marked !== "undefined";
-    const hasPurify = typeof window.DOMPurify !== "undefined";
+function renderAssistantMarkdown(text) {
+    const container = document.createElement("div");
+    container.className = "chatgpt-md";
 
-    if (!hasMarked || !hasPurify) {
+    const clean = markdownHtml(text);
+    if (clean === null) {
         container.textContent = text || "";
         return container;
     }
-
-    const html = window.marked.parse(text || "", { breaks: true });
-    const clean = window.DOMPurify.sanitize(html);
     container.innerHTML = clean;
 
     container.querySelectorAll("pre").forEach((pre) => {
@@ -98,112 +95,223 @@ function renderAssistantMarkdown(text, { streaming = false } = {}) {
     return container;
 }
 
-export function renderChat() {
+function buildMessageRow(m, idx) {
+    const wrap = document.createElement("div");
+    wrap.className =
+        "flex w-full " +
+        (m.role === "user" ? "justify-end" : "justify-start");
+
+    const bubble = document.createElement("div");
+
+    if (m.role === "user") {
+        // USER bubble (เหมือน ChatGPT)
+        bubble.className =
+            "max-w-[70%] rounded-2xl px-4 py-3 " +
+            "bg-indigo-600 text-white whitespace-pre-wrap";
+        bubble.textContent = m.content;
+    }
+
+    if (m.role === "assistant") {
+        bubble.className =
+            "ai-bubble relative max-w-[70%] rounded-2xl px-6 py-4 " +
+            "bg-white dark:bg-slate-900 shadow-sm";
+
+        /* ===== Actions (Copy dropdown) ===== */
+        const actions = document.createElement("div");
+        actions.className =
+            "ai-actions absolute top-3 right-3 flex items-center gap-2 text-xs";
+
+        const copyBtn = document.createElement("button");
+        copyBtn.textContent = "Copy";
+        copyBtn.className =
+            "text-slate-400 hover:text-indigo-600 dark:hover:text-indigo-400";
+
+        const menu = document.createElement("div");
+        menu.addEventListener("click", (e) => {
+            e.stopPropagation();
+        });
+
+        menu.className =
+            "hidden absolute right-0 mt-6 w-40 rounded-lg border " +
+            "bg-white dark:bg-slate-800 shadow-lg z-10";
+
+        const copyMd = document.createElement("button");
+        copyMd.textContent = "Copy as Markdown";
+        copyMd.className =
+            "block w-full text-left px-3 py-2 hover:bg-slate-100 dark:hover:bg-slate-700";
+        copyMd.onclick = () => {
+            copyText(m.content, copyBtn);
+            menu.classList.add("hidden");
+        };
+
+        const copyTxt = document.createElement("button");
+        copyTxt.textContent = "Copy as Text";
+        copyTxt.className =
+            "block w-full text-left px-3 py-2 hover:bg-slate-100 dark:hover:bg-slate-700";
+        copyTxt.onclick = () => {
+            copyText(stripMarkdown(m.content), copyBtn);
+            menu.classList.add("hidden");
+        };
+
+        menu.append(copyMd, copyTxt);
+        actions.append(copyBtn, menu);
+
+        copyBtn.onclick = (e) => {
+            e.stopPropagation();
+            menu.classList.toggle("hidden");
+        };
+
+        bubble.appendChild(actions);
+
+        /* ===== Markdown content ===== */
+        if (m.streaming) {
+            // stream อยู่: ให้ stream view จัดการ (update เฉพาะ bubble นี้)
+            createStreamView(bubble, m);
+        } else {
+            bubble.appendChild(renderAssistantMarkdown(m.content));
+            if (isLastAssistant(idx)) appendRegenerate(bubble);
+        }
+    }
+
+    wrap.appendChild(bubble);
+    return wrap;
+}
+
+function appendRegenerate(bubble) {
+    /* ===== Regenerate (last only) ===== */
+    const regenWrap = document.createElement("div");
+    regenWrap.className = "mt-3 text-sm text-slate-500";
+
+    const regen = document.createElement("button");
+    regen.textContent = "🔄 Regenerate";
+    regen.className =
+        "hover:text-indigo-600 dark:hover:text-indigo-400";
+    regen.onclick = () => window.__chat.regenerateStream();
+
+    regenWrap.appendChild(regen);
+    bubble.appendChild(regenWrap);
+}
+
+export function renderChat({ scroll = true } = {}) {
     const chat = qs("chat");
     chat.innerHTML = "";
 
-    state.messages.forEach((m, idx) => {
-        const wrap = document.createElement("div");
-        wrap.className =
-            "flex w-full " +
-            (m.role === "user" ? "justify-end" : "justify-start");
+    const frag = document.createDocumentFragment();
+    state.messages.forEach((m, idx) => frag.appendChild(buildMessageRow(m, idx)));
+    chat.appendChild(frag);
 
-        const bubble = document.createElement("div");
+    if (scroll) scrollChatBottom();
+}
 
-        if (m.role === "user") {
-            // USER bubble (เหมือน ChatGPT)
-            bubble.className =
-                "max-w-[70%] rounded-2xl px-4 py-3 " +
-                "bg-indigo-600 text-white whitespace-pre-wrap";
-            bubble.textContent = m.content;
-        }
+// ===== Incremental streaming renderer =====
+// ระหว่าง stream ไม่ rebuild ทั้ง chat ต่อ chunk:
+// - update เฉพาะ bubble ที่กำลัง stream
+// - block ที่จบแล้ว (บรรทัดว่างนอก code fence / ปิด ```) parse + highlight ครั้งเดียวแล้ว freeze
+// - ส่วนท้ายที่ยังไม่จบ re-parse อย่างมาก 1 ครั้งต่อ frame (requestAnimationFrame)
+
+const streamViews = new WeakMap();
+const FENCE = /^\s{0,3}(```|~~~)/;
+
+function createStreamView(bubble, m) {
+    const frozen = document.createElement("div");
+    const tail = document.createElement("div");
+    tail.className = "chatgpt-md";
+
+    const cursor = document.createElement("span");
+    cursor.textContent = "▍";
+    cursor.className = "animate-pulse ml-1 text-slate-400";
+
+    bubble.append(frozen, tail, cursor);
+    const view = { bubble, frozen, tail, cursor, committed: 0, frame: 0 };
+    streamViews.set(m, view);
+    flushStreamView(m, view);
+    return view;
+}
 
-        if (m.role === "assistant") {
-            bubble.className =
-                "ai-bubble relative max-w-[70%] rounded-2xl px-6 py-4 " +
-                "bg-white dark:bg-slate-900 shadow-sm";
-
-            /* ===== Actions (Copy dropdown) ===== */
-            const actions = document.createElement("div");
-            actions.className =
-                "ai-actions absolute top-3 right-3 flex items-center gap-2 text-xs";
-
-            const copyBtn = document.createElement("button");
-            copyBtn.textContent = "Copy";
-            copyBtn.className =
-                "text-slate-400 hover:text-indigo-600 dark:hover:text-indigo-400";
-
-            const menu = document.createElement("div");
-            menu.addEventListener("click", (e) => {
-                e.stopPropagation();
-            });
-
-            menu.className =
-                "hidden absolute right-0 mt-6 w-40 rounded-lg border " +
-                "bg-white dark:bg-slate-800 shadow-lg z-10";
-
-            const copyMd = document.createElement("button");
-            copyMd.textContent = "Copy as Markdown";
-            copyMd.className =
-                "block w-full text-left px-3 py-2 hover:bg-slate-100 dark:hover:bg-slate-700";
-            copyMd.onclick = () => {
-                copyText(m.content, copyBtn);
-                menu.classList.add("hidden");
-            };
-
-            const copyTxt = document.createElement("button");
-            copyTxt.textContent = "Copy as Text";
-            copyTxt.className =
-                "block w-full text-left px-3 py-2 hover:bg-slate-100 dark:hover:bg-slate-700";
-            copyTxt.onclick = () => {
-                copyText(stripMarkdown(m.content), copyBtn);
-                menu.classList.add("hidden");
-            };
-
-            menu.append(copyMd, copyTxt);
-            actions.append(copyBtn, menu);
-
-            copyBtn.onclick = (e) => {
-                e.stopPropagation();
-                menu.classList.toggle("hidden");
-            };
-
-            bubble.appendChild(actions);
-
-            /* ===== Markdown content ===== */
-            const content = renderAssistantMarkdown(m.content, { streaming: !!m.streaming });
-            bubble.appendChild(content);
-
-            /* ===== Streaming cursor ===== */
-            if (m.streaming) {
-                const cursor = document.createElement("span");
-                cursor.textContent = "▍";
-                cursor.className = "animate-pulse ml-1 text-slate-400";
-                bubble.appendChild(cursor);
-            }
-
-            /* ===== Regenerate (last only) ===== */
-            if (isLastAssistant(idx) && !m.streaming) {
-                const regenWrap = document.createElement("div");
-                regenWrap.className = "mt-3 text-sm text-slate-500";
-
-                const regen = document.createElement("button");
-                regen.textContent = "🔄 Regenerate";
-                regen.className =
-                    "hover:text-indigo-600 dark:hover:text-indigo-400";
-                regen.onclick = () => window.__chat.regenerateStream();
-
-                regenWrap.appendChild(regen);
-                bubble.appendChild(regenWrap);
-            }
+// หา offset สุดท้ายที่ block ก่อนหน้าจบแน่ ๆ (เริ่มจาก from ซึ่งอยู่นอก fence เสมอ)
+export function completedBlockEnd(text, from = 0) {
+    let end = from;
+    let inFence = false;
+    let pos = from;
+
+    while (true) {
+        const nl = text.indexOf("\n", pos);
+        if (nl === -1) break;
+        const line = text.slice(pos, nl);
+        const next = nl + 1;
+
+        if (FENCE.test(line)) {
+            inFence = !inFence;
+            if (!inFence) end = next; // ปิด fence -> code block จบแล้ว
+        } else if (!inFence && !line.trim()) {
+            // บรรทัดว่าง: ตัดได้เมื่อบรรทัดถัดไปไม่ได้ indent (ไม่ใช่ส่วนต่อของ list / code)
+            const c = text[next];
+            if (c !== undefined && c !== " " && c !== "\t" && c !== "\n") end = next;
         }
+        pos = next;
+    }
+    return end;
+}
+
+function flushStreamView(m, view) {
+    view.frame = 0;
+    const text = m.content || "";
 
+    const end = completedBlockEnd(text, view.committed);
+    if (end > view.committed) {
+        const block = text.slice(view.committed, end);
+        if (block.trim()) view.frozen.appendChild(renderAssistantMarkdown(block));
+        view.committed = end;
+    }
 
-        wrap.appendChild(bubble);
-        chat.appendChild(wrap);
+    const rest = text.slice(view.committed);
+    if (!m.streaming) {
+        view.tail.replaceWith(renderAssistantMarkdown(rest));
+        view.cursor.remove();
+        streamViews.delete(m);
+        return;
+    }
+    // tail: parse markdown อย่างเดียว (ยังไม่ highlight / ไม่ใส่ปุ่ม copy จนกว่า block จะจบ)
+    const html = markdownHtml(rest);
+    if (html === null) view.tail.textContent = rest;
+    else view.tail.innerHTML = html;
+}
+
+function nearBottom(chat) {
+    return chat.scrollHeight - chat.scrollTop - chat.clientHeight < 80;
+}
+
+// เรียกทุก chunk ได้: งานจริงเกิดอย่างมากครั้งละ frame
+export function streamUpdate(m) {
+    const view = streamViews.get(m);
+    if (!view) {
+        renderChat();
+        return;
+    }
+    if (view.frame) return;
+    view.frame = requestAnimationFrame(() => {
+        const chat = qs("chat");
+        const stick = nearBottom(chat);
+        flushStreamView(m, view);
+        if (stick) scrollChatBottom();
     });
+}
 
-    scrollChatBottom();
+// จบ stream: freeze ส่วนที่เหลือ, เอา cursor ออก, ใส่ปุ่ม regenerate
+export function streamFinish(m) {
+    m.streaming = false;
+    const view = streamViews.get(m);
+    if (!view) {
+        renderChat();
+        return;
+    }
+    if (view.frame) cancelAnimationFrame(view.frame);
+
+    const chat = qs("chat");
+    const stick = nearBottom(chat);
+    flushStreamView(m, view);
+    if (isLastAssistant(state.messages.indexOf(m))) appendRegenerate(view.bubble);
+    if (stick) scrollChatBottom();
 }
 
 document.addEventListener("click", () => {
@@ -217,11 +325,24 @@ export function renderSessions() {
     const search = (qs("search").value || "").toLowerCase();
 
     sessionsEl.innerHTML = "";
-    state.sessions
+
+    // session ที่เจอจากการค้นข้อความแต่ยังไม่ได้โหลดใน sidebar
+    const hits = state.searchHits;
+    let sessions = state.sessions;
+    if (hits) {
+        const known = new Set(sessions.map((s) => String(s.id)));
+        const extra = [...hits.values()]
+            .filter((h) => !known.has(String(h.session_id)))
+            .map((h) => ({ id: h.session_id, title: h.session_title, last_preview: "" }));
+        sessions = sessions.concat(extra);
+    }
+
+    sessions
         .filter(s =>
             !search ||
             (s.title || "").toLowerCase().includes(search) ||
-            (s.last_preview || "").toLowerCase().includes(search)
+            (s.last_preview || "").toLowerCase().includes(search) ||
+            hits?.has(String(s.id))
         )
         .forEach((s) => {
             const isActive = String(s.id) === String(state.activeSessionId);
@@ -236,11 +357,15 @@ export function renderSessions() {
 
             item.dataset.sessionId = s.id;
 
+            // snippet จาก server escape HTML แล้ว (มีแค่ <mark>)
+            const hit = hits?.get(String(s.id));
+            const preview = hit ? hit.snippet : (s.last_preview || "—");
+
             item.innerHTML = `
                 <div class="flex-1 min-w-0">
                     <div class="font-semibold truncate">${s.title || `Session #${s.id}`}</div>
                     <div class="text-xs text-slate-500 dark:text-slate-400 truncate mt-1">
-                    ${s.last_preview || "—"}
+                    ${preview}
                     </div>
                 </div>
 
@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .context_window import MAX_MESSAGES, build_context, summary_budget, truncate_to_tokens
+from .db import AsyncSessionLocal
+from .gemini_client import summarize_async
+from .models import ChatMessage, ChatSummary
+from .pagination import encode_cursor, keyset_filter
+
+# Rolling summary ของข้อความเก่าที่หลุด context window
+# - refresh_summary() รันใน background หลังตอบเสร็จ (enqueue เข้า task_queue ดู tasks.py)
+# - สรุปเพิ่มเฉพาะข้อความใหม่ที่หลุด window ตั้งแต่ครั้งก่อน (incremental)
+#   "หลุด window" = เก่ากว่าข้อความเก่าสุดที่ build_context ส่งจริง (ทั้งเกิน MAX_MESSAGES และโดน token budget ตัด)
+# - summary ล่าสุด cache ไว้ใน memory จะได้ไม่ต้อง query ทุก turn
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "1").lower() not in {"0", "false", "no"}
+# สรุปเมื่อมีข้อความหลุด window ที่ยังไม่ถูกสรุปอย่างน้อยเท่านี้
+SUMMARY_MIN_BATCH = int(os.getenv("SUMMARY_MIN_BATCH", "10"))
+SUMMARY_MAX_BATCH = int(os.getenv("SUMMARY_MAX_BATCH", "60"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+
+_CACHE_SIZE = 4096
+_cache: OrderedDict[int, str] = OrderedDict()
+_cache_lock = threading.Lock()
+_running: set[int] = set()
+
+
+def _cache_get(session_id: int) -> str | None:
+    with _cache_lock:
+        text = _cache.get(session_id)
+        if text is not None:
+            _cache.move_to_end(session_id)
+        return text
+
+
+def _cache_put(session_id: int, text: str):
+    with _cache_lock:
+        _cache[session_id] = text
+        _cache.move_to_end(session_id)
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def forget_summary(session_id: int):
+    with _cache_lock:
+        _cache.pop(session_id, None)
+
+
+def get_summary(db: Session, session_id: int) -> str:
+    if not SUMMARY_ENABLED:
+        return ""
+    text = _cache_get(session_id)
+    if text is None:
+        text = db.scalar(select(ChatSummary.content).where(ChatSummary.session_id == session_id)) or ""
+        _cache_put(session_id, text)
+    return text
+
+
+async def get_summary_async(db: AsyncSession, session_id: int) -> str:
+    if not SUMMARY_ENABLED:
+        return ""
+    text = _cache_get(session_id)
+    if text is None:
+        text = await db.scalar(select(ChatSummary.content).where(ChatSummary.session_id == session_id)) or ""
+        _cache_put(session_id, text)
+    return text
+
+
+async def refresh_summary(session_id: int):
+    if not SUMMARY_ENABLED or session_id in _running:
+        return
+    _running.add(session_id)
+    try:
+        async with AsyncSessionLocal() as db:
+            await _refresh(db, session_id)
+    except Exception:
+        # summary เป็นแค่ตัวช่วย: พังก็ไม่กระทบแชท (ไว้ลองใหม่ turn ถัดไป)
+        logger.exception("summary refresh failed for session %s", session_id)
+    finally:
+        _running.discard(session_id)
+
+
+def context_boundary(window: list, summary: str = ""):
+    # window: MAX_MESSAGES message ล่าสุด (เก่า -> ใหม่) -> message เก่าสุดที่ build_context ส่งให้ model ครบ
+    # เก่ากว่านี้ (ทั้งที่หลุด MAX_MESSAGES และที่โดน token budget ตัด) ต้องอยู่ใน summary
+    # None = ทุก message ถูกส่งหมดแล้ว ไม่มีอะไรต้องสรุป
+    kept = build_context(
+        [{"role": m.role, "content": m.content} for m in window], budget=summary_budget(summary)
+    )
+    n = len(kept)
+    # ข้อความเก่าสุดที่ส่งแบบตัดบางส่วน (ขอบ budget / ยาวเกิน) นับว่าหลุด -> สรุปด้วย
+    if n and kept[0]["content"] != window[-n].content:
+        n -= 1
+    n = max(n, 1)
+    if n == len(window) and len(window) < MAX_MESSAGES:
+        return None
+    return window[-n]
+
+
+async def _refresh(db: AsyncSession, session_id: int):
+    summary = await db.get(ChatSummary, session_id)
+
+    window = (await db.execute(
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+        .limit(MAX_MESSAGES)
+    )).all()[::-1]
+    boundary = context_boundary(window, summary.content if summary else "")
+    if boundary is None:
+        return
+
+    conds = [
+        ChatMessage.session_id == session_id,
+        keyset_filter(ChatMessage, encode_cursor(boundary.created_at, boundary.id)),
+    ]
+    if summary and summary.covered_message_id:
+        conds.append(keyset_filter(
+            ChatMessage, encode_cursor(summary.covered_at, summary.covered_message_id), older=False
+        ))
+
+    pending_count = await db.scalar(select(func.count()).select_from(ChatMessage).where(*conds))
+    if pending_count < SUMMARY_MIN_BATCH:
+        return
+
+    pending = (await db.execute(
+        select(ChatMessage)
+        .where(*conds)
+        .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+        .limit(SUMMARY_MAX_BATCH)
+    )).scalars().all()
+
+    previous = summary.content if summary else ""
+    text = await summarize_async(previous, [{"role": m.role, "content": m.content} for m in pending])
+    text = truncate_to_tokens(text, SUMMARY_MAX_TOKENS) if text else previous
+
+    if summary is None:
+        summary = ChatSummary(session_id=session_id)
+        db.add(summary)
+    summary.content = text
+    summary.covered_message_id = pending[-1].id
+    summary.covered_at = pending[-1].created_at
+    await db.commit()
+
+    _cache_put(session_id, text)
@@ -0,0 +1,134 @@
+import asyncio
+import inspect
+import logging
+import os
+from dataclasses import dataclass, field
+
+# In-process background task queue (asyncio workers + retry with backoff)
+# ใช้กับงานที่ไม่ต้องรอก่อนตอบ user เช่น auto-title, rolling summary
+# enqueue ได้ทั้งจาก event loop และจาก threadpool (sync endpoints)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Job:
+    fn: object
+    args: tuple
+    retries: int
+    name: str
+    attempts: int = field(default=0)
+
+
+class TaskQueue:
+    def __init__(self, workers: int = 2, maxsize: int = 1000, backoff: float = 0.5):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.backoff = backoff
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._tasks: list[asyncio.Task] = []
+
+        self.enqueued = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+
+    @property
+    def started(self) -> bool:
+        return self._loop is not None
+
+    def start(self):
+        # ต้องเรียกจากใน event loop (startup event)
+        if self.started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [self._loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        if not self.started:
+            return
+        # flush งานที่ค้างก่อนปิด (จำกัดเวลา)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("task queue stopped with %s pending jobs", self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._loop, self._queue, self._tasks = None, None, []
+
+    def enqueue(self, fn, *args, retries: int = 2, name: str | None = None) -> bool:
+        job = _Job(fn=fn, args=args, retries=retries, name=name or getattr(fn, "__name__", "task"))
+
+        if not self.started:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                logger.warning("task queue not started, dropping %s", job.name)
+                self.dropped += 1
+                return False
+            self.start()
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self._loop:
+            self._put(job)
+        else:
+            self._loop.call_soon_threadsafe(self._put, job)
+        return True
+
+    def _put(self, job: _Job):
+        try:
+            self._queue.put_nowait(job)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("task queue full, dropping %s", job.name)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: _Job):
+        while True:
+            job.attempts += 1
+            try:
+                if inspect.iscoroutinefunction(job.fn):
+                    await job.fn(*job.args)
+                else:
+                    await asyncio.to_thread(job.fn, *job.args)
+                self.succeeded += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if job.attempts > job.retries:
+                    self.failed += 1
+                    logger.exception("task %s failed after %s attempts", job.name, job.attempts)
+                    return
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** (job.attempts - 1))
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "enqueued": self.enqueued,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+        }
+
+
+task_queue = TaskQueue(workers=int(os.getenv("TASK_WORKERS", "2")))
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import re
+
+from sqlalchemy import update
+
+from .context_window import count_tokens
+from .db import AsyncSessionLocal
+from .gemini_client import generate_chat_title_async
+from .models import ChatSession
+from .rate_limit import RateLimited, rate_limiter, reserve_tokens
+from .write_behind import message_writer
+
+# Auto-title แบบไม่ block ข้อความแรก:
+# 1) ตั้ง title จาก heuristic ทันที
+# 2) ให้ Gemini สร้าง title ที่ดีกว่าใน background (task queue + retry)
+# 3) stream ที่ยังเปิดอยู่รับ title ใหม่ผ่าน SSE event "title" (ไม่งั้น client ก็ fetch ทีหลัง)
+# นับ token budget เหมือน chat (จอง -> settle ตามที่ใช้จริง)
+# โดน rate limit -> ไม่เรียก Gemini ใช้ heuristic title ต่อไป (ไม่ retry)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TITLES = {"New Chat", "Study Chat"}
+
+_waiters: dict[int, asyncio.Future] = {}
+
+
+def heuristic_title(text: str) -> str:
+    line = next((ln for ln in (text or "").splitlines() if ln.strip()), "")
+    line = re.sub(r"[`*_#>\[\]()]+", " ", line)
+    words = line.split()[:6]
+    title = " ".join(words).strip(" ?!.,:;")
+    if not title:
+        return "Study Chat"
+    title = title[0].upper() + title[1:]
+    return title[:60]
+
+
+def title_waiter(session_id: int) -> asyncio.Future:
+    # เรียกใน event loop ก่อน enqueue refine_title
+    fut = _waiters.get(session_id)
+    if fut is None or fut.done():
+        fut = asyncio.get_running_loop().create_future()
+        _waiters[session_id] = fut
+    return fut
+
+
+def drop_title_waiter(session_id: int, fut: asyncio.Future):
+    if _waiters.get(session_id) is fut:
+        _waiters.pop(session_id, None)
+
+
+async def refine_title(session_id: int, user_text: str, placeholder: str):
+    try:
+        reserved = await rate_limiter.acquire_async(session_id, reserve_tokens(user_text, output=16))
+    except RateLimited as e:
+        logger.info("rate limited (%s), keeping heuristic title for session %s", e.scope, session_id)
+        return
+    try:
+        title = (await generate_chat_title_async(user_text) or "Study Chat")[:200]
+    except BaseException:
+        await rate_limiter.settle_async(session_id, reserved, 0, called=False)
+        raise
+    await rate_limiter.settle_async(session_id, reserved, count_tokens(user_text) + count_tokens(title))
+
+    # placeholder ไปกับ user message ใน write-behind -> ต้องลง DB ก่อนถึงจะ update ทับได้
+    await message_writer.drain_session(session_id)
+
+    async with AsyncSessionLocal() as db:
+        # อัปเดตเฉพาะถ้า title ยังเป็น placeholder (user อาจ rename ไปแล้ว)
+        result = await db.execute(
+            update(ChatSession)
+            .where(ChatSession.id == session_id, ChatSession.title == placeholder)
+            .values(title=title, version=ChatSession.version + 1)
+        )
+        await db.commit()
+
+    fut = _waiters.get(session_id)
+    if fut is not None and not fut.done() and result.rowcount:
+        fut.set_result(title)
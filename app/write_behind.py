@@ -0,0 +1,319 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, delete, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .context_cache import context_cache
+from .db import AsyncSessionLocal, read_router
+from .messages import PendingMessage, add_message_async, bump_version, make_preview, pending_writes
+from .metrics import WRITE_BEHIND_BATCH, WRITE_BEHIND_FLUSH
+from .models import ChatMessage, ChatSession
+
+# Write-behind ของ ChatMessage: รวม insert จากหลาย session เป็น batch เดียว
+# - persist() ใส่ queue แล้วคืนทันที (หรือรอจน batch commit ถ้า wait=True)
+# - flush เมื่อครบ WRITE_BEHIND_MAX_BATCH หรือผ่านไป WRITE_BEHIND_MAX_DELAY_MS หลัง message แรกของ batch
+# - 1 batch = 1 transaction: delete (regenerate) + multi-row INSERT ... RETURNING + touch session
+# - ลำดับต่อ session: writer ตัวเดียว flush ตามลำดับ queue, batch ถัดไปเริ่มหลัง batch ก่อน commit
+#   -> crash แล้วไม่มีทางที่คำตอบถึง DB แต่คำถามหาย (เสียได้แค่ message ท้าย ๆ ที่ยังไม่ flush)
+# - batch fail -> ลองใหม่ทีละ session (เช่น session ถูกลบไประหว่างรอ ไม่ลากคนอื่นไปด้วย)
+#   session ที่ fail: message ของ session นั้นที่ยังรอใน queue fail ตาม (error เดียวกัน)
+#   และคำตอบที่ persist(after=คำถาม) ทีหลังก็ fail ด้วย -> ไม่มีคำตอบที่คำถามไม่ได้ลง DB
+# - shutdown: stop() flush ที่ค้างทั้งหมดก่อนปิด
+# endpoint แบบ sync (threadpool) ที่เขียน / ลบตรง ๆ ต้องเรียก barrier(session_id) ก่อน
+# WRITE_BEHIND_ENABLED=0 -> persist() เขียน + commit ทันทีแบบเดิม
+#   (ใช้ session ของ caller ถ้าส่ง db= มา: request ที่ถือ connection อยู่แล้วไม่ต้องยืมอีกอัน)
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "1").lower() not in {"0", "false", "no"}
+WRITE_BEHIND_MAX_BATCH = int(os.getenv("WRITE_BEHIND_MAX_BATCH", "256"))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", "20"))
+
+
+class WritesPending(Exception):
+    # barrier หมดเวลาแต่ยังมี message ของ session ค้างใน queue (writer ช้า / DB ค้าง)
+    def __init__(self, session_id: int, pending: int):
+        super().__init__(f"{pending} message(s) of session {session_id} are still being written")
+        self.session_id = session_id
+        self.pending = pending
+
+
+class MessageWriter:
+    def __init__(
+        self,
+        max_batch: int = WRITE_BEHIND_MAX_BATCH,
+        max_delay_ms: float = WRITE_BEHIND_MAX_DELAY_MS,
+        enabled: bool = WRITE_BEHIND_ENABLED,
+    ):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.enabled = enabled
+        self._queue: list[PendingMessage] = []
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._seq = 0
+        # barrier ของ sync endpoint (รอใน thread ของ threadpool)
+        self._cond = threading.Condition()
+
+        self.enqueued = 0
+        self.written = 0
+        self.direct = 0
+        self.batches = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.barrier_timeouts = 0
+
+    @property
+    def started(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        # เรียกใน event loop (startup event)
+        if self.started or not self.enabled:
+            return
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if not self.started:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+
+    async def persist(
+        self,
+        session_id: int,
+        role: str,
+        content: str,
+        *,
+        replaces: int | None = None,
+        title: str | None = None,
+        wait: bool = False,
+        db: AsyncSession | None = None,
+        after: PendingMessage | None = None,
+    ) -> PendingMessage:
+        # wait=True: กลับเมื่อ commit แล้ว (raise ถ้า batch ของ message นี้ fail)
+        # db: session ของ caller ใช้ตอนเขียนตรง (commit ให้ด้วย)
+        # after: message ที่ต้องลงก่อน; fail ไปแล้ว -> raise error เดียวกัน ไม่เขียน
+        if after is not None and after.error is not None:
+            raise after.error
+        msg = PendingMessage(session_id, role, content, replaces=replaces, title=title, after=after)
+        if not self.started or self._closing:
+            await self._write_now(msg, db)
+            return msg
+
+        self._seq += 1
+        msg.seq = self._seq
+        msg.future = asyncio.get_running_loop().create_future()
+        pending_writes.add(msg)
+        # context cache อัปเดตทันที (turn ถัดไปเห็นเลย ไม่ต้องรอ flush)
+        if replaces:
+            context_cache.invalidate(session_id)
+        else:
+            context_cache.append(session_id, role, content)
+
+        self._queue.append(msg)
+        self.enqueued += 1
+        if len(self._queue) == 1 or len(self._queue) >= self.max_batch:
+            self._wakeup.set()
+
+        if wait:
+            await asyncio.shield(msg.future)
+            if msg.error is not None:
+                raise msg.error
+        return msg
+
+    async def drain_session(self, session_id: int):
+        # รอให้ message ที่ค้างของ session นี้ commit ก่อน (อ่านจาก DB ตรง ๆ ต่อได้)
+        futures = [m.future for m in pending_writes.snapshot(session_id) if m.future is not None]
+        if futures:
+            await asyncio.wait(futures)
+
+    def barrier(self, session_id: int, timeout: float = 10.0):
+        # เหมือน drain_session แต่สำหรับ sync endpoint (ห้ามเรียกใน event loop)
+        # หมดเวลา -> raise WritesPending (เขียนต่อไปจะลำดับสลับ / insert ให้ session ที่ลบแล้ว)
+        with self._cond:
+            if self._cond.wait_for(lambda: not pending_writes.snapshot(session_id), timeout):
+                return
+        pending = len(pending_writes.snapshot(session_id))
+        logger.warning("write barrier for session %s timed out after %ss, %s message(s) pending", session_id, timeout, pending)
+        self.barrier_timeouts += 1
+        raise WritesPending(session_id, pending)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._queue:
+                if self._closing:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            # message แรกของ batch เข้ามาแล้ว: รอจนครบ window หรือ batch เต็ม
+            deadline = loop.time() + self.max_delay
+            while len(self._queue) < self.max_batch and not self._closing:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[PendingMessage]):
+        t0 = time.perf_counter()
+        # คำถามของคำตอบไหน fail ใน batch ก่อน -> คำตอบ fail ตาม
+        failed = [m for m in batch if m.after is not None and m.after.error is not None]
+        for m in failed:
+            m.error = m.after.error
+        todo = [m for m in batch if m.error is None]
+        try:
+            if todo:
+                await self._commit(todo)
+            done = todo
+        except Exception:
+            logger.warning("write-behind batch of %s failed, retrying per session", len(todo), exc_info=True)
+            done = []
+            by_session: dict[int, list[PendingMessage]] = {}
+            for m in todo:
+                by_session.setdefault(m.session_id, []).append(m)
+            for group in by_session.values():
+                try:
+                    await self._commit(group)
+                    done += group
+                except Exception as e:
+                    logger.error("dropping %s messages of session %s: %s", len(group), group[0].session_id, e)
+                    for m in group:
+                        m.error = e
+                        m.id = None
+                    failed += group
+
+        # message ของ session ที่ fail ซึ่งยังรอใน queue (enqueue ก่อนรู้ว่า fail) -> fail ตาม ไม่ commit ทีหลัง
+        errors = {m.session_id: m.error for m in failed}
+        held = [m for m in self._queue if m.session_id in errors]
+        if held:
+            self._queue = [m for m in self._queue if m.session_id not in errors]
+            for m in held:
+                m.error = errors[m.session_id]
+            failed += held
+            batch = batch + held
+
+        WRITE_BEHIND_FLUSH.observe(time.perf_counter() - t0)
+        WRITE_BEHIND_BATCH.observe(len(batch))
+        self.batches += 1
+        self.written += len(done)
+        self.failed += len(failed)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+        for session_id in {m.session_id for m in failed}:
+            # cache มี message ที่ไม่ได้ลง DB
+            context_cache.invalidate(session_id)
+        pending_writes.discard(batch)
+        for m in batch:
+            if not m.future.done():
+                m.future.set_result(m.id)
+        with self._cond:
+            self._cond.notify_all()
+
+    async def _commit(self, msgs: list[PendingMessage]):
+        async with AsyncSessionLocal() as db:
+            replaced = [m.replaces for m in msgs if m.replaces]
+            if replaced:
+                await db.execute(delete(ChatMessage).where(ChatMessage.id.in_(replaced)))
+
+            result = await db.execute(
+                insert(ChatMessage).returning(ChatMessage.id, sort_by_parameter_order=True),
+                [{"session_id": m.session_id, "role": m.role, "content": m.content} for m in msgs],
+            )
+            ids = result.scalars().all()
+
+            # last_message_at / last_preview ตาม message ล่าสุดของแต่ละ session ใน batch
+            latest = {m.session_id: m for m in msgs}
+            table = ChatSession.__table__
+            await db.execute(
+                update(table)
+                .where(table.c.id == bindparam("sid"))
+                .values(last_message_at=func.now(), last_preview=bindparam("preview"), version=table.c.version + 1),
+                [{"sid": sid, "preview": make_preview(m.content)} for sid, m in latest.items()],
+            )
+            if replaced:
+                # regenerate แทนคำตอบเดิม -> delta token เก่าของ session นี้ใช้ไม่ได้
+                rewritten = {m.session_id for m in msgs if m.replaces}
+                await db.execute(
+                    update(table).where(table.c.id.in_(rewritten)).values(history_version=table.c.version)
+                )
+            titles = [{"sid": m.session_id, "new_title": m.title} for m in msgs if m.title]
+            if titles:
+                await db.execute(
+                    update(table).where(table.c.id == bindparam("sid")).values(title=bindparam("new_title")),
+                    titles,
+                )
+
+            # id ต้องมาก่อน commit: reader ที่เห็น row แล้วจะได้ตัดออกจาก overlay
+            for m, new_id in zip(msgs, ids):
+                m.id = new_id
+            await db.commit()
+        # read endpoint ของ session เหล่านี้อ่านจาก primary ไปอีกพัก (replica อาจยังไม่ตามทัน)
+        for session_id in latest:
+            read_router.note_write(session_id)
+
+    async def _write_now(self, msg: PendingMessage, db: AsyncSession | None = None):
+        # ไม่มี writer (ปิดอยู่ / ก่อน startup / ระหว่าง shutdown): เขียนตรงแบบเดิม
+        if db is None:
+            async with AsyncSessionLocal() as db:
+                await self._write_in(db, msg)
+        else:
+            await self._write_in(db, msg)
+        read_router.note_write(msg.session_id)
+        self.direct += 1
+
+    async def _write_in(self, db: AsyncSession, msg: PendingMessage):
+        if msg.replaces:
+            old = await db.get(ChatMessage, msg.replaces)
+            if old is not None:
+                await db.delete(old)
+                await db.execute(bump_version(msg.session_id, rewrite=True))
+                await db.flush()
+        if msg.title:
+            s = await db.get(ChatSession, msg.session_id)
+            if s is not None:
+                s.title = msg.title
+        row = await add_message_async(db, msg.session_id, msg.role, msg.content)
+        await db.commit()
+        msg.id = row.id
+
+    def stats(self) -> dict:
+        pending, sessions = pending_writes.count()
+        return {
+            "enabled": self.enabled,
+            "started": self.started,
+            "queued": len(self._queue),
+            "pending": pending,
+            "pending_sessions": sessions,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "direct": self.direct,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "failed": self.failed,
+            "barrier_timeouts": self.barrier_timeouts,
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000,
+        }
+
+
+message_writer = MessageWriter()
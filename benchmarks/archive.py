@@ -0,0 +1,164 @@
+"""Cold-session archiving: storage saved and cost of reopening an archived session.
+
+Seeds --cold sessions idle for 60 days and --hot sessions active today, --turns
+question / answer pairs each (markdown answers with code blocks), then:
+
+1. size of chat_messages (+ indexes) and GET .../messages latency on hot sessions
+2. archive_idle() with the default ARCHIVE_AFTER_DAYS (30)
+3. the same numbers again, plus first open of --reopen archived sessions (rehydrate + read)
+   vs a second open (already hot again)
+
+SQLite sizes are the file size after VACUUM; on Postgres (DATABASE_URL=postgresql+psycopg2://...)
+pg_total_relation_size of chat_messages / chat_archives.
+
+    python -m benchmarks.archive --cold 2000 --hot 200 --turns 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-archive-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ["ARCHIVE_INTERVAL_SECONDS"] = "0"
+
+WORDS = "function value list loop index base case recursion stack memory call return result input output".split()
+
+
+def answer(rnd: random.Random) -> str:
+    # markdown + code ที่ไม่ซ้ำกันทุกข้อความ (ไม่ให้บีบอัดได้ดีเกินจริง)
+    prose = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(80, 200)))
+    n = rnd.randint(2, 50)
+    code = f"def f{n}(xs):\n    total = 0\n    for x in xs[:{n}]:\n        total += x * {rnd.randint(1, 9)}\n    return total\n"
+    return f"## Step {n}\n\n{prose}.\n\n```python\n{code}```\n\n- {rnd.choice(WORDS)}: {rnd.random():.4f}\n"
+
+
+def seed(cold: int, hot: int, turns: int) -> tuple[list[int], list[int]]:
+    from sqlalchemy import insert
+
+    from app.db import SessionLocal
+    from app.messages import make_preview
+    from app.models import ChatMessage, ChatSession
+
+    rnd = random.Random(1)
+    now = datetime.now(timezone.utc)
+    ids: dict[str, list[int]] = {"cold": [], "hot": []}
+    with SessionLocal() as db:
+        for kind, count in (("cold", cold), ("hot", hot)):
+            at = now - timedelta(days=60) if kind == "cold" else now
+            for _ in range(count):
+                s = ChatSession(title=kind, last_message_at=at, last_preview="")
+                db.add(s)
+                db.flush()
+                rows = []
+                for t in range(turns):
+                    ts = at + timedelta(seconds=t)
+                    rows.append({"session_id": s.id, "role": "user", "content": f"question {t}: explain {rnd.choice(WORDS)}?", "created_at": ts})
+                    rows.append({"session_id": s.id, "role": "assistant", "content": answer(rnd), "created_at": ts})
+                db.execute(insert(ChatMessage), rows)
+                s.last_preview = make_preview(rows[-1]["content"])
+                ids[kind].append(s.id)
+        db.commit()
+    return ids["cold"], ids["hot"]
+
+
+def sizes() -> dict:
+    from sqlalchemy import text
+
+    from app.db import engine
+
+    with engine.connect() as conn:
+        rows, content = conn.execute(text("SELECT count(*), coalesce(sum(length(content)), 0) FROM chat_messages")).one()
+        out = {"rows": rows, "content_bytes": content}
+        if engine.dialect.name == "postgresql":
+            for table in ("chat_messages", "chat_archives"):
+                out[table] = conn.execute(text(f"SELECT pg_total_relation_size('{table}')")).scalar()
+    if engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+        out["db_file"] = os.path.getsize(engine.url.database)
+    return out
+
+
+def pct(values: list[float], p: float) -> float:
+    data = sorted(values)
+    return data[min(int(len(data) * p), len(data) - 1)] * 1000 if data else float("nan")
+
+
+async def read_latency(client, session_ids: list[int]) -> list[float]:
+    lat = []
+    for sid in session_ids:
+        t0 = time.perf_counter()
+        r = await client.get(f"/api/sessions/{sid}/messages")
+        lat.append(time.perf_counter() - t0)
+        assert r.status_code == 200 and r.json()["messages"], r.text
+    return lat
+
+
+def mb(n: int) -> str:
+    return f"{n / 1e6:.1f} MB"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cold", type=int, default=2000)
+    parser.add_argument("--hot", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--reopen", type=int, default=200)
+    args = parser.parse_args()
+
+    import httpx
+
+    from app.archive import archiver
+    from app.init_db import init_db
+    from app.main import app
+
+    init_db()
+    t0 = time.perf_counter()
+    cold, hot = seed(args.cold, args.hot, args.turns)
+    print(f"seeded {args.cold} cold + {args.hot} hot sessions x {args.turns * 2} messages in {time.perf_counter() - t0:.1f}s\n")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+        before = sizes()
+        hot_before = await read_latency(c, hot)
+
+        t0 = time.perf_counter()
+        n = await asyncio.to_thread(archiver.archive_idle)
+        took = time.perf_counter() - t0
+        archived = archiver.stats()
+
+        after = sizes()
+        hot_after = await read_latency(c, hot)
+        reopen = cold[: args.reopen]
+        first = await read_latency(c, reopen)
+        second = await read_latency(c, reopen)
+
+    print(f"archived {n} sessions in {took:.2f}s ({n / took:.0f} sessions/s)")
+    print(f"  archive blobs    {mb(archived['raw_bytes'])} json -> {mb(archived['stored_bytes'])} zlib (x{archived['ratio']})")
+    print(f"  chat_messages    {before['rows']} -> {after['rows']} rows, content {mb(before['content_bytes'])} -> {mb(after['content_bytes'])}")
+    for key in ("db_file", "chat_messages", "chat_archives"):
+        if key in before:
+            print(f"  {key:<16} {mb(before[key])} -> {mb(after[key])}")
+
+    print(f"\n{'GET messages':<28} {'p50 ms':>7} {'p95 ms':>7}")
+    for label, lat in (
+        ("hot, before archiving", hot_before),
+        ("hot, after archiving", hot_after),
+        ("archived, first open", first),
+        ("archived, second open", second),
+    ):
+        print(f"{label:<28} {pct(lat, 0.5):>7.2f} {pct(lat, 0.95):>7.2f}")
+    p = archiver.stats()["process"]
+    print(f"\nrehydrate alone: p50 {p['rehydrate_p50_ms']} ms, p95 {p['rehydrate_p95_ms']} ms, max {p['rehydrate_max_ms']} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""Prompt size: fixed messages[-20:] vs token-budgeted context builder.
+
+Builds synthetic study sessions (short questions, some long code answers)
+and compares prompt tokens per turn plus builder time (cold vs cached counts).
+
+    python -m benchmarks.context_window --turns 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.context_window import (  # noqa: E402
+    build_context,
+    context_tokens,
+    count_tokens,
+    truncate_to_tokens,
+    TOKEN_BUDGET,
+)
+
+CODE_LINE = "    result = compute(value, depth=depth + 1)  # recursive step\n"
+
+
+def synthetic_session(turns: int, long_ratio: float, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Question {i}: explain topic {rng.randint(1, 50)} please?"})
+        if rng.random() < long_ratio:
+            body = "```python\n" + CODE_LINE * rng.randint(80, 300) + "```\n"
+            answer = f"Here is a detailed answer for {i}.\n\n" + body
+        else:
+            answer = f"Short answer {i}: " + "this is a brief explanation. " * rng.randint(3, 15)
+        messages.append({"role": "assistant", "content": answer})
+    return messages
+
+
+def run(turns: int, long_ratio: float):
+    session = synthetic_session(turns, long_ratio)
+    legacy_sizes, budget_sizes, cold_ms, warm_ms = [], [], [], []
+
+    for t in range(2, len(session) + 1, 2):
+        history = session[:t]
+        legacy_sizes.append(context_tokens(history[-20:]))
+
+        count_tokens.cache_clear()
+        truncate_to_tokens.cache_clear()
+        t0 = time.perf_counter()
+        build_context(history)
+        cold_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        ctx = build_context(history)
+        warm_ms.append((time.perf_counter() - t0) * 1000)
+        budget_sizes.append(context_tokens(ctx))
+
+    legacy = statistics.mean(legacy_sizes)
+    budget = statistics.mean(budget_sizes)
+    print(
+        f"long_ratio={long_ratio:.2f}: legacy avg={legacy:,.0f} tok (max {max(legacy_sizes):,}) | "
+        f"budgeted avg={budget:,.0f} tok (max {max(budget_sizes):,}) | "
+        f"reduction={(1 - budget / legacy) * 100:.1f}% | "
+        f"build cold={statistics.mean(cold_ms):.3f}ms cached={statistics.mean(warm_ms):.3f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"token budget={TOKEN_BUDGET}")
+    for ratio in (0.0, 0.1, 0.3, 0.6):
+        run(args.turns, ratio)
+
+
+if __name__ == "__main__":
+    main()
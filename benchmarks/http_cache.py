@@ -0,0 +1,125 @@
+"""Read traffic of the frontend refresh pattern: ETag / 304, compression and delta sync.
+
+Seeds --sessions sessions with --messages messages each, then for each session
+replays what the UI does: load the history, refresh it with nothing new, and
+refresh it after one more chat turn. Modes:
+
+- plain:     no conditional headers, Accept-Encoding: identity (old behaviour)
+- gzip:      Accept-Encoding: gzip
+- etag:      gzip + If-None-Match from the previous response (browser cache)
+- delta:     gzip + ETag + ?since=<sync_token> from the previous response
+
+Reports bytes on the wire and latency per step (in-process ASGI, SQLite).
+
+    python -m benchmarks.http_cache --sessions 50 --messages 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-http-cache-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "1")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "0")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+WORDS = "function value list loop index base case recursion stack memory call return result input output".split()
+MODES = ("plain", "gzip", "etag", "delta")
+STEPS = ("load", "refresh", "after_turn")
+
+
+def seed(sessions: int, messages: int) -> list[int]:
+    from sqlalchemy import insert
+
+    from app.db import SessionLocal
+    from app.models import ChatMessage, ChatSession
+
+    rnd = random.Random(1)
+
+    def answer(i: int) -> str:
+        prose = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(40, 120)))
+        return f"## Step {i}\n\n{prose}.\n\n```python\ndef f{i}(n):\n    return n * {rnd.randint(2, 99)}\n```\n"
+
+    with SessionLocal() as db:
+        ids = []
+        for _ in range(sessions):
+            s = ChatSession(title="bench")
+            db.add(s)
+            db.flush()
+            db.execute(insert(ChatMessage), [
+                {"session_id": s.id, "role": "user" if i % 2 == 0 else "assistant",
+                 "content": f"question {i}?" if i % 2 == 0 else answer(i)}
+                for i in range(messages)
+            ])
+            ids.append(s.id)
+        db.commit()
+    return ids
+
+
+async def run(c, mode: str, session_ids: list[int]) -> dict:
+    out = {step: {"bytes": 0, "time": 0.0, "status": {}} for step in STEPS}
+    headers = {"Accept-Encoding": "identity" if mode == "plain" else "gzip"}
+
+    for sid in session_ids:
+        etag = token = None
+        for step in STEPS:
+            if step == "after_turn":
+                await c.post(f"/api/sessions/{sid}/chat/stream", json={"message": f"{mode} turn for {sid}"})
+            h = dict(headers)
+            params = {"limit": 200}
+            if mode in ("etag", "delta") and etag:
+                h["If-None-Match"] = etag
+            if mode == "delta" and token:
+                params["since"] = token
+            t0 = time.perf_counter()
+            r = await c.get(f"/api/sessions/{sid}/messages", params=params, headers=h)
+            elapsed = time.perf_counter() - t0
+            # bytes ที่ส่งจริง (ก่อน httpx แตก gzip)
+            size = int(r.headers.get("content-length") or 0)
+            stat = out[step]
+            stat["bytes"] += size
+            stat["time"] += elapsed
+            stat["status"][r.status_code] = stat["status"].get(r.status_code, 0) + 1
+            if r.status_code == 200:
+                etag = r.headers.get("etag")
+                token = r.json().get("sync_token")
+    return out
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=100)
+    args = parser.parse_args()
+
+    import httpx
+
+    from app.init_db import init_db
+    from app.main import app
+
+    init_db()
+    print(f"{args.sessions} sessions x {args.messages} messages, GET .../messages?limit=200\n")
+    print(f"{'mode':<7} {'step':<11} {'KB/req':>8} {'ms/req':>7}  status")
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+            for mode in MODES:
+                # session ชุดใหม่ทุก mode (turn ของ mode ก่อนไม่ปน)
+                ids = seed(args.sessions, args.messages)
+                r = await run(c, mode, ids)
+                for step in STEPS:
+                    s = r[step]
+                    status = " ".join(f"{k}x{v}" for k, v in sorted(s["status"].items()))
+                    print(f"{mode:<7} {step:<11} {s['bytes'] / len(ids) / 1024:>8.1f} {s['time'] / len(ids) * 1000:>7.2f}  {status}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
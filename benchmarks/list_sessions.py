@@ -0,0 +1,110 @@
+"""GET /api/sessions latency vs number of sessions (single query vs legacy N+1).
+
+Seeds SQLite with N sessions (2 messages each) and times the sidebar query.
+
+    python -m benchmarks.list_sessions --sizes 50 500 5000 50000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-sessions-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+
+from sqlalchemy import event, insert  # noqa: E402
+
+from app.db import engine, SessionLocal, Base  # noqa: E402
+from app.init_db import init_db  # noqa: E402
+from app.main import session_item, session_page  # noqa: E402
+from app.messages import make_preview  # noqa: E402
+from app.models import ChatSession, ChatMessage  # noqa: E402
+
+QUERIES = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _count(*_):
+    global QUERIES
+    QUERIES += 1
+
+
+def legacy_list_sessions(db):
+    # implementation เดิม (1 + 50 queries)
+    sessions = (
+        db.query(ChatSession)
+        .order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+        .limit(50)
+        .all()
+    )
+    result = []
+    for s in sessions:
+        last = (
+            db.query(ChatMessage)
+            .filter(ChatMessage.session_id == s.id)
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc())
+            .first()
+        )
+        result.append({"id": s.id, "last_preview": last.content if last else ""})
+    return {"sessions": result}
+
+
+def seed(total: int):
+    with SessionLocal() as db:
+        have = db.query(ChatSession).count()
+        missing = total - have
+        if missing <= 0:
+            return
+        rows = [
+            {"title": f"Session {i}", "level": "beginner", "last_preview": make_preview(f"answer {i}")}
+            for i in range(have, total)
+        ]
+        db.execute(insert(ChatSession), rows)
+        db.flush()
+        ids = [r[0] for r in db.query(ChatSession.id).filter(ChatSession.id > have).all()]
+        msgs = []
+        for sid in ids:
+            msgs.append({"session_id": sid, "role": "user", "content": f"question {sid}"})
+            msgs.append({"session_id": sid, "role": "assistant", "content": f"answer {sid} " * 30})
+        db.execute(insert(ChatMessage), msgs)
+        db.commit()
+
+
+def measure(fn, repeat: int) -> tuple[float, float]:
+    global QUERIES
+    times = []
+    QUERIES = 0
+    for _ in range(repeat):
+        with SessionLocal() as db:
+            t0 = time.perf_counter()
+            fn(db)
+            times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times), QUERIES / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 5000, 50000])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+
+    print(f"{'sessions':>9} {'new p50 ms':>11} {'new q':>6} {'legacy p50 ms':>14} {'legacy q':>9}")
+    for size in sorted(args.sizes):
+        seed(size)
+        new_ms, new_q = measure(lambda db: [session_item(x) for x in session_page(db)[0]], args.repeat)
+        old_ms, old_q = measure(legacy_list_sessions, args.repeat)
+        print(f"{size:>9} {new_ms:>11.2f} {new_q:>6.0f} {old_ms:>14.2f} {old_q:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Tail TTFT with hedged / retried / fallback streams against a flaky fake upstream.
+
+The fake model draws per request: FAKE_LLM_FAIL_RATE -> 503 before the first token,
+FAKE_LLM_SLOW_RATE -> first token after FAKE_LLM_SLOW_TTFT_MS (slow shard), else FAKE_LLM_TTFT_MS.
+
+- single:   one call, no retry / fallback / hedge (old behaviour)
+- retry:    + retry with jitter and fallback model before the first token
+- hedge:    + second request when no first token after --hedge-ms (budget --hedge-ratio)
+
+    python -m benchmarks.llm_hedging --streams 400 --concurrency 20 --slow-rate 0.05 --fail-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("FAKE_LLM_CHUNKS", "20")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "5")
+
+
+def pct(values: list[float], p: float) -> float:
+    data = sorted(values)
+    return data[min(int(len(data) * p), len(data) - 1)] * 1000 if data else float("nan")
+
+
+async def run(mode: str, args) -> dict:
+    from app import fake_llm
+    from app.fake_llm import FakeGenerativeModel
+    from app.llm_router import LLMRouter
+
+    fake_llm._rng.seed(args.seed)
+    FakeGenerativeModel.reset_stats()
+    router = LLMRouter(
+        fallback="fake-fallback" if mode != "single" else "",
+        hedge_after_ms=args.hedge_ms if mode == "hedge" else 0,
+        hedge_max_ratio=args.hedge_ratio,
+        retries=args.retries if mode != "single" else 0,
+        backoff_ms=args.backoff_ms,
+        ttft_timeout_ms=args.timeout_ms,
+    )
+    models = {}
+
+    def get_model(name: str):
+        if name not in models:
+            models[name] = FakeGenerativeModel(name)
+        return models[name]
+
+    ttft: list[float] = []
+    failed = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal failed
+        async with sem:
+            t0 = time.perf_counter()
+            first = None
+            try:
+                async for _ in router.stream(get_model, "fake-primary", "prompt"):
+                    if first is None:
+                        first = time.perf_counter() - t0
+            except Exception:
+                failed += 1
+                return
+            ttft.append(first)
+
+    await asyncio.gather(*[one() for _ in range(args.streams)])
+    return {
+        "ok": len(ttft),
+        "failed": failed,
+        "p50": pct(ttft, 0.5),
+        "p90": pct(ttft, 0.9),
+        "p99": pct(ttft, 0.99),
+        "max": pct(ttft, 1.0),
+        # ได้ token แรกหลัง slow shard ไปแล้วครึ่งทาง = ไม่ได้รับการช่วยจาก hedge / retry
+        "slow": sum(t * 1000 > args.slow_ms / 2 for t in ttft),
+        "calls": FakeGenerativeModel.calls / args.streams,
+        "events": router.stats()["events"],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--ttft-ms", type=float, default=150)
+    parser.add_argument("--slow-rate", type=float, default=0.05)
+    parser.add_argument("--slow-ms", type=float, default=3000)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--hedge-ms", type=float, default=400)
+    parser.add_argument("--hedge-ratio", type=float, default=0.1)
+    parser.add_argument("--retries", type=int, default=1)
+    parser.add_argument("--backoff-ms", type=float, default=100)
+    parser.add_argument("--timeout-ms", type=float, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # fake อ่าน env ตอนสร้าง model
+    os.environ["FAKE_LLM_TTFT_MS"] = str(args.ttft_ms)
+    os.environ["FAKE_LLM_SLOW_RATE"] = str(args.slow_rate)
+    os.environ["FAKE_LLM_SLOW_TTFT_MS"] = str(args.slow_ms)
+    os.environ["FAKE_LLM_FAIL_RATE"] = str(args.fail_rate)
+
+    print(f"{args.streams} streams, ttft {args.ttft_ms:.0f} ms, slow {args.slow_rate:.0%} @ {args.slow_ms:.0f} ms, "
+          f"fail {args.fail_rate:.0%}, hedge after {args.hedge_ms:.0f} ms (max {args.hedge_ratio:.0%})\n")
+    print(f"{'mode':<7} {'ok':>5} {'failed':>6} {'p50 ms':>7} {'p90 ms':>7} {'p99 ms':>7} {'max ms':>7} {'slow':>5} {'calls/req':>9}  events")
+    for mode in ("single", "retry", "hedge"):
+        r = await run(mode, args)
+        events = " ".join(f"{k}={v}" for k, v in sorted(r["events"].items()))
+        print(f"{mode:<7} {r['ok']:>5} {r['failed']:>6} {r['p50']:>7.0f} {r['p90']:>7.0f} {r['p99']:>7.0f} {r['max']:>7.0f} "
+              f"{r['slow']:>5} {r['calls']:>9.2f}  {events}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
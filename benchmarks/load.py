@@ -0,0 +1,414 @@
+"""End-to-end load test: simulated students against the whole app with a fake Gemini.
+
+Each student owns a chat session (seeded with --history messages) and loops:
+pick an action from --mix, run it, think for ~--think-ms (exponential), repeat.
+
+    list        GET  /api/sessions
+    messages    GET  /api/sessions/{id}/messages
+    chat        POST /api/sessions/{id}/chat/stream       (SSE, TTFT = first delta frame)
+    regenerate  POST /api/sessions/{id}/regenerate/stream (SSE)
+    pdf         POST /api/sessions/{id}/export-pdf
+
+Reports RPS, errors, p50 / p95 / p99 latency per action, TTFT for streams and
+concurrent streams (peak / time-averaged). Fake model: FAKE_LLM_TTFT_MS,
+FAKE_LLM_TOKENS_PER_SEC (or FAKE_LLM_CHUNK_DELAY_MS), FAKE_LLM_CHUNKS, FAKE_LLM_CHUNK_TOKENS.
+
+Default: app in-process (ASGI, same event loop as the clients) on a temp SQLite DB.
+Set DATABASE_URL for local Postgres. --url http://127.0.0.1:8000 drives a running server
+instead (start it with GEMINI_FAKE=1 to keep Gemini out of the loop).
+
+Comparable across commits: fixed --profile + --seed, JSON results with the commit hash.
+
+    python -m benchmarks.load --profile default --out load.json
+    python -m benchmarks.load --profile default --compare load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-load-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "300")
+os.environ.setdefault("FAKE_LLM_TOKENS_PER_SEC", "150")
+os.environ.setdefault("FAKE_LLM_CHUNKS", "40")
+os.environ.setdefault("FAKE_LLM_CHUNK_TOKENS", "3")
+# limiter / cache ไม่ใช่สิ่งที่วัด (20 rpm ต่อ session จะกลายเป็น 429 ทั้งหมด)
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "0")
+
+PROFILES = {
+    "smoke": {"students": 10, "duration": 10, "warmup": 2},
+    "default": {"students": 50, "duration": 30, "warmup": 5},
+    "heavy": {"students": 200, "duration": 60, "warmup": 10},
+}
+DEFAULT_MIX = "list=25,messages=35,chat=25,regenerate=10,pdf=5"
+STREAM_ACTIONS = {"chat", "regenerate"}
+
+TOPICS = [
+    "recursion", "binary search", "hash tables", "big-O notation", "linked lists", "dynamic programming",
+    "python decorators", "SQL joins", "TCP handshakes", "git rebase", "unit testing", "graph traversal",
+]
+
+
+@dataclass
+class Result:
+    status: int = 0
+    ttft: float | None = None
+    total: float = 0.0
+    size: int = 0
+
+
+class DeltaWatch:
+    # หา SSE frame แรกที่เป็นข้อความจาก model (ไม่มี event: = delta)
+    def __init__(self):
+        self.buf = b""
+        self.found = False
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.found:
+            return False
+        self.buf += chunk
+        while b"\n\n" in self.buf:
+            frame, self.buf = self.buf.split(b"\n\n", 1)
+            lines = frame.split(b"\n")
+            if any(line.startswith(b"data:") for line in lines) and not any(line.startswith(b"event:") for line in lines):
+                self.found = True
+                return True
+        return False
+
+
+class InProcessClient:
+    # เรียก ASGI app ตรง ๆ (httpx.ASGITransport buffer ทั้ง body -> วัด TTFT ไม่ได้)
+    def __init__(self, app):
+        self.app = app
+        self.cookies: dict[str, str] = {}
+
+    async def request(self, method: str, path: str, body=None) -> Result:
+        raw = json.dumps(body).encode() if body is not None else b""
+        path, _, query = path.partition("?")
+        headers = [(b"host", b"bench"), (b"content-type", b"application/json"), (b"content-length", str(len(raw)).encode())]
+        if self.cookies:
+            headers.append((b"cookie", "; ".join(f"{k}={v}" for k, v in self.cookies.items()).encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": headers, "client": ("127.0.0.1", 50000), "server": ("bench", 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": raw, "more_body": False}
+            # client ไม่ disconnect: รอจน app ยกเลิก listener เอง
+            await asyncio.Event().wait()
+
+        res, watch, t0 = Result(), DeltaWatch(), time.perf_counter()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                res.status = message["status"]
+                for k, v in message.get("headers", []):
+                    if k.lower() == b"set-cookie":
+                        name, _, value = v.decode().split(";", 1)[0].partition("=")
+                        self.cookies[name] = value
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                res.size += len(chunk)
+                if watch.feed(chunk):
+                    res.ttft = time.perf_counter() - t0
+
+        await self.app(scope, receive, send)
+        res.total = time.perf_counter() - t0
+        return res
+
+
+class HttpClient:
+    # server จริงผ่าน network (--url)
+    def __init__(self, base_url: str):
+        import httpx
+
+        self.client = httpx.AsyncClient(base_url=base_url, timeout=None)
+
+    async def request(self, method: str, path: str, body=None) -> Result:
+        res, watch, t0 = Result(), DeltaWatch(), time.perf_counter()
+        async with self.client.stream(method, path, json=body) as r:
+            res.status = r.status_code
+            async for chunk in r.aiter_raw():
+                res.size += len(chunk)
+                if watch.feed(chunk):
+                    res.ttft = time.perf_counter() - t0
+        res.total = time.perf_counter() - t0
+        return res
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"list", "messages", "chat", "regenerate", "pdf"}
+    if unknown:
+        raise SystemExit(f"unknown actions in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def seed_history(session_ids: list[int], history: int):
+    # history ตั้งต้นใส่ DB ตรง ๆ (เร็วกว่ายิง chat ทีละ turn)
+    from sqlalchemy import insert, update
+
+    from app.db import SessionLocal
+    from app.messages import make_preview
+    from app.models import ChatMessage, ChatSession
+
+    answer = "Here is a step-by-step explanation with a short example.\n\n```python\nprint('hi')\n```\n" * 4
+    with SessionLocal() as db:
+        rows = [
+            {"session_id": sid, "role": "user" if i % 2 == 0 else "assistant",
+             "content": f"question {i} about {TOPICS[i % len(TOPICS)]}" if i % 2 == 0 else answer}
+            for sid in session_ids for i in range(history)
+        ]
+        if rows:
+            db.execute(insert(ChatMessage), rows)
+            db.execute(
+                update(ChatSession).where(ChatSession.id.in_(session_ids))
+                .values(last_preview=make_preview(answer), title="Seeded session")
+            )
+        db.commit()
+
+
+class Recorder:
+    def __init__(self):
+        self.measuring = False
+        self.samples: dict[str, list[Result]] = {}
+        self.errors: dict[str, int] = {}
+        self.streams = 0
+        self.stream_samples: list[int] = []
+
+    def add(self, action: str, res: Result | None):
+        if not self.measuring:
+            return
+        if res is None or res.status >= 400:
+            self.errors[action] = self.errors.get(action, 0) + 1
+        else:
+            self.samples.setdefault(action, []).append(res)
+
+    async def sample_streams(self, stop: asyncio.Event):
+        while not stop.is_set():
+            if self.measuring:
+                self.stream_samples.append(self.streams)
+            await asyncio.sleep(0.1)
+
+
+def pct(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    data = sorted(values)
+    return data[min(int(len(data) * p), len(data) - 1)] * 1000
+
+
+async def student(i: int, client, session_id: int, mix: dict, think: float, rec: Recorder, stop: asyncio.Event, seed: int):
+    rnd = random.Random(seed * 100003 + i)
+    actions, weights = list(mix), list(mix.values())
+    turn = 0
+    while not stop.is_set():
+        action = rnd.choices(actions, weights)[0]
+        turn += 1
+        if action == "list":
+            call = ("GET", "/api/sessions", None)
+        elif action == "messages":
+            call = ("GET", f"/api/sessions/{session_id}/messages", None)
+        elif action == "chat":
+            # คำถามไม่ซ้ำกัน (response cache / summary ไม่ช่วยให้ผลดูดีเกินจริง)
+            question = f"Student {i}, turn {turn}: can you explain {rnd.choice(TOPICS)} with an example?"
+            call = ("POST", f"/api/sessions/{session_id}/chat/stream", {"message": question, "level": "beginner"})
+        elif action == "regenerate":
+            call = ("POST", f"/api/sessions/{session_id}/regenerate/stream", None)
+        else:
+            call = ("POST", f"/api/sessions/{session_id}/export-pdf", None)
+
+        stream = action in STREAM_ACTIONS
+        if stream:
+            rec.streams += 1
+        try:
+            res = await client.request(*call)
+        except Exception:
+            res = None
+        finally:
+            if stream:
+                rec.streams -= 1
+        rec.add(action, res)
+        await asyncio.sleep(rnd.expovariate(1 / think) if think > 0 else 0)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    stop = asyncio.Event()
+    rec = Recorder()
+
+    if args.url:
+        clients = [HttpClient(args.url) for _ in range(args.students)]
+        session_ids = []
+        for c in clients:
+            # ไม่มีสิทธิ์เขียน DB ของ server -> สร้าง session ผ่าน API, history โตเองจาก chat
+            r = await c.client.post("/api/sessions", json={"title": "Load test"})
+            session_ids.append(r.json()["session_id"])
+        lifespan = None
+    else:
+        from app.init_db import init_db
+        from app.main import app
+
+        init_db()
+        clients = [InProcessClient(app) for _ in range(args.students)]
+        lifespan = app.router.lifespan_context(app)
+        await lifespan.__aenter__()
+        from app.db import SessionLocal
+        from app.models import ChatSession
+
+        with SessionLocal() as db:
+            sessions = [ChatSession(title="Load test") for _ in clients]
+            db.add_all(sessions)
+            db.commit()
+            session_ids = [s.id for s in sessions]
+        seed_history(session_ids, args.history)
+
+    sampler = asyncio.create_task(rec.sample_streams(stop))
+    tasks = [
+        asyncio.create_task(student(i, c, sid, mix, args.think_ms / 1000, rec, stop, args.seed))
+        for i, (c, sid) in enumerate(zip(clients, session_ids))
+    ]
+    await asyncio.sleep(args.warmup)
+    rec.measuring = True
+    t0 = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    rec.measuring = False
+    window = time.perf_counter() - t0
+    stop.set()
+    await asyncio.gather(*tasks, sampler)
+    if lifespan is not None:
+        await lifespan.__aexit__(None, None, None)
+
+    actions = {}
+    total = 0
+    for action in mix:
+        samples = rec.samples.get(action, [])
+        total += len(samples)
+        lat = [r.total for r in samples]
+        ttft = [r.ttft for r in samples if r.ttft is not None]
+        actions[action] = {
+            "count": len(samples),
+            "errors": rec.errors.get(action, 0),
+            "rps": round(len(samples) / window, 2),
+            "p50_ms": pct(lat, 0.5), "p95_ms": pct(lat, 0.95), "p99_ms": pct(lat, 0.99),
+            "ttft_p50_ms": pct(ttft, 0.5), "ttft_p95_ms": pct(ttft, 0.95), "ttft_p99_ms": pct(ttft, 0.99),
+        }
+    streams = rec.stream_samples or [0]
+    return {
+        "commit": git_commit(),
+        "config": {
+            "profile": args.profile, "students": args.students, "duration": args.duration, "warmup": args.warmup,
+            "mix": args.mix, "think_ms": args.think_ms, "history": args.history, "seed": args.seed,
+            "transport": args.url or "asgi", "db": os.environ["DATABASE_URL"].split(":", 1)[0],
+            "fake_llm": {k: os.environ.get(k) for k in (
+                "FAKE_LLM_TTFT_MS", "FAKE_LLM_TOKENS_PER_SEC", "FAKE_LLM_CHUNK_DELAY_MS", "FAKE_LLM_CHUNKS", "FAKE_LLM_CHUNK_TOKENS",
+            ) if os.environ.get(k)},
+            "python": platform.python_version(),
+        },
+        "window_s": round(window, 2),
+        "rps": round(total / window, 2),
+        "errors": sum(rec.errors.values()),
+        "streams_peak": max(streams),
+        "streams_avg": round(sum(streams) / len(streams), 1),
+        "actions": actions,
+    }
+
+
+def _fmt(v) -> str:
+    return "-" if v is None else f"{v:.0f}"
+
+
+def report(r: dict, baseline: dict | None = None):
+    c = r["config"]
+    print(f"commit {r['commit']}  profile {c['profile']}: {c['students']} students, {r['window_s']}s measured, "
+          f"think {c['think_ms']:.0f} ms, db {c['db']}, transport {c['transport']}")
+    print(f"fake llm: {c['fake_llm']}\n")
+    print(f"{'action':<11} {'count':>6} {'err':>4} {'rps':>7} {'p50':>6} {'p95':>6} {'p99':>6}   {'ttft p50':>8} {'p95':>6} {'p99':>6}  (ms)")
+    for name, a in r["actions"].items():
+        print(f"{name:<11} {a['count']:>6} {a['errors']:>4} {a['rps']:>7.2f} {_fmt(a['p50_ms']):>6} {_fmt(a['p95_ms']):>6} "
+              f"{_fmt(a['p99_ms']):>6}   {_fmt(a['ttft_p50_ms']):>8} {_fmt(a['ttft_p95_ms']):>6} {_fmt(a['ttft_p99_ms']):>6}")
+    print(f"\ntotal {r['rps']:.2f} req/s, {r['errors']} errors, concurrent streams peak {r['streams_peak']} avg {r['streams_avg']}")
+
+    if baseline is None:
+        return
+    print(f"\nvs {baseline['commit']} ({baseline['config']['profile']}, {baseline['config']['students']} students):")
+    if baseline["config"] != {**c, "python": baseline["config"].get("python")}:
+        print("  note: configs differ, deltas are not like-for-like")
+
+    def delta(new, old) -> str:
+        if new is None or old in (None, 0):
+            return "-"
+        return f"{(new - old) / old * 100:+.0f}%"
+
+    print(f"{'action':<11} {'rps':>7} {'p95':>7} {'p99':>7} {'ttft p95':>9}")
+    for name, a in r["actions"].items():
+        b = baseline["actions"].get(name)
+        if b is None:
+            continue
+        print(f"{name:<11} {delta(a['rps'], b['rps']):>7} {delta(a['p95_ms'], b['p95_ms']):>7} "
+              f"{delta(a['p99_ms'], b['p99_ms']):>7} {delta(a['ttft_p95_ms'], b['ttft_p95_ms']):>9}")
+    print(f"{'total':<11} {delta(r['rps'], baseline['rps']):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="default")
+    parser.add_argument("--students", type=int)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--warmup", type=float)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--think-ms", type=float, default=500)
+    parser.add_argument("--history", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url")
+    parser.add_argument("--out")
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    for key, value in PROFILES[args.profile].items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nwrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
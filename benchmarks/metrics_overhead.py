@@ -0,0 +1,107 @@
+"""Metrics overhead: cost per observation and per request with METRICS_ENABLED=0 vs 1.
+
+1) micro: ns per Histogram.observe / Counter.inc / llm_call / query-count hook
+2) requests: GET /api/sessions/{id}/messages (1 query) through the ASGI app, each mode
+   in a fresh process (the middleware and engine events are installed at import time)
+3) GET /metrics render time
+
+    python -m benchmarks.metrics_overhead --requests 3000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-metrics-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+
+
+def micro(n: int = 200_000):
+    from app.metrics import Counter, Histogram, llm_call, _statement_kind
+
+    h = Histogram("bench_seconds", "bench", ("route",))
+    c = Counter("bench_total", "bench", ("route",))
+
+    def ns(fn) -> float:
+        return timeit.timeit(fn, number=n) / n * 1e9
+
+    def one_call():
+        with llm_call("stream", "beginner", "prompt") as call:
+            call.chunk("token")
+
+    print(f"{'operation':<34} {'ns/op':>8}")
+    print(f"{'(empty call, baseline)':<34} {ns(lambda: None):>8.0f}")
+    print(f"{'Histogram.labels().observe':<34} {ns(lambda: h.labels('/api/x').observe(0.012)):>8.0f}")
+    print(f"{'Counter.labels().inc':<34} {ns(lambda: c.labels('/api/x').inc()):>8.0f}")
+    print(f"{'llm_call enter+chunk+exit':<34} {ns(one_call) :>8.0f}")
+    print(f"{'statement kind':<34} {ns(lambda: _statement_kind('SELECT id FROM chat_messages')):>8.0f}")
+
+
+def _requests(enabled: str, n: int, conn):
+    os.environ["METRICS_ENABLED"] = enabled
+    import httpx
+
+    from app.main import app
+    from app.init_db import init_db
+    from app.metrics import registry
+
+    init_db()
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as c:
+            sid = (await c.post("/api/sessions", json={"title": "bench"})).json()["session_id"]
+            url = f"/api/sessions/{sid}/messages"
+            for _ in range(200):
+                await c.get(url)
+            samples = []
+            for _ in range(n):
+                t0 = time.perf_counter()
+                await c.get(url)
+                samples.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            body = registry.render()
+            render = time.perf_counter() - t0
+            return samples, render, len(body)
+
+    samples, render, size = asyncio.run(main())
+    conn.send((statistics.mean(samples), statistics.median(samples), render, size))
+    conn.close()
+
+
+def requests(n: int):
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for enabled in ("0", "1"):
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=_requests, args=(enabled, n, child))
+        p.start()
+        results[enabled] = parent.recv()
+        p.join()
+
+    print(f"\n{'metrics':>8} {'mean us':>9} {'p50 us':>9} {'render ms':>10} {'body KB':>8}")
+    for enabled, (mean, p50, render, size) in results.items():
+        print(f"{'on' if enabled == '1' else 'off':>8} {mean * 1e6:>9.1f} {p50 * 1e6:>9.1f} {render * 1000:>10.2f} {size / 1024:>8.1f}")
+    off, on = results["0"][1], results["1"][1]
+    print(f"overhead per request (p50): {(on - off) * 1e6:.1f} us ({(on - off) / off * 100:.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--ops", type=int, default=200_000)
+    args = parser.parse_args()
+    micro(args.ops)
+    requests(args.requests)
+
+
+if __name__ == "__main__":
+    main()
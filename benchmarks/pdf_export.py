@@ -0,0 +1,128 @@
+"""PDF export: peak RSS and wall time vs message count (legacy in-memory vs streaming).
+
+Each measurement runs in a fresh process so ru_maxrss reflects that export only.
+
+    python -m benchmarks.pdf_export --sizes 100 1000 5000
+"""
+import argparse
+import importlib
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-pdf-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+
+ANSWER = (
+    "Recursion is when a function calls itself to solve a smaller piece of the problem. "
+    "Each call must move towards a base case, otherwise it never stops.\n"
+    "def fact(n):\n    return 1 if n <= 1 else n * fact(n - 1)\n"
+) * 4
+
+
+def seed(sizes: list[int]) -> dict[int, int]:
+    from sqlalchemy import insert
+
+    from app.db import SessionLocal
+    from app.init_db import init_db
+    from app.models import ChatSession, ChatMessage
+
+    init_db()
+    ids = {}
+    with SessionLocal() as db:
+        for size in sizes:
+            s = ChatSession(title=f"Bench {size}")
+            db.add(s)
+            db.flush()
+            rows = [
+                {"session_id": s.id, "role": "user" if i % 2 == 0 else "assistant",
+                 "content": f"Question {i}?" if i % 2 == 0 else ANSWER}
+                for i in range(size)
+            ]
+            db.execute(insert(ChatMessage), rows)
+            ids[size] = s.id
+        db.commit()
+    return ids
+
+
+def _legacy(session_id: int, out: str):
+    # implementation เดิม: .all() -> list -> story ทั้งก้อน -> BytesIO
+    from io import BytesIO
+
+    from reportlab.lib.pagesizes import A4
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    from app.db import SessionLocal
+    from app.models import ChatMessage
+    from app.pdf_utils import _styles, _message_flowables
+
+    with SessionLocal() as db:
+        msgs = (
+            db.query(ChatMessage)
+            .filter(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+            .all()
+        )
+        payload = [{"role": m.role, "content": m.content} for m in msgs]
+    styles = _styles()
+    story = [Paragraph("Study Chat", styles["TitleStyle"]), Spacer(1, 12)]
+    for m in payload:
+        story.extend(_message_flowables(m, styles))
+    buf = BytesIO()
+    SimpleDocTemplate(buf, pagesize=A4, leftMargin=40, rightMargin=40, topMargin=50, bottomMargin=40).build(story)
+    with open(out, "wb") as f:
+        f.write(buf.getvalue())
+
+
+def _streaming(session_id: int, out: str):
+    from app.pdf_utils import export_session_pdf
+
+    export_session_pdf(session_id, "Study Chat", out)
+
+
+def _measure(mode: str, session_id: int, conn):
+    # โหลด reportlab ก่อนจับเวลา (import cost ไม่นับใน wall time)
+    importlib.import_module("app.pdf_utils")
+
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    out = os.path.join(_tmp, f"{mode}-{session_id}.pdf")
+    t0 = time.perf_counter()
+    (_legacy if mode == "legacy" else _streaming)(session_id, out)
+    wall = time.perf_counter() - t0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((wall, base / 1024, peak / 1024, os.path.getsize(out)))
+    conn.close()
+
+
+def run(mode: str, session_id: int):
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    p = ctx.Process(target=_measure, args=(mode, session_id, child))
+    p.start()
+    result = parent.recv()
+    p.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    args = parser.parse_args()
+
+    ids = seed(args.sizes)
+    print(f"{'messages':>8} {'mode':>9} {'wall s':>8} {'base MB':>8} {'peak MB':>8} {'pdf KB':>8}")
+    for size in args.sizes:
+        for mode in ("legacy", "streaming"):
+            wall, base, peak, nbytes = run(mode, ids[size])
+            print(f"{size:>8} {mode:>9} {wall:>8.2f} {base:>8.1f} {peak:>8.1f} {nbytes / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Read/write routing: read-your-writes and read load split with a lagging replica.
+
+Two SQLite files stand in for primary and replica; a thread copies primary -> replica
+every --lag-ms with the sqlite backup API (emulated async replication).
+
+- writers: POST /api/sessions/{id}/chat, then immediately GET .../messages and check the
+  reply is there (stale = read-your-writes violation)
+- readers: fresh clients (no cookie) GET /api/sessions and .../messages of random sessions
+
+Each mode runs in a fresh process (engines / router are configured at import time):
+
+    primary     no DATABASE_REPLICA_URLS
+    replica     replica + stickiness (DB_REPLICA_STICKY_SECONDS=5)
+    no-sticky   replica, DB_REPLICA_STICKY_SECONDS=0
+
+Point DATABASE_URL / DATABASE_REPLICA_URLS at two local Postgres (streaming replication)
+to measure the real thing; the lag thread is only used for the SQLite stand-ins.
+
+    python -m benchmarks.read_replicas --writers 8 --readers 16 --seconds 10 --lag-ms 200
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    "primary": {},
+    "replica": {"DB_REPLICA_STICKY_SECONDS": "5"},
+    "no-sticky": {"DB_REPLICA_STICKY_SECONDS": "0"},
+}
+
+
+def _copy(primary: str, replica: str):
+    src, dst = sqlite3.connect(primary), sqlite3.connect(replica, timeout=5)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def _replicate(primary: str, replica: str, lag: float, stop: threading.Event):
+    while not stop.wait(lag):
+        try:
+            _copy(primary, replica)
+        except sqlite3.OperationalError:
+            pass  # replica ถูกอ่านอยู่ -> รอรอบหน้า (lag ยาวขึ้น)
+
+
+def _run(mode: str, args, conn):
+    tmp = tempfile.mkdtemp(prefix="bench-replicas-")
+    primary, replica = f"{tmp}/primary.db", f"{tmp}/replica.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{primary}"
+    os.environ["GEMINI_FAKE"] = "1"
+    os.environ.setdefault("FAKE_LLM_TTFT_MS", "20")
+    os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "1")
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    os.environ["RESPONSE_CACHE_ENABLED"] = "0"
+    if mode != "primary":
+        os.environ["DATABASE_REPLICA_URLS"] = f"sqlite:///{replica}"
+    os.environ.update(MODES[mode])
+
+    import httpx
+
+    from app.init_db import init_db
+    from app.main import app
+    from app.db import pool_stats
+
+    init_db()
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        base = "http://bench"
+        async with httpx.AsyncClient(transport=transport, base_url=base) as c:
+            ids = [(await c.post("/api/sessions", json={"title": f"s{i}"})).json()["session_id"] for i in range(args.sessions)]
+            for sid in ids:
+                await c.post(f"/api/sessions/{sid}/chat", json={"message": "seed"})
+
+        stop = threading.Event()
+        if mode != "primary":
+            _copy(primary, replica)
+            threading.Thread(target=_replicate, args=(primary, replica, args.lag_ms / 1000, stop), daemon=True).start()
+
+        deadline = time.perf_counter() + args.seconds
+        stale = writes = 0
+        read_lat: list[float] = []
+
+        async def writer(i: int):
+            nonlocal stale, writes
+            sid = ids[i % len(ids)]
+            async with httpx.AsyncClient(transport=transport, base_url=base) as c:
+                n = 0
+                while time.perf_counter() < deadline:
+                    n += 1
+                    msg = f"writer {i} turn {n}"
+                    await c.post(f"/api/sessions/{sid}/chat", json={"message": msg})
+                    rows = (await c.get(f"/api/sessions/{sid}/messages", params={"limit": 2})).json()["messages"]
+                    writes += 1
+                    if not any(r["content"] == msg for r in rows):
+                        stale += 1
+
+        async def reader(i: int):
+            rnd = random.Random(i)
+            while time.perf_counter() < deadline:
+                # client ใหม่ทุกครั้ง (ไม่มี cookie จาก write)
+                async with httpx.AsyncClient(transport=transport, base_url=base) as c:
+                    t0 = time.perf_counter()
+                    await c.get("/api/sessions")
+                    await c.get(f"/api/sessions/{rnd.choice(ids)}/messages")
+                    read_lat.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*[writer(i) for i in range(args.writers)], *[reader(i) for i in range(args.readers)])
+        stop.set()
+        return writes, stale, read_lat
+
+    async def with_lifespan():
+        async with app.router.lifespan_context(app):
+            return await main()
+
+    writes, stale, read_lat = asyncio.run(with_lifespan())
+    read_lat.sort()
+    stats = pool_stats()
+    conn.send({
+        "writes": writes,
+        "stale": stale,
+        "reads": len(read_lat),
+        "p50": statistics.median(read_lat) if read_lat else 0.0,
+        "p95": read_lat[int(len(read_lat) * 0.95)] if read_lat else 0.0,
+        "routing": stats["routing"]["reads"],
+        "wait": {name: e.get("avg_wait_ms", 0.0) for name, e in stats["engines"].items()},
+    })
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--lag-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{args.writers} writers, {args.readers} readers, {args.seconds:.0f}s, replica lag ~{args.lag_ms:.0f} ms\n")
+    print(f"{'mode':<10} {'writes':>7} {'stale':>6} {'reads':>6} {'p50 ms':>7} {'p95 ms':>7}  routing / avg pool wait ms")
+    for mode in MODES:
+        parent, child = ctx.Pipe()
+        p = ctx.Process(target=_run, args=(mode, args, child))
+        p.start()
+        r = parent.recv()
+        p.join()
+        routing = " ".join(f"{k}={v}" for k, v in sorted(r["routing"].items()))
+        wait = " ".join(f"{k}={v}" for k, v in r["wait"].items())
+        print(f"{mode:<10} {r['writes']:>7} {r['stale']:>6} {r['reads']:>6} {r['p50'] * 1000:>7.1f} {r['p95'] * 1000:>7.1f}  {routing} | {wait}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""GET /api/search latency vs number of messages.
+
+Seeds N synthetic study messages and times a mix of word, phrase and code
+queries (first page, 20 results). Point DATABASE_URL at Postgres to measure
+the tsvector/GIN and trigram paths; without it the run uses SQLite and the
+LIKE fallback (the baseline).
+
+    DATABASE_URL=postgresql+psycopg2://... python -m benchmarks.search --messages 1000000
+    python -m benchmarks.search --messages 20000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-search-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+
+from sqlalchemy import func, insert, select, text  # noqa: E402
+
+from app.db import engine, SessionLocal  # noqa: E402
+from app.init_db import init_db  # noqa: E402
+from app.models import ChatSession, ChatMessage  # noqa: E402
+from app.search import search_messages  # noqa: E402
+
+TOPICS = [
+    "recursion", "binary search", "linked list", "hash table", "dynamic programming",
+    "big O notation", "sorting algorithm", "graph traversal", "stack overflow", "pointer arithmetic",
+    "photosynthesis", "cell division", "derivative", "integral", "probability",
+]
+FILLER = (
+    "the idea is simple once you see an example so let us walk through it step by step "
+    "and compare the cost of each approach before writing any code"
+).split()
+SNIPPETS = [
+    "def fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)",
+    "for (int i = 0; i < n; i++) { sum += a[i]; }",
+    "items.sort(key=lambda x: x.score)",
+    "std::vector<int> v; v.push_back(42);",
+]
+QUERIES = ["recursion", "binary search", "dynamic programming example", "photosynthesis light", "fib(n)", "push_back"]
+BATCH = 10_000
+
+
+def make_message(rng: random.Random, i: int) -> str:
+    topic = rng.choice(TOPICS)
+    words = rng.sample(FILLER, 12)
+    body = f"Question about {topic}: " + " ".join(words)
+    if i % 2:
+        body = f"{topic.capitalize()} explained. " + " ".join(rng.sample(FILLER, 20))
+        if rng.random() < 0.3:
+            body += "\n```\n" + rng.choice(SNIPPETS) + "\n```"
+    return body
+
+
+def seed(total: int):
+    init_db()
+    rng = random.Random(42)
+    with SessionLocal() as db:
+        have = db.scalar(select(func.count()).select_from(ChatMessage))
+        if have >= total:
+            return
+        sessions = max(total // 40, 1)
+        db.execute(insert(ChatSession), [{"title": f"Bench {i}"} for i in range(sessions)])
+        first = db.scalar(select(func.min(ChatSession.id)))
+        db.commit()
+        for start in range(have, total, BATCH):
+            rows = [
+                {"session_id": first + (i // 40) % sessions, "role": "user" if i % 2 == 0 else "assistant",
+                 "content": make_message(rng, i)}
+                for i in range(start, min(start + BATCH, total))
+            ]
+            db.execute(insert(ChatMessage), rows)
+            db.commit()
+    if engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE chat_messages"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    seed(args.messages)
+    print(f"dialect={engine.dialect.name} messages={args.messages} seed={time.perf_counter() - t0:.1f}s")
+    print(f"{'query':>28} {'mode':>8} {'hits':>5} {'p50 ms':>8} {'p95 ms':>8} {'page2 ms':>9}")
+
+    with SessionLocal() as db:
+        for q in QUERIES:
+            times = []
+            for _ in range(args.repeat):
+                t = time.perf_counter()
+                res = search_messages(db, q)
+                times.append((time.perf_counter() - t) * 1000)
+            page2 = 0.0
+            if res["next_cursor"]:
+                t = time.perf_counter()
+                search_messages(db, q, cursor=res["next_cursor"])
+                page2 = (time.perf_counter() - t) * 1000
+            times.sort()
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print(f"{q:>28} {res['mode']:>8} {len(res['results']):>5} "
+                  f"{statistics.median(times):>8.2f} {p95:>8.2f} {page2:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
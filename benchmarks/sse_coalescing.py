@@ -0,0 +1,58 @@
+"""SSE chunk coalescing: frames / bytes / time-to-first-byte per coalesce window.
+
+Streams the fake model (many small chunks) through the Coalescer with different
+time windows. window=0 is the old behaviour: one SSE frame per model chunk.
+
+    python -m benchmarks.sse_coalescing --windows 0 20 50 --chunks 300
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "200")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "3")
+
+
+async def run(window_ms: float, streams: int) -> dict:
+    from app.gemini_client import chat_reply_stream_async
+    from app.sse import Coalescer, sse_frame
+
+    async def one():
+        coalescer = Coalescer(window_ms=window_ms)
+        t0 = time.perf_counter()
+        ttfb = None
+        frames = nbytes = 0
+        async for text in coalescer.pieces(chat_reply_stream_async([{"role": "user", "content": "hi"}])):
+            if ttfb is None:
+                ttfb = time.perf_counter() - t0
+            frames += 1
+            nbytes += len(sse_frame("message", text, frames))
+        return coalescer.chunks_in, frames, nbytes, ttfb, time.perf_counter() - t0
+
+    results = await asyncio.gather(*(one() for _ in range(streams)))
+    avg = lambda i: sum(r[i] for r in results) / streams
+    return {"chunks": avg(0), "frames": avg(1), "bytes": avg(2), "ttfb_ms": avg(3) * 1000, "stream_s": avg(4)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 20, 50])
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--streams", type=int, default=20)
+    args = parser.parse_args()
+    os.environ["FAKE_LLM_CHUNKS"] = str(args.chunks)
+
+    print(f"{'window ms':>9} {'chunks':>7} {'frames':>7} {'bytes':>7} {'ttfb ms':>8} {'stream s':>9}")
+    for w in args.windows:
+        r = asyncio.run(run(w, args.streams))
+        print(f"{w:>9.0f} {r['chunks']:>7.0f} {r['frames']:>7.1f} {r['bytes']:>7.0f} {r['ttfb_ms']:>8.1f} {r['stream_s']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Worker boot: import time per module and time-to-ready per startup mode.
+
+1) imports: `python -X importtime -c "import app.main"`, top modules by cumulative time,
+   plus the cost of what is now deferred (google.generativeai, ReportLab + font)
+2) time-to-ready: fresh interpreter per run, wall time from spawn until the lifespan
+   startup finished and GET /api/health answered (ASGI in-process, no socket), then the
+   first real request (GET /api/sessions) right after ready
+
+   legacy      DB_AUTO_MIGRATE=1 STARTUP_WARMUP=blocking   (old on_startup behaviour)
+   migrate     DB_AUTO_MIGRATE=1 STARTUP_WARMUP=background
+   default     DB_AUTO_MIGRATE=0 STARTUP_WARMUP=background
+   cold        DB_AUTO_MIGRATE=0 STARTUP_WARMUP=off
+
+Uses the real Gemini SDK with a dummy key when it is installed (models are built, nothing
+is sent); falls back to GEMINI_FAKE=1 otherwise.
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-startup-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+if importlib.util.find_spec("google.generativeai") is not None:
+    os.environ.setdefault("GEMINI_FAKE", "0")
+    os.environ.setdefault("GEMINI_API_KEY", "bench-dummy-key")
+else:
+    os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("PDF_EXPORT_WORKERS", "0")
+
+MODES = {
+    "legacy": {"DB_AUTO_MIGRATE": "1", "STARTUP_WARMUP": "blocking"},
+    "migrate": {"DB_AUTO_MIGRATE": "1", "STARTUP_WARMUP": "background"},
+    "default": {"DB_AUTO_MIGRATE": "0", "STARTUP_WARMUP": "background"},
+    "cold": {"DB_AUTO_MIGRATE": "0", "STARTUP_WARMUP": "off"},
+}
+
+
+def child():
+    # รันใน interpreter ใหม่: import -> startup -> health -> request แรก
+    t_import = time.perf_counter()
+    import httpx
+
+    from app.main import app
+
+    t_started = time.perf_counter()
+
+    async def main():
+        async with app.router.lifespan_context(app):
+            t_lifespan = time.perf_counter()
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+                assert (await c.get("/api/health")).status_code == 200
+                t_ready = time.perf_counter()
+                assert (await c.get("/api/sessions")).status_code == 200
+                t_first = time.perf_counter()
+        return t_lifespan, t_ready, t_first
+
+    t_lifespan, t_ready, t_first = asyncio.run(main())
+    print(json.dumps({
+        "import": t_started - t_import,
+        "startup": t_lifespan - t_started,
+        "ready_at": time.time() - (t_first - t_ready),
+        "first": t_first - t_ready,
+    }))
+
+
+def spawn(env: dict) -> dict:
+    t0 = time.time()
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"],
+        cwd=ROOT, env={**os.environ, **env}, capture_output=True, text=True, check=True,
+    ).stdout
+    r = json.loads(out.strip().splitlines()[-1])
+    r["ready"] = r.pop("ready_at") - t0
+    return r
+
+
+def imports(top: int):
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, env=os.environ.copy(), capture_output=True, text=True, check=True,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cum_us, name = line.split(":", 1)[1].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cum_us), depth))
+
+    total = next(cum for name, _, cum, _ in rows if name == "app.main")
+    print(f"import app.main: {total / 1000:.0f} ms")
+    print(f"\n{'module':<34} {'cumulative ms':>14}")
+    # module ของ app + package ระดับบนสุดที่ app.main ดึงเข้ามา
+    picked = [r for r in rows if r[0].startswith("app.") or (r[3] <= 1 and "." not in r[0])]
+    for name, _, cum, _ in sorted(picked, key=lambda r: -r[2])[:top]:
+        print(f"{name:<34} {cum / 1000:>14.1f}")
+
+    print(f"\n{'deferred (first use / warm-up)':<34} {'ms':>14}")
+    snippets = {
+        "google.generativeai": "import google.generativeai",
+        "reportlab + STSong-Light font": "from app.pdf_utils import register_fonts; register_fonts()",
+    }
+    for label, code in snippets.items():
+        t0 = time.perf_counter()
+        r = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=os.environ.copy(), capture_output=True)
+        base = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], cwd=ROOT, capture_output=True)
+        interp = time.perf_counter() - base
+        cost = (base - t0 - interp) * 1000 if r.returncode == 0 else float("nan")
+        print(f"{label:<34} {cost:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--child", action="store_true")
+    args = parser.parse_args()
+    if args.child:
+        child()
+        return
+
+    # migration step ครั้งเดียว (เหมือน deploy จริง) ก่อนวัด worker boot
+    from app.init_db import init_db
+
+    init_db()
+    print(f"db: {os.environ['DATABASE_URL'].split(':')[0]}, gemini fake: {os.environ['GEMINI_FAKE']}\n")
+    imports(args.top)
+
+    print(f"\n{'mode':<9} {'import ms':>10} {'startup ms':>11} {'ready ms':>9} {'first req ms':>13}   (median of {args.runs})")
+    for mode, env in MODES.items():
+        runs = [spawn(env) for _ in range(args.runs)]
+
+        def med(key):
+            return statistics.median(r[key] for r in runs) * 1000
+
+        print(f"{mode:<9} {med('import'):>10.0f} {med('startup'):>11.1f} {med('ready'):>9.0f} {med('first'):>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
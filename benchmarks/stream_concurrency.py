@@ -0,0 +1,113 @@
+"""Concurrent SSE stream benchmark (async pipeline vs threadpool-bound sync baseline).
+
+Runs the app in-process against SQLite and the fake Gemini model, opens N
+streams at once and reports the effective number of streams served in
+parallel (N * single-stream generation time / wall time). The sync baseline
+tops out around the threadpool size (40); the async path should not.
+
+    python -m benchmarks.stream_concurrency --streams 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-stream-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "500")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "40")
+os.environ.setdefault("FAKE_LLM_CHUNKS", "50")
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+import httpx  # noqa: E402
+from fastapi.responses import StreamingResponse  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.sse import sse_data  # noqa: E402
+from app.init_db import init_db  # noqa: E402
+from app.fake_llm import FakeGenerativeModel  # noqa: E402
+from app.gemini_client import chat_reply_stream_async  # noqa: E402
+
+
+# baseline: sync generator แบบเดิม (Starlette วนใน threadpool ทีละ thread)
+# model call เป็น chat_reply_stream_async ตัวเดียวกับที่ใช้จริง (router / metrics) แต่วนใน loop
+# ของ thread เอง -> 1 stream ถือ 1 thread ตลอดเหมือน sync path เดิม
+@app.post("/bench/sync-stream")
+def _sync_stream():
+    def gen():
+        loop = asyncio.new_event_loop()
+        stream = chat_reply_stream_async([{"role": "user", "content": "hi"}])
+        try:
+            while True:
+                try:
+                    chunk = loop.run_until_complete(stream.__anext__())
+                except StopAsyncIteration:
+                    break
+                yield sse_data(chunk)
+        finally:
+            loop.run_until_complete(stream.aclose())
+            loop.close()
+        yield "event: done\ndata: ok\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+async def run(mode: str, streams: int) -> dict:
+    FakeGenerativeModel.reset_stats()
+    transport = httpx.ASGITransport(app=app)
+    # lifespan: write-behind writer / task queue ทำงานเหมือนตอนรันจริง
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=None
+    ) as client:
+        if mode == "async":
+            ids = []
+            for _ in range(streams):
+                r = await client.post("/api/sessions", json={"title": "Bench"})
+                ids.append(r.json()["session_id"])
+            calls = [client.post(f"/api/sessions/{sid}/chat/stream", json={"message": "hello"}) for sid in ids]
+        else:
+            calls = [client.post("/bench/sync-stream") for _ in range(streams)]
+
+        t0 = time.perf_counter()
+        responses = await asyncio.gather(*calls)
+        wall = time.perf_counter() - t0
+
+    ok = sum(1 for r in responses if "event: done" in r.text)
+    fake = FakeGenerativeModel()
+    single = fake.ttft + fake.chunk_delay * fake.chunks
+    return {
+        "mode": mode,
+        "streams": streams,
+        "completed": ok,
+        "peak_in_flight": FakeGenerativeModel.peak_in_flight,
+        "effective_concurrency": round(streams * single / wall, 1),
+        "wall_s": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--mode", choices=["async", "sync", "both"], default="both")
+    args = parser.parse_args()
+
+    init_db()
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        res = asyncio.run(run(mode, args.streams))
+        print(
+            f"{res['mode']:>5}: streams={res['streams']} completed={res['completed']} "
+            f"effective_concurrency={res['effective_concurrency']} "
+            f"peak_in_flight={res['peak_in_flight']} wall={res['wall_s']}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Message persistence throughput: one commit per message vs the write-behind batcher.
+
+N sessions write M messages each concurrently (user / assistant alternating, each
+session waits for its previous write like a chat turn would).
+
+- direct:       AsyncSessionLocal + add_message_async + commit per message (old path)
+- write-behind: message_writer.persist(wait=True), batched across sessions
+
+Runs against SQLite by default; point DATABASE_URL at a local Postgres to compare there.
+
+    python -m benchmarks.write_behind --sessions 50 --messages 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp = tempfile.mkdtemp(prefix="bench-writes-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/bench.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+
+ANSWER = "Recursion is when a function calls itself on a smaller input until it reaches a base case. " * 6
+
+
+async def seed(n: int) -> list[int]:
+    from app.db import AsyncSessionLocal
+    from app.models import ChatSession
+
+    async with AsyncSessionLocal() as db:
+        sessions = [ChatSession(title="bench") for _ in range(n)]
+        db.add_all(sessions)
+        await db.commit()
+        return [s.id for s in sessions]
+
+
+async def direct(session_id: int, i: int):
+    from app.db import AsyncSessionLocal
+    from app.messages import add_message_async
+
+    async with AsyncSessionLocal() as db:
+        await add_message_async(db, session_id, "user" if i % 2 == 0 else "assistant", ANSWER)
+        await db.commit()
+
+
+async def behind(session_id: int, i: int):
+    from app.write_behind import message_writer
+
+    await message_writer.persist(session_id, "user" if i % 2 == 0 else "assistant", ANSWER, wait=True)
+
+
+async def run(mode: str, sessions: int, messages: int) -> dict:
+    from app.write_behind import MessageWriter
+    import app.write_behind as wb
+
+    writer = wb.message_writer = MessageWriter(enabled=mode == "write-behind")
+    writer.start()
+    ids = await seed(sessions)
+    write = behind if mode == "write-behind" else direct
+    latencies = []
+    errors = 0
+
+    async def session(sid: int):
+        nonlocal errors
+        for i in range(messages):
+            t0 = time.perf_counter()
+            try:
+                await write(sid, i)
+            except Exception:
+                # sqlite: "database is locked" เมื่อ commit แย่งกันมากเกิน busy timeout
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[session(sid) for sid in ids])
+    wall = time.perf_counter() - t0
+    await writer.stop()
+
+    latencies.sort()
+    written = sessions * messages - errors
+    return {
+        "wall": wall,
+        "rate": written / wall,
+        "errors": errors,
+        "commits": writer.batches if mode == "write-behind" else written,
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args()
+
+    from app.init_db import init_db
+    from app.db import engine
+
+    init_db()
+    print(f"db: {engine.dialect.name}, {args.sessions} sessions x {args.messages} messages")
+    print(f"{'mode':>13} {'wall s':>7} {'msg/s':>8} {'commits':>8} {'errors':>7} {'p50 ms':>7} {'p95 ms':>7}")
+    for mode in ("direct", "write-behind"):
+        r = await run(mode, args.sessions, args.messages)
+        print(f"{mode:>13} {r['wall']:>7.2f} {r['rate']:>8.0f} {r['commits']:>8} {r['errors']:>7} "
+              f"{r['p50'] * 1000:>7.1f} {r['p95'] * 1000:>7.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.db สร้าง engine ตอน import -> ตั้ง env ก่อน import app ทุกตัว
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_tmp = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("GEMINI_FAKE", "1")
+os.environ.setdefault("FAKE_LLM_TTFT_MS", "1")
+os.environ.setdefault("FAKE_LLM_CHUNK_DELAY_MS", "0")
+os.environ.setdefault("FAKE_LLM_CHUNKS", "5")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _schema():
+    from app.init_db import init_db
+
+    init_db()
+
+
+@pytest.fixture
+def new_session():
+    # สร้าง ChatSession ว่าง ๆ -> id
+    from app.db import SessionLocal
+    from app.models import ChatSession
+
+    def make(title: str = "test", **values) -> int:
+        with SessionLocal() as db:
+            s = ChatSession(title=title, **values)
+            db.add(s)
+            db.commit()
+            return s.id
+
+    return make
+
+
+@pytest.fixture
+async def client():
+    # app ทั้งตัวรวม lifespan (write-behind writer / task queue เริ่มเหมือนตอนรันจริง)
+    import httpx
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as c:
+            yield c
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app.archive import ARCHIVE_ENABLED, Archiver, _RAW_CREATED_AT
+from app.db import SessionLocal
+from app.messages import add_message
+from app.models import ChatArchive, ChatMessage, ChatSession
+
+
+@pytest.fixture
+def idle_session(new_session):
+    # session ที่มี message แล้ว idle เกิน cutoff
+    def make(*contents: str) -> int:
+        sid = new_session()
+        with SessionLocal() as db:
+            for i, c in enumerate(contents):
+                add_message(db, sid, "user" if i % 2 == 0 else "assistant", c)
+            db.execute(update(ChatSession).where(ChatSession.id == sid).values(
+                last_message_at=datetime.now(timezone.utc) - timedelta(days=60)
+            ))
+            db.commit()
+        return sid
+
+    return make
+
+
+def snapshot(session_id: int) -> list[tuple]:
+    with SessionLocal() as db:
+        return [tuple(r) for r in db.execute(
+            select(ChatMessage.id, ChatMessage.role, ChatMessage.content, _RAW_CREATED_AT, ChatMessage.created_at)
+            .where(ChatMessage.session_id == session_id)
+            .order_by(ChatMessage.created_at.asc(), ChatMessage.id.asc())
+        )]
+
+
+def cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=30)
+
+
+def test_archiver_is_opt_in():
+    assert ARCHIVE_ENABLED is False
+    assert Archiver().enabled is False
+
+
+def test_archive_then_rehydrate_round_trips_ids_timestamps_and_content(idle_session):
+    sid = idle_session("what is a closure?", "a function plus its environment ✨", "ภาษาไทยด้วย", "x" * 5000)
+    before = snapshot(sid)
+    archiver = Archiver()
+
+    assert archiver.archive_session(sid, cutoff())
+    assert snapshot(sid) == []
+    with SessionLocal() as db:
+        blob = db.get(ChatArchive, sid)
+        assert blob.message_count == 4 and blob.stored_bytes < blob.raw_bytes
+        assert db.get(ChatSession, sid).archived_at is not None
+
+    assert archiver.rehydrate(sid)
+    assert snapshot(sid) == before
+    with SessionLocal() as db:
+        assert db.get(ChatArchive, sid) is None
+        assert db.get(ChatSession, sid).archived_at is None
+    # ย้ายกลับแล้ว -> ครั้งถัดไปไม่มีอะไรทำ
+    assert not archiver.rehydrate(sid)
+
+
+def test_new_message_after_rehydrate_sorts_after_restored_ones(idle_session):
+    sid = idle_session("q1", "a1")
+    archiver = Archiver()
+    archiver.archive_session(sid, cutoff())
+    archiver.rehydrate(sid)
+    with SessionLocal() as db:
+        add_message(db, sid, "user", "q2")
+        db.commit()
+    assert [r[2] for r in snapshot(sid)] == ["q1", "a1", "q2"]
+
+
+def test_active_session_is_not_claimed(idle_session):
+    sid = idle_session("recent")
+    assert not Archiver().archive_session(sid, datetime.now(timezone.utc) - timedelta(days=90))
+    assert len(snapshot(sid)) == 1
+
+
+@pytest.mark.anyio
+async def test_opening_an_archived_session_restores_it(client, idle_session):
+    sid = idle_session("q", "a")
+    before = snapshot(sid)
+    Archiver().archive_session(sid, cutoff())
+
+    messages = (await client.get(f"/api/sessions/{sid}/messages")).json()["messages"]
+    assert [(m["id"], m["content"]) for m in messages] == [(r[0], r[2]) for r in before]
+
+
+@pytest.mark.anyio
+async def test_search_reports_archived_sessions_and_rehydrates_a_scoped_search(client, idle_session):
+    sid = idle_session("archived needle zebra", "answer")
+    Archiver().archive_session(sid, cutoff())
+
+    page = (await client.get("/api/search", params={"q": "needle zebra"})).json()
+    assert page["results"] == []
+    assert page["archived_sessions_excluded"] >= 1
+
+    page = (await client.get("/api/search", params={"q": "needle zebra", "session_id": sid})).json()
+    assert [r["session_id"] for r in page["results"]] == [sid]
+    assert page["archived_sessions_excluded"] == 0
@@ -0,0 +1,181 @@
+from types import SimpleNamespace
+
+from app.context_cache import ContextCache
+from app.context_window import (
+    MAX_MESSAGES,
+    ROLE_OVERHEAD,
+    TRUNCATED_MARK,
+    build_context,
+    context_tokens,
+    count_tokens,
+)
+from app.summaries import context_boundary
+
+
+def msgs(*contents):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": c} for i, c in enumerate(contents)]
+
+
+# --- ContextCache ---
+
+def test_fill_then_append_is_write_through():
+    cache = ContextCache(max_sessions=4, window=3)
+    cache.fill(1, msgs("a", "b"), cache.token(1))
+    cache.append(1, "user", "c")
+    cache.append(1, "assistant", "d")
+    # ring buffer ขนาด window
+    assert [m["content"] for m in cache.get(1)] == ["b", "c", "d"]
+
+
+def test_fill_with_stale_token_is_dropped():
+    # write ระหว่างโหลดจาก DB -> ผลโหลดเก่าต้องไม่ทับ
+    cache = ContextCache()
+    token = cache.token(1)
+    cache.append(1, "user", "written while loading")
+    cache.fill(1, msgs("old"), token)
+    assert cache.get(1) is None
+
+    token = cache.token(1)
+    cache.invalidate(1)
+    cache.fill(1, msgs("old"), token)
+    assert cache.get(1) is None
+
+
+def test_invalidate_drops_only_that_session():
+    cache = ContextCache()
+    cache.fill(1, msgs("a"), cache.token(1))
+    cache.fill(2, msgs("b"), cache.token(2))
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.get(2) == msgs("b")
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_append_to_uncached_session_does_not_create_entry():
+    cache = ContextCache()
+    cache.append(1, "user", "a")
+    assert cache.get(1) is None
+
+
+def test_lru_eviction_keeps_recently_used():
+    cache = ContextCache(max_sessions=2)
+    cache.fill(1, msgs("a"), cache.token(1))
+    cache.fill(2, msgs("b"), cache.token(2))
+    cache.get(1)
+    cache.fill(3, msgs("c"), cache.token(3))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_generation_map_reset_invalidates_old_tokens():
+    # _gen ล้างเมื่อโตเกิน -> epoch ใหม่ token เก่าทุกตัวใช้ไม่ได้
+    cache = ContextCache(max_sessions=1)
+    token = cache.token(99)
+    for sid in range(10):
+        cache.invalidate(sid)
+    cache.fill(99, msgs("stale"), token)
+    assert cache.get(99) is None
+
+
+def test_disabled_cache_never_fills():
+    cache = ContextCache(max_sessions=0)
+    cache.fill(1, msgs("a"), cache.token(1))
+    assert cache.get(1) is None
+
+
+def test_session_events_invalidate_the_shared_cache(new_session):
+    # hooks ใน app/messages.py: add_message -> append หลัง commit, ลบ message -> invalidate
+    from app.context_cache import context_cache
+    from app.db import SessionLocal
+    from app.messages import add_message, recent_context
+    from app.models import ChatMessage
+
+    sid = new_session()
+    with SessionLocal() as db:
+        add_message(db, sid, "user", "q1")
+        db.commit()
+        assert [m["content"] for m in recent_context(db, sid)] == ["q1"]
+
+        add_message(db, sid, "assistant", "a1")
+        assert [m["content"] for m in context_cache.get(sid)] == ["q1"]  # ยังไม่ commit
+        db.commit()
+        assert [m["content"] for m in context_cache.get(sid)] == ["q1", "a1"]
+
+        db.delete(db.query(ChatMessage).filter_by(session_id=sid, role="assistant").one())
+        db.commit()
+        assert context_cache.get(sid) is None
+        assert [m["content"] for m in recent_context(db, sid)] == ["q1"]
+
+        add_message(db, sid, "assistant", "rolled back")
+        db.rollback()
+        assert [m["content"] for m in context_cache.get(sid)] == ["q1"]
+
+
+# --- build_context ---
+
+def test_everything_fits_is_unchanged():
+    history = msgs("a", "b", "c")
+    assert build_context(history, budget=1000) == history
+
+
+def test_budget_keeps_newest_messages():
+    history = msgs(*[f"message {i} " + "x" * 40 for i in range(10)])
+    per = count_tokens(history[0]["content"]) + ROLE_OVERHEAD
+    out = build_context(history, budget=per * 3, max_message_tokens=1000)
+    assert out == history[-3:]
+    assert context_tokens(out) <= per * 3
+
+
+def test_long_old_message_is_truncated_but_latest_is_sent_whole():
+    long = "y" * 4000
+    history = msgs(long, "short question", long)
+    out = build_context(history, budget=100_000, max_message_tokens=50)
+    assert out[-1]["content"] == long
+    assert out[0]["content"].endswith(TRUNCATED_MARK)
+    assert count_tokens(out[0]["content"]) <= 50
+
+
+def test_latest_message_over_budget_is_truncated_to_budget():
+    out = build_context(msgs("z" * 4000), budget=100)
+    assert len(out) == 1
+    assert out[0]["content"].endswith(TRUNCATED_MARK)
+    assert context_tokens(out) <= 100
+
+
+def test_partial_message_at_the_boundary():
+    # ที่เหลือพอ (>= MIN_PARTIAL_TOKENS) -> ใส่ข้อความถัดไปแบบตัด, ไม่พอ -> หยุด
+    history = msgs("o" * 2000, "n" * 40)
+    newest = count_tokens("n" * 40) + ROLE_OVERHEAD
+
+    out = build_context(history, budget=newest + 200, max_message_tokens=1000)
+    assert len(out) == 2 and out[0]["content"].endswith(TRUNCATED_MARK)
+    assert context_tokens(out) <= newest + 200
+
+    out = build_context(history, budget=newest + 20, max_message_tokens=1000)
+    assert out == history[-1:]
+
+
+# --- summary boundary ---
+
+def rows(*contents):
+    return [SimpleNamespace(id=i, **m) for i, m in enumerate(msgs(*contents))]
+
+
+def test_boundary_is_oldest_message_sent_whole():
+    # ข้อความที่ยังอยู่ใน MAX_MESSAGES แต่โดน token budget ตัด (หลุดทั้งข้อ / ส่งแค่บางส่วน) ต้องถูกสรุป
+    window = rows(*["x" * 2800 for _ in range(10)])
+    kept = build_context([{"role": r.role, "content": r.content} for r in window])
+    whole = [m for m in kept if not m["content"].endswith(TRUNCATED_MARK)]
+    assert len(whole) < len(kept) < len(window)
+
+    assert context_boundary(window) is window[-len(whole)]
+
+
+def test_no_boundary_when_everything_fits():
+    assert context_boundary(rows("a", "b", "c")) is None
+
+
+def test_boundary_at_max_messages_without_budget_cut():
+    window = rows(*["m"] * MAX_MESSAGES)
+    assert context_boundary(window) is window[0]
@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+
+from app.generations import Generation, GenerationRegistry, parse_last_event_id
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunks(*parts, fail: Exception | None = None, gate: asyncio.Event | None = None):
+    for p in parts:
+        yield p
+    if gate is not None:
+        await gate.wait()
+    if fail is not None:
+        raise fail
+
+
+async def collect(gen: Generation, after: int = 0):
+    return [e async for e in gen.subscribe(after)]
+
+
+def finished(*parts, buffer_events: int = 16) -> Generation:
+    gen = Generation(1, buffer_events=buffer_events)
+    for p in parts:
+        gen.publish("message", p)
+    gen.publish("done", "ok")
+    gen._finish()
+    return gen
+
+
+async def test_resume_from_the_middle_of_the_buffer():
+    gen = finished("a", "b", "c", "d")
+    assert await collect(gen, after=2) == [(3, "message", "c"), (4, "message", "d"), (5, "done", "ok")]
+    assert gen.text(upto=2) == "ab"
+
+
+async def test_subscribe_after_completion_replays_everything():
+    gen = Generation(1)
+    completed = []
+
+    async def on_complete(answer):
+        completed.append(answer)
+
+    await gen.run(chunks("hello ", "world"), on_complete)
+    events = await collect(gen)
+    assert "".join(d for _, e, d in events if e == "message") == "hello world"
+    assert events[-1][1:] == ("done", "ok")
+    assert completed == ["hello world"]
+    # ต่อหลังจบด้วย seq สุดท้าย -> ไม่มีอะไรค้าง
+    assert await collect(gen, after=gen.seq) == []
+
+
+async def test_overrun_subscriber_gets_a_snapshot_then_the_buffer():
+    gen = finished("a", "b", "c", "d", "e", buffer_events=3)
+    events = await collect(gen)
+    # buffer เหลือ seq 4..6 (d, e, done) -> snapshot ของ seq 1..3 ก่อน
+    assert events == [(3, "snapshot", "abc"), (4, "message", "d"), (5, "message", "e"), (6, "done", "ok")]
+
+
+async def test_live_subscriber_follows_new_events():
+    gen = Generation(1)
+    got = asyncio.create_task(collect(gen))
+    await asyncio.sleep(0)
+    gen.publish("message", "x")
+    await asyncio.sleep(0)
+    gen.publish("message", "y")
+    gen.publish("done", "ok")
+    gen._finish()
+    assert await asyncio.wait_for(got, 1) == [(1, "message", "x"), (2, "message", "y"), (3, "done", "ok")]
+
+
+async def test_on_error_runs_with_partial_text_when_producer_raises():
+    gen = Generation(1)
+    completed, failed = [], []
+
+    async def on_complete(answer):
+        completed.append(answer)
+
+    async def on_error(partial):
+        failed.append(partial)
+
+    await gen.run(chunks("par", "tial", fail=RuntimeError("model down")), on_complete, on_error)
+    assert completed == []
+    assert failed == ["partial"]
+    assert gen.done
+    assert gen.events[-1][1:] == ("error", "model down")
+
+
+async def test_on_error_runs_when_generation_is_cancelled():
+    registry = GenerationRegistry()
+    gate = asyncio.Event()
+    failed = []
+
+    async def on_complete(answer):
+        raise AssertionError("must not complete")
+
+    async def on_error(partial):
+        failed.append(partial)
+
+    gen = registry.start(7, chunks("a", gate=gate), on_complete, on_error)
+    await asyncio.sleep(0.05)
+    registry.forget_session(7)
+    await gen.wait()
+    assert failed == ["a"]
+    assert registry.running(7) is None
+
+
+async def test_on_error_is_not_called_after_a_full_answer():
+    gen = Generation(1)
+    failed = []
+
+    async def on_complete(answer):
+        pass
+
+    async def on_error(partial):
+        failed.append(partial)
+
+    await gen.run(chunks("ok"), on_complete, on_error)
+    assert failed == []
+
+
+async def test_drain_waits_for_running_generations_to_persist():
+    registry = GenerationRegistry()
+    gate = asyncio.Event()
+    persisted = []
+
+    async def on_complete(answer):
+        persisted.append(answer)
+
+    registry.start(1, chunks("a", "b", gate=gate), on_complete)
+    registry.start(2, chunks("c"), on_complete)
+    assert registry.stats()["started"] == 2
+
+    # ยังไม่ปล่อย gate -> drain หมดเวลา generation 1 ยังรันอยู่
+    await registry.drain(timeout=0.05)
+    assert registry.running(1) is not None
+
+    gate.set()
+    await registry.drain(timeout=1)
+    assert sorted(persisted) == ["ab", "c"]
+    assert registry.stats()["running"] == 0
+
+
+async def test_claim_attaches_to_matching_generation_and_waits_for_others():
+    registry = GenerationRegistry()
+    gate = asyncio.Event()
+
+    async def on_complete(answer):
+        pass
+
+    gen = registry.start(1, chunks("a", gate=gate), on_complete, key=(1, 10, "beginner"))
+    assert await registry.claim(1, lambda g: g.key == (1, 10, "beginner")) is gen
+
+    waiter = asyncio.create_task(registry.claim(1, lambda g: False))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    gate.set()
+    assert await asyncio.wait_for(waiter, 1) is None
+    assert registry.stats()["attached"] == 1 and registry.stats()["waits"] == 1
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("12") == 12
+    assert parse_last_event_id(" 3 ") == 3
+    assert parse_last_event_id("-5") == 0
+    assert parse_last_event_id("abc") == 0
+    assert parse_last_event_id(None) == 0
@@ -0,0 +1,121 @@
+import pytest
+from sqlalchemy import delete, insert
+
+from app.db import SessionLocal
+from app.messages import _touch_session, add_message, bump_version
+from app.models import ChatMessage
+
+pytestmark = pytest.mark.anyio
+
+
+def write(session_id: int, *contents: str) -> list[int]:
+    with SessionLocal() as db:
+        msgs = [add_message(db, session_id, "user", c) for c in contents]
+        db.commit()
+        return [m.id for m in msgs]
+
+
+async def messages(client, session_id: int, **params):
+    return await client.get(f"/api/sessions/{session_id}/messages", params=params)
+
+
+def contents(r) -> list[str]:
+    return [m["content"] for m in r.json()["messages"]]
+
+
+async def test_etag_revalidates_with_304_until_the_session_changes(client, new_session):
+    sid = new_session()
+    write(sid, "q1")
+    first = await messages(client, sid)
+    etag = first.headers["etag"]
+
+    again = await client.get(f"/api/sessions/{sid}/messages", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+
+    write(sid, "q2")
+    changed = await client.get(f"/api/sessions/{sid}/messages", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert contents(changed) == ["q1", "q2"]
+
+
+async def test_session_list_etag(client, new_session):
+    new_session()
+    first = await client.get("/api/sessions")
+    etag = first.headers["etag"]
+    assert (await client.get("/api/sessions", headers={"If-None-Match": etag})).status_code == 304
+    new_session()
+    assert (await client.get("/api/sessions", headers={"If-None-Match": etag})).status_code == 200
+
+
+async def test_delta_returns_only_newer_messages(client, new_session):
+    sid = new_session()
+    write(sid, "q1", "q2")
+    token = (await messages(client, sid)).json()["sync_token"]
+
+    # ไม่มีอะไรใหม่ -> delta ว่าง, token เดิม
+    r = await messages(client, sid, since=token)
+    assert r.json()["delta"] is True and contents(r) == []
+    assert r.json()["sync_token"] == token
+
+    write(sid, "q3", "q4")
+    r = await messages(client, sid, since=token)
+    assert r.json()["delta"] is True
+    assert contents(r) == ["q3", "q4"]
+
+    write(sid, "q5")
+    r = await messages(client, sid, since=r.json()["sync_token"])
+    assert r.json()["delta"] is True and contents(r) == ["q5"]
+
+
+async def test_late_commit_of_a_lower_id_falls_back_to_a_full_page(client, new_session):
+    # จำลอง transaction ที่ได้ id ก่อนแต่ commit หลัง: id ตรงกลางยังไม่มีตอนออก token
+    sid = new_session()
+    q1, late, q3 = write(sid, "q1", "late", "q3")
+    with SessionLocal() as db:
+        db.execute(delete(ChatMessage).where(ChatMessage.id == late))
+        db.commit()
+    r = await messages(client, sid)
+    assert contents(r) == ["q1", "q3"]
+    token = r.json()["sync_token"]
+
+    with SessionLocal() as db:
+        db.execute(insert(ChatMessage).values(id=late, session_id=sid, role="user", content="late"))
+        db.execute(_touch_session(sid, "late"))
+        db.commit()
+
+    r = await messages(client, sid, since=token)
+    assert r.json()["delta"] is False
+    assert sorted(contents(r)) == ["late", "q1", "q3"]
+    # token ใหม่ใช้ delta ต่อได้
+    write(sid, "q4")
+    r = await messages(client, sid, since=r.json()["sync_token"])
+    assert r.json()["delta"] is True and contents(r) == ["q4"]
+
+
+async def test_rewrite_after_token_falls_back_to_a_full_page(client, new_session):
+    sid = new_session()
+    _, answer = write(sid, "q1", "old answer")
+    token = (await messages(client, sid)).json()["sync_token"]
+
+    with SessionLocal() as db:
+        db.execute(delete(ChatMessage).where(ChatMessage.id == answer))
+        db.execute(bump_version(sid, rewrite=True))
+        add_message(db, sid, "assistant", "new answer")
+        db.commit()
+
+    r = await messages(client, sid, since=token)
+    assert r.json()["delta"] is False
+    assert contents(r) == ["q1", "new answer"]
+
+
+async def test_legacy_and_invalid_tokens(client, new_session):
+    sid = new_session()
+    write(sid, "q1")
+    # token แบบเก่า (version.last_id) -> โหลดเต็มหน้า
+    r = await messages(client, sid, since="1.1")
+    assert r.status_code == 200 and r.json()["delta"] is False
+    assert contents(r) == ["q1"]
+    assert (await messages(client, sid, since="garbage")).status_code == 400
+    assert (await messages(client, sid, since="1.2.3.4")).status_code == 400
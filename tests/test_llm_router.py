@@ -0,0 +1,155 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import llm_router as router_module
+from app.llm_router import LLMRouter
+
+pytestmark = pytest.mark.anyio
+
+
+class Unavailable(Exception):
+    code = 503
+
+
+class Stub:
+    # model ปลอมที่กำหนดพฤติกรรมได้: ช้าก่อน token แรก / fail ก่อน token แรก / fail กลาง stream
+    def __init__(self, chunks=("hello", " world"), delay: float = 0.0, fail: Exception | None = None, fail_after: int | None = None):
+        self.chunks = chunks
+        self.delay = delay
+        self.fail = fail
+        self.fail_after = fail_after
+        self.cancelled = False
+
+    async def generate_content_async(self, prompt, stream=False):
+        if not stream:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise self.fail
+            return SimpleNamespace(text="".join(self.chunks))
+        return self._iter()
+
+    async def _iter(self):
+        try:
+            await asyncio.sleep(self.delay)
+            for i, c in enumerate(self.chunks):
+                if self.fail is not None and (self.fail_after or 0) == i:
+                    raise self.fail
+                yield SimpleNamespace(text=c)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def models(**plan):
+    # get_model(name) คืน stub ตัวถัดไปของ name นั้น; calls เก็บลำดับชื่อที่ถูกเรียก
+    calls = []
+
+    def get_model(name):
+        calls.append(name)
+        return plan[name].pop(0)
+
+    return get_model, calls
+
+
+def router(**kw) -> LLMRouter:
+    values = {"fallback": "", "hedge_after_ms": 0, "retries": 0, "backoff_ms": 0, "ttft_timeout_ms": 2000, **kw}
+    return LLMRouter(**values)
+
+
+async def text_of(r: LLMRouter, get_model, name="primary") -> str:
+    return "".join([t async for t in r.stream(get_model, name, "prompt")])
+
+
+def test_fallback_is_off_by_default():
+    assert router_module.LLM_FALLBACK_MODEL == ""
+    assert LLMRouter(retries=1)._plan("m") == ["m", "m"]
+    assert LLMRouter(fallback="f", retries=1)._plan("m") == ["m", "m", "f"]
+    assert LLMRouter().stats()["fallback_model"] is None
+
+
+async def test_hedge_wins_when_first_request_is_slow():
+    slow, fast = Stub(("slow",), delay=5), Stub(("fast",))
+    get_model, calls = models(primary=[slow, fast])
+    r = router(hedge_after_ms=20, hedge_max_ratio=1)
+
+    it, first, winner = await r._first_token(get_model, "primary", "prompt", "primary", "stream")
+    assert (first, winner) == ("fast", "hedge")
+    await it.aclose()
+    await asyncio.sleep(0)
+    assert slow.cancelled
+    assert calls == ["primary", "primary"]
+    assert r.counts == {"hedge": 1, "hedge_won": 1}
+
+
+async def test_no_hedge_when_first_token_is_fast():
+    get_model, calls = models(primary=[Stub()])
+    r = router(hedge_after_ms=50, hedge_max_ratio=1)
+    assert await text_of(r, get_model) == "hello world"
+    assert calls == ["primary"] and r.hedges == 0
+    assert r.stats()["ttft"]["primary"]["count"] == 1
+
+
+async def test_hedge_budget_limits_extra_requests():
+    r = router(hedge_after_ms=10, hedge_max_ratio=0.0)
+    get_model, calls = models(primary=[Stub(delay=0.05), Stub(delay=0.05), Stub(delay=0.05), Stub(delay=0.05)])
+    await text_of(r, get_model)
+    await text_of(r, get_model)
+    # ratio 0 -> hedge ได้แค่ตัวแรก (+1) ที่เหลือไม่ hedge
+    assert r.hedges == 1
+    assert calls.count("primary") == 3
+
+
+async def test_retry_before_first_token():
+    get_model, calls = models(primary=[Stub(fail=Unavailable("busy")), Stub()])
+    r = router(retries=1)
+    assert await text_of(r, get_model) == "hello world"
+    assert calls == ["primary", "primary"]
+    assert r.counts == {"error": 1, "retry": 1}
+
+
+async def test_fallback_after_retries_are_exhausted():
+    get_model, calls = models(primary=[Stub(fail=Unavailable("a")), Stub(fail=Unavailable("b"))], backup=[Stub(("from backup",))])
+    r = router(retries=1, fallback="backup")
+    assert await text_of(r, get_model) == "from backup"
+    assert calls == ["primary", "primary", "backup"]
+    assert r.counts["fallback"] == 1
+    assert r.stats()["ttft"]["fallback"]["count"] == 1
+
+
+async def test_last_error_is_raised_when_every_attempt_fails():
+    get_model, calls = models(primary=[Stub(fail=Unavailable("a")), Stub(fail=Unavailable("b"))])
+    with pytest.raises(Unavailable, match="b"):
+        await text_of(router(retries=1), get_model)
+
+
+async def test_non_retryable_error_is_not_retried():
+    get_model, calls = models(primary=[Stub(fail=ValueError("bad prompt")), Stub()])
+    with pytest.raises(ValueError):
+        await text_of(router(retries=1), get_model)
+    assert calls == ["primary"]
+
+
+async def test_no_retry_after_the_first_token():
+    # token แรกส่งถึง client แล้ว -> error กลาง stream ต้องส่งต่อ ไม่ retry
+    get_model, calls = models(primary=[Stub(("a", "b"), fail=Unavailable("cut"), fail_after=1), Stub()])
+    got = []
+    with pytest.raises(Unavailable):
+        async for t in router(retries=1).stream(get_model, "primary", "prompt"):
+            got.append(t)
+    assert got == ["a"]
+    assert calls == ["primary"]
+
+
+async def test_first_token_timeout_is_retryable():
+    get_model, calls = models(primary=[Stub(delay=5), Stub()])
+    r = router(retries=1, ttft_timeout_ms=30)
+    assert await text_of(r, get_model) == "hello world"
+    assert r.counts["timeout"] == 1 and r.counts["retry"] == 1
+
+
+async def test_generate_retries_then_falls_back():
+    get_model, calls = models(primary=[Stub(fail=Unavailable("x"))], backup=[Stub(("ok",))])
+    assert await router(fallback="backup").generate(get_model, "primary", "prompt", "title") == "ok"
+    assert calls == ["primary", "backup"]
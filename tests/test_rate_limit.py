@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import main, rate_limit
+from app.context_window import count_tokens
+from app.rate_limit import MemoryBackend, RateLimited, RateLimiter, reserve_tokens, used_tokens
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # เวลาของ MemoryBackend (time.monotonic) เลื่อนเองได้
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def limiter(**limits) -> RateLimiter:
+    values = {"session_rpm": 0, "session_tpm": 0, "global_rpm": 0, "global_tpm": 0, **limits}
+    return RateLimiter(MemoryBackend(), enabled=True, **values)
+
+
+def test_disabled_by_default():
+    assert RateLimiter(MemoryBackend()).enabled is rate_limit.RATE_LIMIT_ENABLED
+    assert rate_limit.RATE_LIMIT_ENABLED is False
+
+
+def test_bucket_refills_over_time(clock):
+    rl = limiter(session_rpm=2)
+    rl.acquire(1, 0)
+    rl.acquire(1, 0)
+    with pytest.raises(RateLimited) as e:
+        rl.acquire(1, 0)
+    assert e.value.scope == "session"
+    assert e.value.retry_after == pytest.approx(30)
+    assert e.value.retry_after_header == "30"
+
+    clock[0] += 30
+    rl.acquire(1, 0)
+    # session อื่นมี bucket ของตัวเอง
+    rl.acquire(2, 0)
+
+
+def test_over_budget_rejection_takes_nothing(clock):
+    rl = limiter(session_rpm=10, global_tpm=100)
+    rl.acquire(1, 80)
+    with pytest.raises(RateLimited) as e:
+        rl.acquire(1, 50)
+    assert e.value.scope == "global"
+    # all-or-nothing: คำขอที่โดนปฏิเสธไม่หัก request ของ session
+    levels = rl.backend.levels(rl._specs(1, 0, 0))
+    assert levels[0] == pytest.approx(9)
+    assert rl.stats()["limited_global"] == 1 and rl.stats()["allowed"] == 1
+
+
+def test_cost_above_capacity_passes_on_a_full_bucket(clock):
+    rl = limiter(global_tpm=100)
+    rl.acquire(None, 500)
+    with pytest.raises(RateLimited):
+        rl.acquire(None, 1)
+    clock[0] += 60
+    with pytest.raises(RateLimited):
+        rl.acquire(None, 1)
+    clock[0] += 4 * 60
+    rl.acquire(None, 1)
+
+
+def test_settle_refunds_unused_tokens(clock):
+    rl = limiter(session_tpm=1000)
+    reserved = rl.acquire(1, 900)
+    with pytest.raises(RateLimited):
+        rl.acquire(1, 500)
+
+    rl.settle(1, reserved, 300)
+    rl.acquire(1, 500)
+    stats = rl.stats()
+    assert stats["reserved_tokens"] == 500 and stats["used_tokens"] == 300
+
+
+def test_settle_charges_the_overrun(clock):
+    rl = limiter(session_tpm=1000)
+    reserved = rl.acquire(1, 100)
+    rl.settle(1, reserved, 1000)
+    with pytest.raises(RateLimited):
+        rl.acquire(1, 200)
+
+
+def test_settle_without_a_call_returns_the_request(clock):
+    rl = limiter(session_rpm=1)
+    reserved = rl.acquire(1, 10)
+    rl.settle(1, reserved, 0, called=False)
+    rl.acquire(1, 10)
+
+
+@pytest.mark.anyio
+async def test_async_path_shares_the_buckets(clock):
+    rl = limiter(session_rpm=1, session_tpm=100)
+    reserved = await rl.acquire_async(1, 90)
+    with pytest.raises(RateLimited):
+        rl.acquire(1, 0)
+    await rl.settle_async(1, reserved, 10, called=False)
+    rl.acquire(1, 80)
+
+
+def test_reserve_and_used_tokens():
+    assert reserve_tokens("hello world", output=100) == count_tokens("hello world") + 100
+    assert reserve_tokens("", output=7) == 7
+    context = [{"role": "user", "content": "q"}]
+    assert used_tokens(context, "sum", "answer") > count_tokens("answer") + count_tokens("sum")
+
+
+# --- 429 จาก endpoint ---
+
+@pytest.fixture
+def strict(monkeypatch):
+    rl = limiter(session_rpm=1)
+    monkeypatch.setattr(main, "rate_limiter", rl)
+    return rl
+
+
+@pytest.mark.anyio
+async def test_stream_endpoint_returns_429_with_retry_after(client, new_session, strict):
+    sid = new_session()
+    ok = await client.post(f"/api/sessions/{sid}/chat/stream", json={"message": "first"})
+    assert ok.status_code == 200
+
+    limited = await client.post(f"/api/sessions/{sid}/chat/stream", json={"message": "second"})
+    assert limited.status_code == 429
+    assert int(limited.headers["retry-after"]) >= 1
+    # คำขอที่โดน 429 ไม่บันทึก message
+    messages = (await client.get(f"/api/sessions/{sid}/messages")).json()["messages"]
+    assert [m["content"] for m in messages if m["role"] == "user"] == ["first"]
+    assert strict.stats()["limited_session"] == 1
+
+
+@pytest.mark.anyio
+async def test_sync_chat_endpoint_returns_429(client, new_session, strict):
+    sid = new_session()
+    # ข้อความไม่ซ้ำ test อื่น (response cache hit คืน request ให้ bucket)
+    assert (await client.post(f"/api/sessions/{sid}/chat", json={"message": "sync first"})).status_code == 200
+    limited = await client.post(f"/api/sessions/{sid}/chat", json={"message": "sync second"})
+    assert limited.status_code == 429
+    assert "retry-after" in limited.headers
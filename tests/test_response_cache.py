@@ -0,0 +1,37 @@
+from app.response_cache import ResponseCache
+
+
+def test_exact_hit_is_per_level():
+    cache = ResponseCache()
+    cache.put("What is recursion?", "beginner", "a function calling itself")
+    assert cache.get("what is   recursion", "beginner") == "a function calling itself"
+    assert cache.get("what is recursion", "advanced") is None
+
+
+def test_semantic_hit_goes_through_the_lsh_index():
+    cache = ResponseCache(semantic=True, threshold=0.8)
+    cache.put("explain big o notation with examples", "beginner", "big o")
+    cache.put("how does a python dict work internally", "beginner", "hash table")
+    assert cache.get("explain big o notation with an example", "beginner") == "big o"
+    assert cache.get("explain big o notation with an example", "advanced") is None
+    assert cache.stats()["semantic_hits"] == 1
+    # เทียบแค่ candidate ที่ชน bucket ไม่ใช่ทั้ง cache
+    assert cache.stats()["semantic_candidates"] <= 2
+
+
+def test_candidate_cap_limits_the_scan():
+    cache = ResponseCache(semantic=True, max_candidates=5)
+    for i in range(50):
+        cache.put(f"what is a python list number {i}", "beginner", str(i))
+    cache.get("what is a python list number", "beginner")
+    assert cache.stats()["semantic_candidates"] <= 5
+
+
+def test_evicted_entries_leave_the_index():
+    cache = ResponseCache(semantic=True, max_bytes=200)
+    for i in range(20):
+        cache.put(f"question {i} about sorting", "beginner", "x" * 20)
+    indexed = {k for keys in cache._buckets.values() for k in keys}
+    assert indexed == set(cache._entries)
+    cache.clear()
+    assert not cache._buckets
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import insert
+
+from app.db import SessionLocal
+from app.models import ChatMessage, ChatSession
+from app.search import _encode_cursor, _trigram, has_trigram, search_messages
+
+
+@pytest.fixture
+def db():
+    with SessionLocal() as db:
+        s = ChatSession(title="search test")
+        db.add(s)
+        db.flush()
+        db.execute(insert(ChatMessage), [
+            {"session_id": s.id, "role": "assistant", "content": f"step {i}: return fib(n - 1) + fib(n - 2)"}
+            for i in range(5)
+        ] + [{"session_id": s.id, "role": "user", "content": "what is a list?"}])
+        db.commit()
+        db.info["test_session"] = s.id
+        yield db
+
+
+def test_trigram_without_pg_trgm_falls_back_to_ilike_by_recency(db):
+    sid = db.info["test_session"]
+    assert not has_trigram(db)
+
+    rows = _trigram(db, "FIB(n - 1)", None, 10, sid)
+    ids = [r.id for r, _, _ in rows]
+    assert len(ids) == 5
+    assert ids == sorted(ids, reverse=True)
+    assert all(rank == 0.0 for _, _, rank in rows)
+    assert "<mark>fib(n - 1)</mark>" in rows[0][1]
+
+
+def test_trigram_cursor_pages_through_fallback(db):
+    sid = db.info["test_session"]
+    first = _trigram(db, "fib(n", None, 10, sid)
+    cursor = _encode_cursor("trigram", 0.0, first[1][0].id)
+
+    page = search_messages(db, "fib(n", cursor=cursor, limit=10, session_id=sid)
+    assert page["mode"] == "trigram"
+    assert [r["message_id"] for r in page["results"]] == [r.id for r, _, _ in first[2:]]
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app import main
+from app.generations import generations
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def gated_model(monkeypatch):
+    # model ที่ค้างหลัง chunk แรกจนกว่าจะปล่อย gate -> generation ยังรันอยู่ตอนคำขอที่สองมาถึง
+    gate = asyncio.Event()
+    calls = []
+
+    async def fake_stream(context, level="beginner", summary=""):
+        calls.append(context[-1]["content"])
+        yield "first "
+        await gate.wait()
+        yield "second"
+
+    monkeypatch.setattr(main, "chat_reply_stream_async", fake_stream)
+    return gate, calls
+
+
+async def release_when(gate: asyncio.Event, cond, timeout: float = 5):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not cond() and loop.time() < deadline:
+        await asyncio.sleep(0.01)
+    gate.set()
+
+
+def answer_of(body: str) -> str:
+    return "".join(line[6:] for line in body.splitlines() if line.startswith("data: ") and line != "data: ok")
+
+
+async def test_duplicate_stream_request_attaches_to_the_running_generation(client, new_session, gated_model):
+    gate, calls = gated_model
+    sid = new_session()
+    before = generations.stats()
+    payload = {"message": "single flight question", "level": "beginner"}
+
+    first, second, _ = await asyncio.gather(
+        client.post(f"/api/sessions/{sid}/chat/stream", json=payload),
+        client.post(f"/api/sessions/{sid}/chat/stream", json=payload),
+        release_when(gate, lambda: generations.stats()["attached"] > before["attached"]),
+    )
+    after = generations.stats()
+
+    assert first.status_code == second.status_code == 200
+    assert after["started"] - before["started"] == 1
+    assert after["attached"] - before["attached"] == 1
+    assert calls == ["single flight question"]
+    assert first.headers["x-generation-id"] == second.headers["x-generation-id"]
+    assert answer_of(first.text) == answer_of(second.text) == "first second"
+
+    messages = (await client.get(f"/api/sessions/{sid}/messages")).json()["messages"]
+    assert [m["role"] for m in messages] == ["user", "assistant"]
+
+
+async def test_different_message_waits_for_the_running_generation(client, new_session, gated_model):
+    gate, calls = gated_model
+    sid = new_session()
+    before = generations.stats()
+
+    first, second, _ = await asyncio.gather(
+        client.post(f"/api/sessions/{sid}/chat/stream", json={"message": "one"}),
+        client.post(f"/api/sessions/{sid}/chat/stream", json={"message": "two"}),
+        release_when(gate, lambda: generations.stats()["waits"] > before["waits"]),
+    )
+    after = generations.stats()
+
+    assert first.status_code == second.status_code == 200
+    assert after["started"] - before["started"] == 2
+    assert after["waits"] - before["waits"] == 1
+    assert first.headers["x-generation-id"] != second.headers["x-generation-id"]
+    # คำถามที่สองเริ่มหลังคำตอบแรกจบ -> ลำดับใน DB ไม่สลับ
+    messages = (await client.get(f"/api/sessions/{sid}/messages")).json()["messages"]
+    assert [(m["role"], m["content"]) for m in messages] == [
+        ("user", "one"), ("assistant", "first second"), ("user", "two"), ("assistant", "first second"),
+    ]
@@ -0,0 +1,184 @@
+import asyncio
+import functools
+
+import pytest
+
+from app import main
+from app.db import SessionLocal
+from app.messages import PendingMessage, pending_writes
+from app.models import ChatMessage, ChatSession
+from app.write_behind import MessageWriter, WritesPending
+
+
+@pytest.fixture
+async def writer():
+    w = MessageWriter(max_batch=2, max_delay_ms=5, enabled=True)
+    w.start()
+    yield w
+    await w.stop()
+
+
+def gate_commits(monkeypatch, writer, fail_for=()):
+    # _commit ค้างจนกว่าจะปล่อย gate; session ใน fail_for -> commit fail
+    gate, entered = asyncio.Event(), asyncio.Event()
+    original = writer._commit
+
+    async def commit(msgs):
+        entered.set()
+        await gate.wait()
+        if any(m.session_id in fail_for for m in msgs):
+            raise RuntimeError("db down")
+        await original(msgs)
+
+    monkeypatch.setattr(writer, "_commit", commit)
+    return gate, entered
+
+
+def rows_of(session_id: int) -> list[tuple]:
+    with SessionLocal() as db:
+        return [
+            (m.id, m.role, m.content)
+            for m in db.query(ChatMessage).filter_by(session_id=session_id).order_by(ChatMessage.id)
+        ]
+
+
+def versions_of(session_id: int) -> tuple:
+    with SessionLocal() as db:
+        s = db.get(ChatSession, session_id)
+        return s.version, s.history_version, s.last_preview, s.title
+
+
+@pytest.fixture
+def stuck(new_session):
+    # message ค้างใน pending_writes ที่ writer จะไม่มีวัน flush
+    sid = new_session()
+    msg = PendingMessage(sid, "user", "stuck")
+    pending_writes.add(msg)
+    yield sid
+    pending_writes.discard([msg])
+
+
+def test_barrier_raises_when_writes_are_still_pending(stuck):
+    writer = MessageWriter()
+    with pytest.raises(WritesPending) as e:
+        writer.barrier(stuck, timeout=0.01)
+    assert e.value.session_id == stuck and e.value.pending == 1
+    assert writer.stats()["barrier_timeouts"] == 1
+    # session อื่นไม่ต้องรอ
+    writer.barrier(stuck + 1, timeout=0.01)
+
+
+@pytest.mark.anyio
+async def test_sync_endpoint_returns_503_instead_of_writing_out_of_order(client, stuck, monkeypatch):
+    writer = main.message_writer
+    monkeypatch.setattr(writer, "barrier", functools.partial(MessageWriter.barrier, writer, timeout=0.05))
+
+    r = await client.delete(f"/api/sessions/{stuck}")
+    assert r.status_code == 503
+    assert r.headers["retry-after"] == "1"
+    with SessionLocal() as db:
+        assert db.get(ChatSession, stuck) is not None
+
+
+@pytest.mark.anyio
+async def test_messages_commit_in_persist_order_across_batches(writer, new_session):
+    sid = new_session()
+    msgs = [await writer.persist(sid, "user" if i % 2 == 0 else "assistant", f"m{i}") for i in range(4)]
+    last = await writer.persist(sid, "user", "m4", wait=True)
+    await asyncio.gather(*(m.future for m in msgs))
+
+    rows = rows_of(sid)
+    assert [c for _, _, c in rows] == ["m0", "m1", "m2", "m3", "m4"]
+    assert [i for i, _, _ in rows] == [m.id for m in msgs + [last]]
+    # max_batch=2 -> หลาย batch, ทุก batch bump version ของ session 1 ครั้ง
+    assert writer.stats()["batches"] >= 3
+    version, history_version, preview, _ = versions_of(sid)
+    assert version == writer.stats()["batches"]
+    assert history_version == 0
+    assert preview == "m4"
+
+
+@pytest.mark.anyio
+async def test_regenerate_replaces_the_assistant_row(writer, new_session):
+    sid = new_session()
+    await writer.persist(sid, "user", "question")
+    old = await writer.persist(sid, "assistant", "old answer", wait=True)
+    before = versions_of(sid)[0]
+
+    new = await writer.persist(sid, "assistant", "new answer", replaces=old.id, wait=True)
+    assert [(r, c) for _, r, c in rows_of(sid)] == [("user", "question"), ("assistant", "new answer")]
+    assert rows_of(sid)[-1][0] == new.id
+
+    version, history_version, preview, _ = versions_of(sid)
+    assert version == before + 1
+    # delta token ที่ออกก่อน regenerate ใช้ไม่ได้อีก
+    assert history_version == version
+    assert preview == "new answer"
+
+
+@pytest.mark.anyio
+async def test_title_is_set_in_the_same_batch(writer, new_session):
+    sid = new_session()
+    await writer.persist(sid, "user", "what is recursion", title="Recursion basics", wait=True)
+    assert versions_of(sid)[3] == "Recursion basics"
+
+
+@pytest.mark.anyio
+async def test_failed_session_fails_its_held_and_dependent_messages(writer, new_session, monkeypatch):
+    bad, good = new_session(), new_session()
+    gate, entered = gate_commits(monkeypatch, writer, fail_for={bad})
+
+    question = await writer.persist(bad, "user", "question")
+    await entered.wait()
+    # batch ของ question กำลัง commit อยู่: message ที่ตามมาค้างใน queue
+    held = await writer.persist(bad, "user", "follow up")
+    other = await writer.persist(good, "user", "unrelated")
+    gate.set()
+    await asyncio.gather(question.future, held.future, other.future)
+
+    assert isinstance(question.error, RuntimeError)
+    assert held.error is question.error
+    assert other.error is None and other.id is not None
+    # คำตอบของคำถามที่ fail ไม่ถูก enqueue เลย
+    with pytest.raises(RuntimeError):
+        await writer.persist(bad, "assistant", "answer", after=question, wait=True)
+
+    assert rows_of(bad) == []
+    assert [c for _, _, c in rows_of(good)] == ["unrelated"]
+    assert not pending_writes.snapshot(bad)
+    assert writer.stats()["failed"] == 2
+
+
+@pytest.mark.anyio
+async def test_answer_queued_after_a_failing_question_fails_too(writer, new_session, monkeypatch):
+    sid = new_session()
+    gate, entered = gate_commits(monkeypatch, writer, fail_for={sid})
+    question = await writer.persist(sid, "user", "question")
+    await entered.wait()
+    answer = await writer.persist(sid, "assistant", "answer", after=question)
+    gate.set()
+    with pytest.raises(RuntimeError):
+        await writer.persist(sid, "assistant", "late", after=question, wait=True)
+    await answer.future
+    assert answer.error is question.error
+
+
+@pytest.mark.anyio
+async def test_get_messages_overlays_pending_writes(client, new_session, monkeypatch):
+    writer = main.message_writer
+    sid = new_session()
+    gate, entered = gate_commits(monkeypatch, writer)
+
+    msg = await writer.persist(sid, "user", "not flushed yet")
+    await entered.wait()
+    r = await client.get(f"/api/sessions/{sid}/messages")
+    body = r.json()
+    assert [(m["id"], m["content"], m.get("pending")) for m in body["messages"]] == [(None, "not flushed yet", True)]
+    # overlay ไม่อยู่ใน version -> ห้าม cache
+    assert "etag" not in r.headers
+
+    gate.set()
+    await msg.future
+    r = await client.get(f"/api/sessions/{sid}/messages")
+    assert [(m["id"], m.get("pending")) for m in r.json()["messages"]] == [(msg.id, None)]
+    assert "etag" in r.headers